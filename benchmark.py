@@ -0,0 +1,502 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmarks for the Rachio NodeServer.
+
+Runs rachio-poly.py's Controller against the local Rachio API simulator (rachio_simulator.py) and
+an in-process stand-in for Polyglot, then reports as JSON:
+  * discovery: time until all nodes for N controllers are added and started
+  * api_calls: Rachio API requests made by one longPoll and one QUERY cycle
+  * webhook_latency: time from a webhook being sent until the affected driver is published, and the API calls made meanwhile
+  * update_info_cpu: CPU time per update_info call, by node type
+  * warm_start: time and API calls for a restart that loads the snapshot saved by the first run
+  * peak_rss_kb: peak resident set size of the process
+
+Results are comparable across runs with the same arguments:
+    python3 benchmark.py --controllers 20 --output baseline.json
+    python3 benchmark.py --controllers 20 --compare baseline.json
+--compare exits with status 1 if any metric regressed by more than --tolerance.
+
+"python3 benchmark.py drivers" only measures update_info_cpu (the CPU cost of re-rendering every node's drivers
+from cached data), on nodes built straight from the simulated account without any HTTP or discovery, half of
+the controllers mid-run.  It takes seconds even for hundreds of controllers and supports --output/--compare too.
+"python3 benchmark.py memory" builds the same nodes and reports the memory they hold: RSS growth and tracemalloc's
+count of Python allocations with the largest allocation sites, each measured in a fresh process.
+
+The node server's own dependencies (rachiopy, httplib2) must be installed; only Polyglot is stubbed.
+"""
+
+import argparse
+import gc
+import importlib.util
+import json
+import logging
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+from copy import deepcopy
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+import rachio_simulator
+
+LOGGER = logging.getLogger('benchmark')
+
+
+class PolyglotStub(object):
+    """
+    Stands in for the Polyglot MQTT interface: acknowledges added nodes (starting them the way
+    polyinterface does when Polyglot confirms an addition) and timestamps every driver update.
+    """
+    def __init__(self, ackDelay=0.):
+        self.ackDelay = ackDelay
+        self.added = []
+        self.started = set()
+        self.statusCount = 0
+        self._latest = {} #(address, driver) -> (value, time published)
+        self._cond = threading.Condition()
+
+    def send(self, message):
+        if 'status' in message:
+            _status = message['status']
+            with self._cond:
+                self.statusCount += 1
+                self._latest[(_status['address'], _status['driver'])] = (str(_status['value']), time.perf_counter())
+                self._cond.notify_all()
+
+    def addNode(self, node):
+        self.added.append(node.address)
+        threading.Thread(target=self._ack, args=(node,), daemon=True).start()
+
+    def _ack(self, node):
+        if self.ackDelay:
+            time.sleep(self.ackDelay)
+        try:
+            node.start()
+        finally:
+            with self._cond:
+                self.started.add(node.address)
+                self._cond.notify_all()
+
+    def delNode(self, address):
+        pass
+
+    def installprofile(self):
+        pass
+
+    def waitFor(self, predicate, timeout):
+        with self._cond:
+            return self._cond.wait_for(predicate, timeout)
+
+    def waitForDriver(self, address, driver, value, since, timeout):
+        #Returns the time the driver was published with "value" after "since", or None on timeout
+        def _published():
+            _latest = self._latest.get((address, driver))
+            return _latest is not None and _latest[0] == str(value) and _latest[1] >= since
+        if self.waitFor(_published, timeout):
+            return self._latest[(address, driver)][1]
+        return None
+
+
+def polyinterfaceStub():
+    #Minimal polyinterface module (Node, Controller, Interface, LOGGER) backed by PolyglotStub
+    _module = types.ModuleType('polyinterface')
+    _module.LOGGER = logging.getLogger('polyinterface')
+
+    class Node(object):
+        drivers = []
+
+        def __init__(self, controller, primary, address, name):
+            self.controller = controller
+            self.parent = controller
+            self.poly = controller.poly
+            self.primary = primary
+            self.address = address
+            self.name = name
+            self.drivers = deepcopy(self.drivers)
+            self._drivers = deepcopy(self.drivers)
+            self.isPrimary = None
+            self.added = None
+
+        def setDriver(self, driver, value, report=True, force=False, uom=None):
+            for _driver in self.drivers:
+                if _driver['driver'] == driver:
+                    _driver['value'] = value
+                    if report:
+                        self.reportDriver(_driver, report, force)
+                    break
+
+        def reportDriver(self, driver, report, force):
+            for _driver in self._drivers:
+                if _driver['driver'] == driver['driver'] and (str(_driver['value']) != str(driver['value']) or force):
+                    self.poly.send({'status': {'address': self.address, 'driver': _driver['driver'], 'value': str(driver['value']), 'uom': _driver['uom']}})
+                    _driver['value'] = deepcopy(driver['value'])
+
+        def reportDrivers(self):
+            for _driver in self.drivers:
+                self.setDriver(_driver['driver'], _driver['value'], True, True)
+
+        def start(self):
+            pass
+
+    class Controller(Node):
+        def __init__(self, poly):
+            self.poly = poly
+            Node.__init__(self, self, 'controller', 'controller', 'Controller')
+            self.nodes = {self.address: self}
+            self.polyConfig = {'customParams': {}, 'customData': {}}
+
+        def saveCustomData(self, data):
+            self.polyConfig['customData'] = deepcopy(data)
+
+        def addNode(self, node, update=False):
+            self.nodes[node.address] = node
+            self.poly.addNode(node)
+            return node
+
+        def delNode(self, address):
+            if address in self.nodes:
+                del self.nodes[address]
+                self.poly.delNode(address)
+
+    _module.Node = Node
+    _module.Controller = Controller
+    _module.Interface = PolyglotStub
+    return _module
+
+
+def loadNodeServer():
+    sys.modules['polyinterface'] = polyinterfaceStub()
+    os.chdir(HERE) #rachio-poly.py reads server.json from the working directory
+    _spec = importlib.util.spec_from_file_location('rachio_poly', os.path.join(HERE, 'rachio-poly.py'))
+    _module = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(_module)
+    return _module
+
+
+def freePort():
+    _sock = socket.socket()
+    _sock.bind(('127.0.0.1', 0))
+    _port = _sock.getsockname()[1]
+    _sock.close()
+    return _port
+
+
+def percentiles(values, points=(50, 90, 95, 99)):
+    if not values:
+        return {}
+    _sorted = sorted(values)
+    _result = dict(('p%i' % p, _sorted[min(int(round(p / 100. * (len(_sorted) - 1))), len(_sorted) - 1)]) for p in points)
+    _result.update({'min': _sorted[0], 'max': _sorted[-1], 'mean': sum(_sorted) / len(_sorted), 'count': len(_sorted)})
+    return _result
+
+
+def currentRssKb():
+    #Current resident set size, from /proc where available (Linux), otherwise the peak
+    try:
+        with open('/proc/self/statm') as _file:
+            return int(_file.read().split()[1]) * resource.getpagesize() // 1024
+    except (IOError, OSError, IndexError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _round(value):
+    if isinstance(value, float):
+        return round(value, 6)
+    if isinstance(value, dict):
+        return dict((k, _round(v)) for k, v in value.items())
+    return value
+
+
+class Benchmark(object):
+    def __init__(self, args):
+        self.args = args
+        self.results = {}
+
+    def setUp(self):
+        _args = self.args
+        self.account = rachio_simulator.SimulatedAccount(_args.controllers, _args.zones, _args.schedules, _args.flex_schedules, _args.seed)
+        self.simulator = rachio_simulator.RachioSimulator(self.account, limit=10 ** 9, latency=_args.latency, timeScale=1., seed=_args.seed)
+        self.simulatorServer = rachio_simulator.startSimulator(self.simulator)
+        self.rachio = loadNodeServer()
+        os.chdir(tempfile.mkdtemp(prefix='rachio-benchmark-')) #the node server saves its snapshot in the working directory
+        self.polyglot, self.controller = self.newController()
+        self.expectedNodes = 1 + _args.controllers * (1 + _args.zones + _args.schedules + _args.flex_schedules)
+
+    def newController(self, port=None):
+        _polyglot = PolyglotStub(self.args.ack_delay)
+        _controller = self.rachio.Controller(_polyglot)
+        _controller.polyConfig = {'customParams': {'api_key': 'benchmark',
+                                                   'host': '127.0.0.1',
+                                                   'port': str(port or freePort()),
+                                                   'apiUrl': self.simulatorServer.url,
+                                                   'nodeAdditionInterval': str(self.args.node_interval),
+                                                   'cacheRefreshInterval': str(self.args.refresh_interval)}}
+        return _polyglot, _controller
+
+    def discovery(self):
+        _start = time.perf_counter()
+        self.controller.start()
+        _done = self.polyglot.waitFor(lambda: len(self.polyglot.started) >= self.expectedNodes - 1, self.args.timeout)
+        _seconds = time.perf_counter() - _start
+        self.waitForWebhookSummary(self.controller)
+        self.results['discovery'] = {'seconds': _seconds, 'nodes': len(self.polyglot.started) + 1, 'expected_nodes': self.expectedNodes, 'completed': bool(_done),
+                                     'api_calls': self.simulator.stats()['totalRequests']}
+
+    def apiCalls(self):
+        _calls = {}
+        for _name, _cycle in (('longPoll', self.controller.longPoll), ('query', self.controller.query)):
+            time.sleep(self.args.refresh_interval + 0.1) #let the previous cycle's refreshes age past cacheRefreshInterval
+            self.simulator.resetStats()
+            _cycle()
+            _stats = self.simulator.stats()
+            _calls[_name] = {'total': _stats['totalRequests'], 'by_endpoint': _stats['requests']}
+        self.results['api_calls'] = _calls
+
+    def webhookLatency(self):
+        #Starts and stops zones on the simulator and times how long until the zone's ST driver is published
+        _zones = [(d['id'], z) for d in self.account.devices.values() for z in d['zones']]
+        _latencies = []
+        _timeouts = 0
+        self.simulator.resetStats()
+        for i in range(self.args.webhooks):
+            _device_id, _zone = _zones[(i * 7919) % len(_zones)]
+            _address = self.controller.registry.zones[_zone['id']].address
+            for _expected in (100, 0):
+                time.sleep(self.args.refresh_interval + 0.05) #keep consecutive events further apart than cacheRefreshInterval
+                _sent = time.perf_counter()
+                with self.account.lock:
+                    if _expected:
+                        self.simulator.startRun(_device_id, _zone, 3600, 'MANUAL')
+                    else:
+                        self.simulator._finishRun(_device_id, 'ZONE_STOPPED')
+                _published = self.polyglot.waitForDriver(_address, 'ST', _expected, _sent, self.args.webhook_timeout)
+                if _published is None:
+                    _timeouts += 1
+                else:
+                    _latencies.append((_published - _sent) * 1000.)
+        self.results['webhook_latency_ms'] = percentiles(_latencies)
+        self.results['webhook_latency_ms']['timeouts'] = _timeouts
+        self.results['webhook_latency_ms']['api_calls'] = self.simulator.stats()['totalRequests']
+
+    def updateInfoCpu(self):
+        #CPU time of update_info from cached data (no API requests), per node type
+        _samples = {}
+        _nodes = [n for n in list(self.controller.nodes.values()) if n is not self.controller]
+        for _round_ in range(self.args.update_rounds):
+            for _node in _nodes:
+                _start = time.thread_time()
+                _node.update_info(force=False, queryAPI=False)
+                _samples.setdefault(_node.id, []).append((time.thread_time() - _start) * 1e6)
+        self.results['update_info_cpu_us'] = dict((k, percentiles(v, (50, 95))) for k, v in _samples.items())
+
+    def warmStart(self):
+        #Restarts the node server against the snapshot the first run saved: time until every node is started with its saved values,
+        #and API calls until the background reconciliation (which finishes with the webhook check) is done
+        for _account in self.controller.accounts:
+            _account.snapshotStore.save()
+        self.controller.webSocketServer.shutdown()
+        self.controller.webSocketServer.server_close()
+        _polyglot, _controller = self.newController(self.controller.polyConfig['customParams']['port']) #same webhook URL as before the restart
+        self.simulator.resetStats()
+        _start = time.perf_counter()
+        _controller.start()
+        _done = _polyglot.waitFor(lambda: len(_polyglot.started) >= self.expectedNodes - 1, self.args.timeout)
+        _seconds = time.perf_counter() - _start
+        self.results['warm_start'] = {'seconds': _seconds, 'nodes': len(_polyglot.started) + 1, 'completed': bool(_done),
+                                      'reconciled': self.waitForWebhookSummary(_controller), 'api_calls': self.simulator.stats()['totalRequests'], 'by_endpoint': self.simulator.stats()['requests']}
+
+    def waitForWebhookSummary(self, controller):
+        #Webhook registrations are checked in the background after nodes are queued, wait for them so their API calls are counted
+        _deadline = time.time() + self.args.timeout
+        while len(controller.webhookSummary) < len(controller.accounts) and time.time() < _deadline:
+            time.sleep(0.05)
+        return len(controller.webhookSummary) >= len(controller.accounts)
+
+    def setUpNodes(self):
+        _args = self.args
+        self.account = rachio_simulator.SimulatedAccount(_args.controllers, _args.zones, _args.schedules, _args.flex_schedules, _args.seed)
+        self.rachio = loadNodeServer()
+        self.polyglot = PolyglotStub()
+        self.controller = self.rachio.Controller(self.polyglot)
+
+    def buildNodes(self):
+        #Controller, zone and schedule nodes for every simulated device, registered the way discovery would but without Polyglot or the API
+        _now = time.time()
+        for _i, _device in enumerate(self.account.devices.values()):
+            _address = _device['macAddress'].lower()
+            _payload = json.loads(json.dumps(_device)) #new objects throughout, as parsed from an API response
+            _node = self.rachio.RachioController(self.controller, _address, _address, _device['name'], _payload)
+            _schedule = {}
+            if _i % 2 == 0 and _device['zones']:
+                _zone = _device['zones'][_i % len(_device['zones'])]
+                _schedule = {'type': 'MANUAL', 'status': 'PROCESSING', 'deviceId': _device['id'], 'startDate': int((_now - 120) * 1000), 'duration': 600,
+                             'zoneId': _zone['id'], 'zoneNumber': _zone['zoneNumber'], 'cycling': False, 'cycleCount': 1, 'totalCycleCount': 1}
+            _node.cache.update(_node.device, _schedule)
+            _node.discoverComplete = True
+            self.controller.nodes[_address] = _node
+            self.controller.registry.register(_node)
+            for _childAddress, (_class, _id, _name, _payload) in _node.desiredChildren().items():
+                _child = _class(self.controller, _address, _childAddress, _name, _payload, _device['id'], _node)
+                self.controller.nodes[_childAddress] = _child
+                self.controller.registry.register(_child)
+
+    def runDrivers(self):
+        self.setUpNodes()
+        self.buildNodes()
+        self.updateInfoCpu()
+        return {'meta': self.meta(), 'results': _round(self.results)}
+
+    def runMemory(self):
+        #Each measurement runs in its own process: tracemalloc's bookkeeping would inflate the RSS figures, and RSS never shrinks back
+        _args = self.args
+        self.rachio = loadNodeServer() #for the version in meta()
+        _command = [sys.executable, os.path.abspath(__file__), 'memory', '--controllers', str(_args.controllers), '--zones', str(_args.zones),
+                    '--schedules', str(_args.schedules), '--flex-schedules', str(_args.flex_schedules), '--update-rounds', str(_args.update_rounds),
+                    '--seed', str(_args.seed)]
+        _memory = {}
+        for _measure in ('rss', 'tracemalloc'):
+            _memory.update(json.loads(subprocess.check_output(_command + ['--measure', _measure], cwd=HERE).decode('utf-8')))
+        self.results['memory'] = _memory
+        return {'meta': self.meta(), 'results': _round(self.results)}
+
+    def measureMemory(self, measure):
+        #Memory held once every node is built from its device payload and has run update_info, excluding the simulated account itself.
+        #"rss": growth of the resident set size, "tracemalloc": memory allocated by Python objects, with the largest allocation sites
+        self.setUpNodes()
+        gc.collect()
+        if measure == 'tracemalloc':
+            tracemalloc.start()
+        _rss = currentRssKb()
+        self.buildNodes()
+        _nodes = [n for n in list(self.controller.nodes.values()) if n is not self.controller]
+        for _round_ in range(self.args.update_rounds):
+            for _node in _nodes:
+                _node.update_info(force=False, queryAPI=False)
+        self.polyglot._latest.clear() #driver updates "sent" to the Polyglot stub aren't the node server's memory
+        gc.collect()
+        if measure != 'tracemalloc':
+            return {'nodes': len(_nodes), 'rss_kb': currentRssKb() - _rss}
+        _current, _peak = tracemalloc.get_traced_memory()
+        _top = tracemalloc.take_snapshot().statistics('lineno')[:10]
+        tracemalloc.stop()
+        return {'traced_kb': _current / 1024., 'traced_peak_kb': _peak / 1024., 'bytes_per_node': _current / float(len(_nodes)),
+                'top_kb': dict(('%s:%i' % (os.path.basename(_stat.traceback[0].filename), _stat.traceback[0].lineno), round(_stat.size / 1024., 1)) for _stat in _top)}
+
+    def run(self):
+        self.setUp()
+        self.discovery()
+        self.apiCalls()
+        self.webhookLatency()
+        self.updateInfoCpu()
+        self.warmStart()
+        self.results['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.results['driver_updates_published'] = self.polyglot.statusCount
+        return {'meta': self.meta(), 'results': _round(self.results)}
+
+    def meta(self):
+        try:
+            _commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, stderr=subprocess.DEVNULL).decode().strip()
+        except Exception:
+            _commit = None
+        _args = dict(vars(self.args))
+        for _key in ('output', 'compare', 'tolerance', 'debug'):
+            _args.pop(_key, None)
+        return {'version': self.rachio.VERSION, 'commit': _commit, 'python': platform.python_version(), 'platform': platform.platform(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'args': _args}
+
+
+# Metrics compared by --compare, all "lower is better"
+COMPARED_METRICS = [('discovery', 'seconds'), ('discovery', 'api_calls'), ('api_calls', 'longPoll', 'total'), ('api_calls', 'query', 'total'),
+                    ('webhook_latency_ms', 'p50'), ('webhook_latency_ms', 'p95'), ('webhook_latency_ms', 'timeouts'), ('webhook_latency_ms', 'api_calls'),
+                    ('warm_start', 'seconds'), ('warm_start', 'api_calls'), ('peak_rss_kb',), ('memory', 'rss_kb'), ('memory', 'traced_kb')]
+
+
+def _lookup(results, path):
+    for _key in path:
+        if not isinstance(results, dict) or _key not in results:
+            return None
+        results = results[_key]
+    return results
+
+
+def compare(baseline, current, tolerance):
+    #Prints each metric against the baseline and returns the list of regressions
+    _regressions = []
+    if baseline['meta'].get('args') != current['meta'].get('args'):
+        print('WARNING: benchmark arguments differ from the baseline, results may not be comparable')
+    _paths = list(COMPARED_METRICS)
+    for _type in sorted(set(current['results'].get('update_info_cpu_us', {})) | set(baseline['results'].get('update_info_cpu_us', {}))):
+        _paths.append(('update_info_cpu_us', _type, 'p50'))
+    for _path in _paths:
+        _old = _lookup(baseline['results'], _path)
+        _new = _lookup(current['results'], _path)
+        if _old is None or _new is None:
+            continue
+        _change = (_new - _old) / float(_old) if _old else (0. if _new == _old else float('inf'))
+        _flag = ''
+        if _change > tolerance and _new - _old > 1e-9:
+            _flag = '  REGRESSION'
+            _regressions.append('.'.join(_path))
+        print('%-40s %14.3f -> %14.3f  (%+.1f%%)%s' % ('.'.join(_path), _old, _new, _change * 100., _flag))
+    return _regressions
+
+
+def main():
+    _parser = argparse.ArgumentParser(description='End-to-end benchmarks for the Rachio NodeServer')
+    _parser.add_argument('mode', nargs='?', choices=['all', 'drivers', 'memory'], default='all',
+                         help='"drivers" only measures update_info CPU time and "memory" the memory held by the nodes, without HTTP or discovery')
+    _parser.add_argument('--controllers', type=int, default=10)
+    _parser.add_argument('--zones', type=int, default=16)
+    _parser.add_argument('--schedules', type=int, default=2)
+    _parser.add_argument('--flex-schedules', type=int, default=1)
+    _parser.add_argument('--latency', type=float, default=0.02, help='simulated Rachio API latency in seconds')
+    _parser.add_argument('--node-interval', type=float, default=0., help='nodeAdditionInterval custom parameter')
+    _parser.add_argument('--ack-delay', type=float, default=0., help='seconds before the Polyglot stub acknowledges an added node')
+    _parser.add_argument('--refresh-interval', type=float, default=1., help='cacheRefreshInterval custom parameter')
+    _parser.add_argument('--webhooks', type=int, default=20, help='zone start/stop pairs used to measure webhook latency')
+    _parser.add_argument('--webhook-timeout', type=float, default=10.)
+    _parser.add_argument('--update-rounds', type=int, default=5, help='update_info calls per node for the CPU measurement')
+    _parser.add_argument('--timeout', type=float, default=600., help='seconds to wait for discovery to complete')
+    _parser.add_argument('--seed', type=int, default=1)
+    _parser.add_argument('--output', help='write the JSON results to this file')
+    _parser.add_argument('--compare', help='compare against a previous JSON results file')
+    _parser.add_argument('--tolerance', type=float, default=0.2, help='relative increase reported as a regression by --compare')
+    _parser.add_argument('--debug', action='store_true')
+    _parser.add_argument('--measure', choices=['rss', 'tracemalloc'], help=argparse.SUPPRESS) #set on the processes "memory" runs
+    _args = _parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if _args.debug else logging.ERROR, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    _benchmark = Benchmark(_args)
+    if _args.measure:
+        print(json.dumps(_benchmark.measureMemory(_args.measure)))
+        os._exit(0)
+    if _args.mode == 'memory':
+        _report = _benchmark.runMemory()
+    elif _args.mode == 'drivers':
+        _report = _benchmark.runDrivers()
+    else:
+        _report = _benchmark.run()
+    _text = json.dumps(_report, indent=2, sort_keys=True)
+    print(_text)
+    if _args.output:
+        with open(_args.output, 'w') as _file:
+            _file.write(_text + '\n')
+    if _args.compare:
+        with open(_args.compare) as _file:
+            _regressions = compare(json.load(_file), _report, _args.tolerance)
+        if _regressions:
+            print('Regressions: ' + ', '.join(_regressions))
+            os._exit(1)
+    os._exit(0) #node server threads (timers, HTTP servers, pools) are not meant to be stopped
+
+
+if __name__ == '__main__':
+    main()
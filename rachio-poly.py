@@ -11,16 +11,115 @@ from copy import deepcopy
 import json, time
 from datetime import datetime
 from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import queue
+import random
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import httplib2
 import re
 from threading import Timer #Added version 2.2.0 for node addition queue
 import threading
 from rachiopy import Rachio
- 
-LOGGER = polyinterface.LOGGER
+from email.utils import parsedate_to_datetime
+import http.client
+import ssl
+import select
+from urllib.parse import urlsplit
+import os
+import gzip
+import hashlib
+import ipaddress
+import contextlib
+import functools
+import logging
+import rachio_drivers
+
+
+class ThrottledLogger(object):
+    """
+    Logging layer for the node server (LOGGER), in front of polyinterface's logger.
+
+    Messages are %-formatted lazily by the logging module, so pass values as arguments rather than str()-ing them.
+    Debug and info messages pass straight through.  Warnings and errors are deduplicated by message template and
+    arguments: the first occurrence is logged, repeats of the same message within "interval" seconds are only counted
+    (so an API outage doesn't log the same error for the same node on every cycle), and the count is logged once the
+    interval is over, either on the next occurrence or from flush(), which longPoll calls.  Messages logged with
+    throttle=False (e.g. command failures) are never held back.
+    """
+    _STACKLEVEL = sys.version_info >= (3, 8) #records report the node server's function that logged, not this class's
+
+    def __init__(self, logger, interval=300.):
+        self._logger = logger
+        self.interval = interval
+        self.suppressed = 0
+        self._seen = {} #(level, template, formatted arguments) -> [window start, repeats, last arguments]
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self._logger, name)
+
+    def _caller(self, depth, kwargs={}):
+        #Keyword arguments for logger.log() with the stack level "depth" frames above the method calling it
+        return dict(kwargs, stacklevel=depth + 1) if self._STACKLEVEL else dict(kwargs)
+
+    def debug(self, msg, *args, **kwargs):
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.log(logging.DEBUG, msg, *args, **self._caller(1, kwargs))
+
+    def info(self, msg, *args, **kwargs):
+        if self._logger.isEnabledFor(logging.INFO):
+            self._logger.log(logging.INFO, msg, *args, **self._caller(1, kwargs))
+
+    def warning(self, msg, *args, **kwargs):
+        self._throttled(logging.WARNING, msg, args, kwargs)
+
+    def error(self, msg, *args, **kwargs):
+        self._throttled(logging.ERROR, msg, args, kwargs)
+
+    def _throttled(self, level, msg, args, kwargs):
+        if not self._logger.isEnabledFor(level):
+            return
+        if not kwargs.pop('throttle', True):
+            self._logger.log(level, msg, *args, **self._caller(2, kwargs))
+            return
+        _now = time.time()
+        _key = (level, msg, tuple(str(a) for a in args))
+        with self._lock:
+            _entry = self._seen.get(_key)
+            if _entry is not None and _now - _entry[0] < self.interval:
+                _entry[1] += 1
+                _entry[2] = args
+                self.suppressed += 1
+                return
+            self._seen[_key] = [_now, 0, None]
+        if _entry is not None and _entry[1]:
+            self._repeated(level, msg, _entry, 3)
+        self._logger.log(level, msg, *args, **self._caller(2, kwargs))
+
+    def _repeated(self, level, msg, entry, depth):
+        self._logger.log(level, 'Repeated %i more time(s) within %i seconds: ' + msg, entry[1], int(self.interval), *entry[2], **self._caller(depth))
+
+    def flush(self):
+        #Logs the repeat counts of messages whose interval is over
+        _now = time.time()
+        with self._lock:
+            _expired = [(k, v) for k, v in self._seen.items() if _now - v[0] >= self.interval]
+            for _key, _entry in _expired:
+                del self._seen[_key]
+        for (_level, _msg, _args), _entry in _expired:
+            if _entry[1]:
+                self._repeated(_level, _msg, _entry, 2)
+        return len(_expired)
+
+
+LOGGER = ThrottledLogger(polyinterface.LOGGER)
 SERVERDATA = json.load(open('server.json'))
 VERSION = SERVERDATA['credits'][0]['version']
 _HTTP = httplib2.Http()
+RACHIO_API_URL = 'https://api.rach.io/1/public'
+SNAPSHOT_FILE = 'rachio_snapshot.json.gz' #Written to the node server's working directory
+PROFILE_VERSION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profile', 'version.txt')
 WS_EVENT_TYPES = {
         "DEVICE_STATUS_EVENT": 5,
         "RAIN_DELAY_EVENT": 6,
@@ -32,6 +131,1162 @@ WS_EVENT_TYPES = {
         "ZONE_DELTA": 12,
         "DELTA": 14
     }
+#Nodes affected by each webhook event type.  "zone"/"schedule" route to the node the event names, "zones"/"schedules" to every node of that kind on the device
+WS_EVENT_ROUTES = {
+        "DEVICE_STATUS_EVENT": ('controller',),
+        "RAIN_DELAY_EVENT": ('controller', 'schedules'),
+        "WEATHER_INTELLIGENCE_EVENT": ('controller', 'schedules'),
+        "WATER_BUDGET": ('schedules',),
+        "SCHEDULE_STATUS_EVENT": ('controller', 'schedule'),
+        "ZONE_STATUS_EVENT": ('controller', 'zone'),
+        "RAIN_SENSOR_DETECTION_EVENT": ('controller',),
+        "ZONE_DELTA": ('zone',),
+        "DELTA": ('controller', 'zones', 'schedules')
+    }
+#DeviceSnapshotCache method that applies each webhook event type's payload to the cached snapshot without an API request.  Other types refresh from the API
+WS_EVENT_REDUCERS = {
+        "DEVICE_STATUS_EVENT": 'reduceDeviceStatus',
+        "RAIN_DELAY_EVENT": 'reduceRainDelay',
+        "SCHEDULE_STATUS_EVENT": 'reduceScheduleStatus',
+        "ZONE_STATUS_EVENT": 'reduceZoneStatus'
+    }
+
+class RachioSession(object):
+    """
+    Thread-safe pool of keep-alive HTTP(S) connections used as the transport for the rachiopy client.
+
+    rachiopy sends every request through one module-level httplib2.Http shared by all threads,
+    which is the likely source of the SSL WRONG_VERSION_NUMBER errors that prompted the old
+    "try twice" loops.  Here each request checks a connection out of the pool, idle connections
+    are health checked (and discarded after maxIdle seconds) before reuse, and a request that
+    fails on a reused connection the server already closed is retried once on a fresh one.
+    """
+    _ID_PATTERN = re.compile('[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}')
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.) #Upper bounds (seconds) of the request latency histogram buckets
+
+    def __init__(self, baseUrl=RACHIO_API_URL, connectTimeout=10, readTimeout=30, maxIdle=60, poolSize=8):
+        _url = urlsplit(baseUrl)
+        self._https = (_url.scheme == 'https')
+        self._host = _url.hostname
+        self._port = _url.port
+        self._basePath = _url.path.rstrip('/')
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+        self.maxIdle = maxIdle
+        self.poolSize = poolSize
+        self._headers = {'Content-Type': 'application/json'}
+        self._idle = [] #(connection, time returned to the pool)
+        self._lock = threading.Lock()
+        self._sslContext = ssl.create_default_context() if self._https else None
+        self.requests = 0
+        self.errors = 0
+        self.reconnects = 0
+        self.latency = {} #endpoint -> [count, total seconds, max seconds]
+        self.histogram = {} #endpoint -> request count per LATENCY_BUCKETS bucket, plus one for slower requests
+        self.results = {} #(endpoint, HTTP status or "error") -> request count
+
+    def attach(self, client, api_key):
+        #Routes all requests made by a rachiopy client through this session
+        self._headers = {'Content-Type': 'application/json', 'Authorization': 'Bearer %s' % api_key}
+        client._request = self.request
+        return client
+
+    def endpoint(self, method, path):
+        #Request label with Rachio ids removed, e.g. "GET device/{id}/current_schedule"
+        return method + ' ' + self._ID_PATTERN.sub('{id}', path)
+
+    def _connect(self):
+        if self._https:
+            _conn = http.client.HTTPSConnection(self._host, self._port, timeout=self.connectTimeout, context=self._sslContext)
+        else:
+            _conn = http.client.HTTPConnection(self._host, self._port, timeout=self.connectTimeout)
+        try:
+            _conn.connect()
+        except Exception:
+            _conn.close()
+            raise
+        _conn.sock.settimeout(self.readTimeout)
+        return _conn
+
+    def _healthy(self, conn, idleSince):
+        #An idle keep-alive socket should have nothing to read; if it does, the server closed it (or sent something unexpected)
+        if conn.sock is None or time.time() - idleSince > self.maxIdle:
+            return False
+        try:
+            return not select.select([conn.sock], [], [], 0)[0]
+        except Exception:
+            return False
+
+    def _acquire(self):
+        with self._lock:
+            while self._idle:
+                _conn, _idleSince = self._idle.pop()
+                if self._healthy(_conn, _idleSince):
+                    return _conn, True
+                _conn.close()
+        return self._connect(), False
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.poolSize:
+                self._idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def _recordLatency(self, endpoint, seconds, status):
+        with self._lock:
+            self.requests += 1
+            _stats = self.latency.setdefault(endpoint, [0, 0., 0.])
+            _stats[0] += 1
+            _stats[1] += seconds
+            _stats[2] = max(_stats[2], seconds)
+            _buckets = self.histogram.setdefault(endpoint, [0] * (len(self.LATENCY_BUCKETS) + 1))
+            _bucket = 0
+            while _bucket < len(self.LATENCY_BUCKETS) and seconds > self.LATENCY_BUCKETS[_bucket]:
+                _bucket += 1
+            _buckets[_bucket] += 1
+            self.results[(endpoint, str(status))] = self.results.get((endpoint, str(status)), 0) + 1
+
+    def _recordError(self, endpoint):
+        with self._lock:
+            self.errors += 1
+            self.results[(endpoint, 'error')] = self.results.get((endpoint, 'error'), 0) + 1
+
+    def request(self, path, method, body=None):
+        #Same contract as rachiopy's Rachio._request: returns (headers, content) with lower-case header names, a "status" entry and JSON content decoded
+        _url = self._basePath + '/' + path
+        _endpoint = self.endpoint(method, path)
+        for _attempt in range(2):
+            _conn, _reused = None, False
+            try:
+                _conn, _reused = self._acquire() #opens a new connection if none is idle, so connect failures (refused, DNS, timeout) are counted as errors too
+                _start = time.time()
+                _conn.request(method, _url, body=body, headers=self._headers)
+                _resp = _conn.getresponse()
+                _content = _resp.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                if _conn is not None:
+                    _conn.close()
+                if _reused and _attempt == 0:
+                    with self._lock:
+                        self.reconnects += 1
+                    continue
+                self._recordError(_endpoint)
+                raise
+            except Exception:
+                if _conn is not None:
+                    _conn.close()
+                self._recordError(_endpoint)
+                raise
+            self._recordLatency(_endpoint, time.time() - _start, _resp.status)
+            if _resp.will_close:
+                _conn.close()
+            else:
+                self._release(_conn)
+            _headers = dict((k.lower(), v) for k, v in _resp.getheaders())
+            _headers['status'] = str(_resp.status)
+            if _headers.get('content-type', '').startswith('application/json') and _content:
+                _content = json.loads(_content.decode('UTF-8'))
+            return _headers, _content
+
+    def counters(self):
+        #Copies of the raw counters for /metrics: ({(endpoint, result): count}, {endpoint: (bucket counts, total seconds)}, reconnects)
+        with self._lock:
+            return dict(self.results), dict((k, (list(v), self.latency[k][1])) for k, v in self.histogram.items()), self.reconnects
+
+    def stats(self):
+        with self._lock:
+            _latency = dict((k, {'count': v[0], 'avg': round(v[1] / v[0], 3), 'max': round(v[2], 3)}) for k, v in self.latency.items())
+            return {'requests': self.requests, 'errors': self.errors, 'reconnects': self.reconnects, 'idle': len(self._idle), 'latency': _latency}
+
+
+class RateLimitReserved(Exception):
+    #Raised instead of making a non-command API request when only the reserved budget remains
+    pass
+
+
+class RachioApiError(IOError):
+    #Raised by RateLimitGovernor.get when the Rachio API answers with an error (429, 5xx, ...) instead of the requested data
+    pass
+
+
+class RateLimitGovernor(object):
+    """
+    Central gate for every Rachio API request, driven by the x-ratelimit-* response headers.
+
+    Once the remaining budget falls to "reserve", only user commands (start, stop, rain delay,
+    enable/disable, ...) are sent until the budget resets.  Refresh TTLs are stretched by
+    ttlFactor() whenever the budget is being spent faster than the reset window elapses.
+    """
+    WINDOW = 86400 #Rachio's rate limit window is one day
+    MAX_TTL_FACTOR = 60.
+
+    def __init__(self, reserve=100):
+        self.reserve = reserve
+        self.limit = None
+        self.remaining = None
+        self.reset = None #epoch seconds at which the budget resets
+        self.deferred = 0
+        self.clockOffset = 0. #Rachio's clock minus the local one, from the Date header of the last response
+        self._lock = threading.Lock()
+
+    def call(self, endpoint, func, *args, command=False):
+        #Makes the request through "func" unless it is a non-command and only the reserve is left.  "endpoint" labels the request in logs
+        if not command and not self.allowRefresh():
+            with self._lock:
+                self.deferred += 1
+            raise RateLimitReserved('Rachio API budget down to %s request(s), reserved for commands until %s; skipping %s' % (str(self.remaining), self.resetText(), endpoint))
+        with PROFILER.span('api.' + endpoint):
+            _resp = func(*args)
+        self.record(_resp[0])
+        return _resp
+
+    def get(self, endpoint, func, *args):
+        #call() for requests whose content is used as data: an error response raises RachioApiError rather than being returned in place of the data
+        _resp = self.call(endpoint, func, *args)
+        _status = int(_resp[0].get('status', 200))
+        if not 200 <= _status < 300:
+            raise RachioApiError('Rachio API returned HTTP status %s for %s' % (str(_status), endpoint))
+        return _resp
+
+    def record(self, headers):
+        try:
+            with self._lock:
+                if 'x-ratelimit-remaining' in headers:
+                    self.remaining = int(headers['x-ratelimit-remaining'])
+                if 'x-ratelimit-limit' in headers:
+                    self.limit = int(headers['x-ratelimit-limit'])
+                if 'x-ratelimit-reset' in headers:
+                    self.reset = parsedate_to_datetime(headers['x-ratelimit-reset']).timestamp()
+                if 'date' in headers:
+                    #Whole seconds, received after the fact, so the offset errs low: events are compared against a slightly early fetch time rather than dropped
+                    self.clockOffset = parsedate_to_datetime(headers['date']).timestamp() - time.time()
+        except Exception as ex:
+            LOGGER.debug('Unable to parse Rachio rate limit headers: %s', ex)
+
+    def serverTime(self, localTime):
+        #Converts a local epoch time to Rachio's clock, which webhook event times are on
+        return localTime + self.clockOffset
+
+    def _budgetRenewed(self):
+        return self.reset is not None and time.time() >= self.reset
+
+    def allowRefresh(self):
+        if self.remaining is None or self._budgetRenewed():
+            return True
+        return self.remaining > self.reserve
+
+    def ttlFactor(self):
+        #1 while the budget left (above the reserve) keeps pace with the time left in the window, growing as it falls behind
+        if self.remaining is None or self.limit is None or self.reset is None or self._budgetRenewed():
+            return 1.
+        _usable = float(self.limit - self.reserve)
+        if _usable <= 0:
+            return 1.
+        _budgetFraction = (self.remaining - self.reserve) / _usable
+        _timeFraction = min(max(self.reset - time.time(), 0) / self.WINDOW, 1.)
+        if _budgetFraction <= 0:
+            return self.MAX_TTL_FACTOR
+        return min(max(_timeFraction / _budgetFraction, 1.), self.MAX_TTL_FACTOR)
+
+    def resetText(self):
+        if self.reset is None:
+            return 'unknown'
+        return datetime.fromtimestamp(self.reset).strftime('%Y-%m-%d %H:%M:%S')
+
+    def stats(self):
+        return {'remaining': self.remaining, 'limit': self.limit, 'reset': self.resetText(), 'reserve': self.reserve, 'deferred': self.deferred, 'ttlFactor': round(self.ttlFactor(), 2)}
+
+
+class CommandRejected(Exception):
+    #Raised when the Rachio API refuses a command outright, retrying would not help
+    pass
+
+
+class CommandExecutor(object):
+    """
+    Runs ISY commands against the Rachio API off the Polyglot command thread.
+
+    Commands for one device run one at a time in the order received while different devices
+    run in parallel.  Failures are retried with jittered exponential backoff, and a command
+    identical to one submitted less than dedupeWindow seconds earlier is dropped.
+    onStatus(device_id, status) is called with PENDING, SUCCEEDED or FAILED as commands progress.
+    """
+    PENDING = 1
+    SUCCEEDED = 2
+    FAILED = 3
+
+    def __init__(self, workers=4, retries=3, backoff=1., dedupeWindow=2., onStatus=None):
+        self.retries = retries
+        self.backoff = backoff
+        self.dedupeWindow = dedupeWindow
+        self._onStatus = onStatus
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._queues = {} #device id -> deque of (description, func)
+        self._recent = {} #command key -> time submitted
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.collapsed = 0
+        self.retried = 0
+        self.succeeded = 0
+        self.failed = 0
+
+    def submit(self, device_id, key, description, func):
+        #Queues func() to run for device_id.  Returns False if it duplicates a command submitted within the dedupe window
+        _now = time.time()
+        with self._lock:
+            for _key, _submitted in list(self._recent.items()):
+                if _now - _submitted >= self.dedupeWindow:
+                    del self._recent[_key]
+            if key in self._recent:
+                self.collapsed += 1
+                LOGGER.info('Ignoring duplicate command: %s', description)
+                return False
+            self._recent[key] = _now
+            self.submitted += 1
+            _start = device_id not in self._queues
+            self._queues.setdefault(device_id, deque()).append((description, func))
+        self._status(device_id, self.PENDING)
+        if _start:
+            self._pool.submit(self._drain, device_id)
+        return True
+
+    def _drain(self, device_id):
+        while True:
+            with self._lock:
+                _queue = self._queues[device_id]
+                if not _queue:
+                    del self._queues[device_id]
+                    return
+                _description, _func = _queue.popleft()
+            _success = self._run(_description, _func)
+            with self._lock:
+                if _success:
+                    self.succeeded += 1
+                else:
+                    self.failed += 1
+            self._status(device_id, self.SUCCEEDED if _success else self.FAILED)
+
+    def _run(self, description, func):
+        for _attempt in range(self.retries + 1):
+            try:
+                func()
+                return True
+            except CommandRejected as ex:
+                LOGGER.error('%s failed: %s', description, ex, throttle=False)
+                return False
+            except Exception as ex:
+                if _attempt >= self.retries:
+                    LOGGER.error('%s failed after %i attempt(s): %s', description, _attempt + 1, ex, throttle=False)
+                    return False
+                _delay = self.backoff * (2 ** _attempt) * random.uniform(0.5, 1.5)
+                LOGGER.warning('%s failed, retrying in %.1f second(s): %s', description, _delay, ex, throttle=False)
+                with self._lock:
+                    self.retried += 1
+                time.sleep(_delay)
+
+    def _status(self, device_id, status):
+        if self._onStatus is not None:
+            try:
+                self._onStatus(device_id, status)
+            except Exception as ex:
+                LOGGER.error('Error reporting command status for device %s: %s', device_id, ex)
+
+    def stats(self):
+        with self._lock:
+            return {'queued': sum(len(q) for q in self._queues.values()), 'submitted': self.submitted, 'collapsed': self.collapsed, 'retried': self.retried, 'succeeded': self.succeeded, 'failed': self.failed}
+
+
+class WebhookQueue(object):
+    """
+    Bounded queue of parsed webhook events drained by a pool of worker threads.
+
+    The HTTP handler only enqueues and acknowledges, so a slow Rachio API response while
+    processing one event never delays accepting the next.  When the queue is full the
+    event is dropped and counted; the next refresh of that device picks up the change.
+    """
+    def __init__(self, handler, workers=4, maxSize=200):
+        self._handler = handler
+        self._queue = queue.Queue(maxsize=maxSize)
+        self._lock = threading.Lock()
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        for i in range(workers):
+            threading.Thread(target=self._worker, name='webhook-worker-' + str(i), daemon=True).start()
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait(event)
+            with self._lock:
+                self.received += 1
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def _worker(self):
+        while True:
+            _event = self._queue.get()
+            try:
+                self._handler(_event)
+                with self._lock:
+                    self.processed += 1
+            except Exception as ex:
+                with self._lock:
+                    self.errors += 1
+                LOGGER.error('Error processing webhook event: %s', ex)
+            finally:
+                self._queue.task_done()
+
+    def stats(self):
+        return {'depth': self.depth(), 'received': self.received, 'processed': self.processed, 'dropped': self.dropped, 'errors': self.errors}
+
+
+class WebhookHTTPServer(ThreadingMixIn, HTTPServer):
+    #Handles each request on its own thread so webhooks from many controllers are accepted in parallel
+    daemon_threads = True
+
+
+class WebhookCoalescer(object):
+    """
+    Merges the bursts of webhook events Rachio sends for one device (zone, schedule and delta events within a
+    second or two of each other) into a single refresh.
+
+    The first event for a device opens a window of "window" seconds; events arriving before it closes are
+    added to it.  When it closes, flush(device_id, events, since) is called once on a timer thread with all
+    of the window's events and the arrival time of the last one.  A window of 0 flushes every event straight
+    away.  received/merged/refreshes count events received, events folded into an already open window, and
+    flushes issued.
+    """
+    def __init__(self, flush, window=1.):
+        self._flush = flush
+        self.window = window
+        self._pending = {} #device id -> [events, arrival time of the latest event]
+        self._lock = threading.Lock()
+        self.received = 0
+        self.merged = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    def add(self, device_id, event, received):
+        with self._lock:
+            self.received += 1
+            _entry = self._pending.get(device_id)
+            if _entry is not None:
+                _entry[0].append(event)
+                _entry[1] = received
+                self.merged += 1
+                return False
+            if self.window > 0:
+                self._pending[device_id] = [[event], received]
+                _timer = Timer(self.window, self._close, [device_id])
+                _timer.daemon = True
+                _timer.start()
+                return True
+        self._run(device_id, [event], received)
+        return True
+
+    def _close(self, device_id):
+        with self._lock:
+            _events, _since = self._pending.pop(device_id)
+        self._run(device_id, _events, _since)
+
+    def _run(self, device_id, events, since):
+        try:
+            self._flush(device_id, events, since)
+            with self._lock:
+                self.refreshes += 1
+        except Exception as ex:
+            with self._lock:
+                self.errors += 1
+            LOGGER.error('Error processing %i webhook event(s) for device %s: %s', len(events), device_id, ex)
+
+    def stats(self):
+        with self._lock:
+            return {'received': self.received, 'merged': self.merged, 'refreshes': self.refreshes, 'errors': self.errors, 'open': len(self._pending)}
+
+
+class NodeAdditionQueue(object):
+    """
+    Adds queued nodes to Polyglot in batches from a single worker thread.
+
+    Primary nodes are sent ahead of child nodes, and a child is held back while its primary is
+    still queued or awaiting acknowledgement.  Polyglot acknowledges an added node by starting it
+    (see RachioNode.start), and each batch waits for those acknowledgements rather than a fixed
+    sleep: the batch size doubles (up to maxBatch) while a batch is acknowledged within ackTarget
+    seconds and halves when it is not, so a busy Polyglot/ISY is never handed more than it keeps up
+    with.  interval is the minimum time between the start of two batches.  Nodes not acknowledged
+    within ackTimeout are counted as failed (and moved back to added if Polyglot acknowledges them
+    later).  onProgress(stats) is called after every batch.
+    """
+    def __init__(self, addNode, interval=1., maxBatch=32, ackTarget=2., ackTimeout=30., onProgress=None):
+        self._addNode = addNode
+        self.interval = interval
+        self.maxBatch = maxBatch
+        self.ackTarget = ackTarget
+        self.ackTimeout = ackTimeout
+        self._onProgress = onProgress
+        self._primaries = {} #address -> node, insertion ordered
+        self._children = {}
+        self._inFlight = set()
+        self._failed = set()
+        self._cond = threading.Condition()
+        self.batchSize = 1
+        self.added = 0
+        self.batches = 0
+        threading.Thread(target=self._worker, name='node-addition', daemon=True).start()
+
+    def put(self, node):
+        with self._cond:
+            if node.address in self._inFlight:
+                return False
+            self._failed.discard(node.address)
+            if node.primary == node.address:
+                self._primaries[node.address] = node
+            else:
+                self._children[node.address] = node
+            self._cond.notify_all()
+        return True
+
+    def acknowledged(self, address):
+        #Called when Polyglot confirms a node was added
+        _late = False
+        with self._cond:
+            if address in self._inFlight:
+                self._inFlight.discard(address)
+                self.added += 1
+            elif address in self._failed:
+                self._failed.discard(address)
+                self.added += 1
+                _late = True
+            else:
+                return False
+            self._cond.notify_all()
+        if _late and self._onProgress is not None:
+            self._onProgress(self.stats())
+        return True
+
+    def pending(self):
+        with self._cond:
+            return len(self._primaries) + len(self._children)
+
+    def contains(self, address):
+        #True while the node is waiting to be added or awaiting Polyglot's acknowledgement
+        with self._cond:
+            return address in self._primaries or address in self._children or address in self._inFlight
+
+    def _nextBatch(self):
+        #Called with the condition held.  Takes up to batchSize nodes, primaries first, skipping children whose primary isn't added yet
+        _batch = []
+        for _pending in (self._primaries, self._children):
+            for _address in list(_pending):
+                if len(_batch) >= self.batchSize:
+                    return _batch
+                _node = _pending[_address]
+                if _pending is self._children and (_node.primary in self._primaries or _node.primary in self._inFlight):
+                    continue
+                _batch.append(_pending.pop(_address))
+        return _batch
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                _batch = self._nextBatch()
+                while not _batch:
+                    self._cond.wait(self.ackTimeout)
+                    _batch = self._nextBatch()
+                self._inFlight.update(_node.address for _node in _batch)
+            _start = time.time()
+            for _node in _batch:
+                try:
+                    LOGGER.debug('Adding %s(%s) from queue', _node.name, _node.address)
+                    with PROFILER.span('nodeAddition.addNode'):
+                        self._addNode(_node)
+                except Exception as ex:
+                    LOGGER.error('Error encountered adding node %s from queue: %s', _node.address, ex)
+                    with self._cond:
+                        self._inFlight.discard(_node.address)
+                        self._failed.add(_node.address)
+            _addresses = set(_node.address for _node in _batch)
+            with self._cond, PROFILER.span('nodeAddition.ackWait'):
+                self._cond.wait_for(lambda: not (_addresses & self._inFlight), self.ackTimeout)
+                _elapsed = time.time() - _start
+                _unacknowledged = _addresses & self._inFlight
+                if _unacknowledged:
+                    LOGGER.error('Polyglot did not acknowledge the addition of %i node(s) within %s seconds: %s', len(_unacknowledged), self.ackTimeout, ', '.join(sorted(_unacknowledged)))
+                    self._inFlight -= _unacknowledged
+                    self._failed |= _unacknowledged
+                if _unacknowledged or _elapsed > self.ackTarget:
+                    self.batchSize = max(1, self.batchSize // 2)
+                else:
+                    self.batchSize = min(self.maxBatch, self.batchSize * 2)
+                self.batches += 1
+                _remaining = len(self._primaries) + len(self._children)
+            LOGGER.debug('Node addition batch of %i acknowledged in %.2fs, next batch size %i, %i node(s) pending', len(_batch), _elapsed, self.batchSize, _remaining)
+            if _remaining == 0:
+                LOGGER.info('No nodes pending addition')
+            if self._onProgress is not None:
+                try:
+                    self._onProgress(self.stats())
+                except Exception as ex:
+                    LOGGER.error('Error reporting node addition progress: %s', ex)
+            if _elapsed < self.interval:
+                time.sleep(self.interval - _elapsed)
+
+    def stats(self):
+        with self._cond:
+            return {'queued': len(self._primaries) + len(self._children) + len(self._inFlight), 'added': self.added, 'failed': len(self._failed),
+                    'batchSize': self.batchSize, 'batches': self.batches}
+
+
+class RefreshScheduler(object):
+    """
+    Keeps a refresh deadline per Rachio device and refreshes each device from a single worker thread when its deadline passes.
+
+    The interval is picked from the device's last snapshot: activeInterval while a schedule is running
+    (currentSchedule status PROCESSING), a deadline just after the rain delay ends when one expires before the
+    next idle refresh, and idleInterval otherwise.  Intervals are stretched by ttlFactor() (see
+    RateLimitGovernor) and jittered so devices spread out over the window instead of refreshing together;
+    the first deadline of a newly tracked device is spread over the whole interval.  Every completed
+    refresh, whatever triggered it (webhook, QUERY, this scheduler), re-plans that device's deadline.
+
+    refresh(device_id) is called for due devices.  schedule() describes the current plan for debugging.
+    """
+    SPREAD = 0.5 #First deadline after a device is tracked falls between 50% and 100% of the interval after the last update
+    JITTER = 0.1 #Later deadlines fall between 90% and 100% of the interval
+    RAIN_DELAY_MARGIN = 30 #Seconds after a rain delay ends before refreshing, so the API reports it as over
+    RETRY = 300 #Seconds before retrying a device whose scheduled refresh didn't update its snapshot
+
+    def __init__(self, refresh, activeInterval=60., idleInterval=3600., ttlFactor=None):
+        self._refresh = refresh
+        self.activeInterval = activeInterval
+        self.idleInterval = idleInterval
+        self._ttlFactor = ttlFactor
+        self._entries = {} #device id -> {'name', 'deadline', 'interval', 'reason', 'updated'}
+        self._cond = threading.Condition()
+        self._random = random.Random()
+        self.refreshes = 0
+        threading.Thread(target=self._worker, name='refresh-scheduler', daemon=True).start()
+
+    def plan(self, device, currentSchedule, now):
+        #Returns (interval, reason, rain delay end or None) for a device snapshot
+        _factor = self._ttlFactor() if self._ttlFactor is not None else 1.
+        if str(currentSchedule.get('status', '')) == 'PROCESSING':
+            return self.activeInterval * _factor, 'watering', None
+        _rainDelayEnd = device.get('rainDelayExpirationDate', 0) / 1000.
+        if now < _rainDelayEnd < now + self.idleInterval * _factor:
+            return self.idleInterval * _factor, 'rain delay ending', _rainDelayEnd + self.RAIN_DELAY_MARGIN
+        return self.idleInterval * _factor, 'idle', None
+
+    def track(self, device_id, name, device, currentSchedule, updated):
+        #Starts scheduling a device.  "updated" is when its snapshot was last fetched (0 if never)
+        _now = time.time()
+        _interval, _reason, _rainDelayEnd = self.plan(device, currentSchedule, _now)
+        _deadline = updated + _interval * self._random.uniform(self.SPREAD, 1.)
+        if _deadline < _now:
+            _deadline = _now + self._random.uniform(0, min(_interval, 60.))
+        if _rainDelayEnd is not None:
+            _deadline = min(_deadline, _rainDelayEnd)
+        with self._cond:
+            self._entries[device_id] = {'name': name, 'deadline': _deadline, 'interval': _interval, 'reason': _reason, 'updated': updated, 'spread': True}
+            self._cond.notify_all()
+
+    def forget(self, device_id):
+        with self._cond:
+            self._entries.pop(device_id, None)
+
+    def updated(self, device_id, device, currentSchedule, updated):
+        #Re-plans a device after its snapshot was refreshed
+        _interval, _reason, _rainDelayEnd = self.plan(device, currentSchedule, updated)
+        with self._cond:
+            _entry = self._entries.get(device_id)
+            if _entry is None:
+                return
+            #Devices discovered together also complete their first refresh together, so that one is spread over the whole window
+            _deadline = updated + _interval * self._random.uniform(self.SPREAD if _entry['spread'] else 1. - self.JITTER, 1.)
+            if _rainDelayEnd is not None:
+                _deadline = min(_deadline, _rainDelayEnd)
+            _entry['spread'] = False
+            if _reason != _entry['reason']:
+                LOGGER.debug('Refreshing %s every %is (%s)', _entry['name'], int(_interval), _reason)
+            _entry.update({'deadline': _deadline, 'interval': _interval, 'reason': _reason, 'updated': updated})
+            self._cond.notify_all()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                _now = time.time()
+                _due = [i for i, e in self._entries.items() if e['deadline'] <= _now]
+                if not _due:
+                    _next = min([e['deadline'] for e in self._entries.values()] or [_now + 60.])
+                    self._cond.wait(max(min(_next - _now, 60.), 0.05))
+                    continue
+                _due.sort(key=lambda i: self._entries[i]['deadline'])
+            for _device_id in _due:
+                try:
+                    self._refresh(_device_id)
+                    self.refreshes += 1
+                except Exception as ex:
+                    LOGGER.error('Error running scheduled refresh of Rachio device %s: %s', _device_id, ex)
+                with self._cond:
+                    _entry = self._entries.get(_device_id)
+                    if _entry is not None and _entry['deadline'] <= time.time():
+                        #Refresh skipped or failed (API budget reserved, connection error), try again later rather than immediately
+                        _entry['deadline'] = time.time() + min(_entry['interval'], self.RETRY)
+
+    def schedule(self):
+        #Current plan, soonest first: device id, name, reason, interval and seconds until the next refresh and since the last one
+        _now = time.time()
+        with self._cond:
+            _entries = [(i, dict(e)) for i, e in self._entries.items()]
+        return [{'deviceId': i, 'name': e['name'], 'reason': e['reason'], 'interval': round(e['interval'], 1),
+                 'nextRefresh': round(e['deadline'] - _now, 1), 'lastRefresh': round(_now - e['updated'], 1) if e['updated'] else None}
+                for i, e in sorted(_entries, key=lambda x: x[1]['deadline'])]
+
+    def stats(self):
+        _reasons = {}
+        with self._cond:
+            for _entry in self._entries.values():
+                _reasons[_entry['reason']] = _reasons.get(_entry['reason'], 0) + 1
+        return {'devices': _reasons, 'refreshes': self.refreshes}
+
+
+class NodeRegistry(object):
+    """
+    O(1) lookups from Rachio IDs to the nodes representing them, maintained by Controller.addNode/delNode.
+
+    devices: Rachio device id -> RachioController node
+    zones: Rachio zone id -> RachioZone node
+    schedules: Rachio schedule rule id -> RachioSchedule or RachioFlexSchedule node
+    children: Rachio device id -> {address: node} for the zones and schedules on that device
+    """
+    def __init__(self):
+        self.devices = {}
+        self.zones = {}
+        self.schedules = {}
+        self.children = {}
+        self._lock = threading.Lock()
+
+    def register(self, node):
+        with self._lock:
+            if isinstance(node, RachioController):
+                self.devices[node.device_id] = node
+                return
+            if isinstance(node, RachioZone):
+                self.zones[node.zone_id] = node
+            elif isinstance(node, (RachioSchedule, RachioFlexSchedule)):
+                self.schedules[node.schedule_id] = node
+            else:
+                return
+            self.children.setdefault(node.device_id, {})[node.address] = node
+
+    def unregister(self, node):
+        with self._lock:
+            if isinstance(node, RachioController):
+                if self.devices.get(node.device_id) is node:
+                    del self.devices[node.device_id]
+                return
+            if isinstance(node, RachioZone) and self.zones.get(node.zone_id) is node:
+                del self.zones[node.zone_id]
+            elif isinstance(node, (RachioSchedule, RachioFlexSchedule)) and self.schedules.get(node.schedule_id) is node:
+                del self.schedules[node.schedule_id]
+            self.children.get(getattr(node, 'device_id', None), {}).pop(node.address, None)
+
+    def deviceChildren(self, device_id):
+        return list(self.children.get(device_id, {}).values())
+
+
+class MetricsPage(object):
+    """
+    Builds a page in the Prometheus text exposition format (version 0.0.4), served at /metrics by the webhook HTTP server.
+
+    Each metric is added once with all of its samples; "samples" is a list of (labels dict, value).
+    histogram() takes the bucket upper bounds and per-bucket (not cumulative) counts, with one extra count for
+    values above the last bound, and writes the cumulative _bucket, _sum and _count series.
+    """
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self._lines = []
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ''
+        return '{' + ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in sorted(labels.items())) + '}'
+
+    @staticmethod
+    def _value(value):
+        if value is None:
+            return 'NaN'
+        if isinstance(value, float) and value == float('inf'):
+            return '+Inf'
+        return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+    def add(self, name, metricType, help, samples):
+        self._lines.append('# HELP %s %s' % (name, help))
+        self._lines.append('# TYPE %s %s' % (name, metricType))
+        for _labels, _value in samples:
+            self._lines.append('%s%s %s' % (name, self._labels(_labels), self._value(_value)))
+
+    def histogram(self, name, help, bounds, series):
+        #series: list of (labels dict, per-bucket counts, sum of observed values)
+        self._lines.append('# HELP %s %s' % (name, help))
+        self._lines.append('# TYPE %s histogram' % name)
+        for _labels, _counts, _sum in series:
+            _total = 0
+            for _bound, _count in zip(list(bounds) + [float('inf')], _counts):
+                _total += _count
+                self._lines.append('%s_bucket%s %i' % (name, self._labels(dict(_labels, le=self._value(float(_bound)))), _total))
+            self._lines.append('%s_sum%s %s' % (name, self._labels(_labels), self._value(float(_sum))))
+            self._lines.append('%s_count%s %i' % (name, self._labels(_labels), _total))
+
+    def text(self):
+        return '\n'.join(self._lines) + '\n'
+
+
+class Profiler(object):
+    """
+    Opt-in timing spans plus a sampling profiler, for finding where time goes on a production Polyglot host.
+
+    Both are off until start(seconds, directory) is called (see the 'profileSeconds' custom parameter).  While on,
+    span(name) and the @timed decorator record the count, total and longest duration of each named span
+    (discovery, webhook reconciliation, update_info per node type, driver publishing, webhook handling, each
+    Rachio API endpoint, node additions), and a background thread samples the stacks of all threads every
+    SAMPLE_INTERVAL seconds (wall clock, so idle threads show up waiting).  cProfile only sees the thread that enables it, which misses the webhook, refresh and
+    node addition threads where most of the work happens, so stacks are sampled with sys._current_frames() instead.
+    When the time is up, rachio_profile_<time>.txt (span table and the functions seen in the most samples) and
+    rachio_profile_<time>.folded (collapsed stacks for flamegraph.pl or speedscope) are written to "directory".
+    """
+    SAMPLE_INTERVAL = 0.01
+    MAX_DEPTH = 64
+    TOP_FUNCTIONS = 40
+
+    def __init__(self):
+        self.enabled = False
+        self.spans = {} #span name -> [count, total seconds, max seconds]
+        self.stacks = {} #collapsed stack -> samples
+        self.samples = 0
+        self.lastProfile = None #path of the last report written
+        self._lock = threading.Lock()
+
+    def span(self, name):
+        #Context manager timing a block as "name" while profiling is on
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._span(name)
+
+    @contextlib.contextmanager
+    def _span(self, name):
+        _start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - _start)
+
+    def record(self, name, seconds):
+        with self._lock:
+            _stats = self.spans.setdefault(name, [0, 0., 0.])
+            _stats[0] += 1
+            _stats[1] += seconds
+            _stats[2] = max(_stats[2], seconds)
+
+    def start(self, seconds, directory):
+        #Turns spans and sampling on for "seconds", then writes the report to "directory".  Returns False if a run is already in progress
+        with self._lock:
+            if self.enabled:
+                return False
+            self.spans = {}
+            self.stacks = {}
+            self.samples = 0
+            self.enabled = True
+        LOGGER.info('Profiling for %i seconds, the report will be written to %s', int(seconds), directory)
+        threading.Thread(target=self._sample, args=(time.time() + seconds, directory), name='profiler', daemon=True).start()
+        return True
+
+    def _sample(self, deadline, directory):
+        _started = time.time()
+        _own = threading.get_ident()
+        try:
+            while time.time() < deadline:
+                _names = dict((t.ident, t.name) for t in threading.enumerate())
+                for _ident, _frame in sys._current_frames().items():
+                    if _ident == _own:
+                        continue
+                    _stack = []
+                    while _frame is not None and len(_stack) < self.MAX_DEPTH:
+                        _code = _frame.f_code
+                        _stack.append('%s (%s:%i)' % (_code.co_name, os.path.basename(_code.co_filename), _code.co_firstlineno))
+                        _frame = _frame.f_back
+                    _stack.append(re.sub(r'-\d+$', '', _names.get(_ident, 'thread'))) #pool threads of the same kind share a root
+                    _key = ';'.join(reversed(_stack))
+                    with self._lock:
+                        self.stacks[_key] = self.stacks.get(_key, 0) + 1
+                with self._lock:
+                    self.samples += 1
+                time.sleep(self.SAMPLE_INTERVAL)
+        finally:
+            with self._lock:
+                self.enabled = False
+        try:
+            self.lastProfile = self.write(directory, time.time() - _started)
+            LOGGER.info('Profile written to %s', self.lastProfile)
+        except Exception as ex:
+            LOGGER.error('Error writing profile to %s: %s', directory, ex)
+
+    def report(self, seconds):
+        #Text report: spans by total time, then functions by samples spent in them (self) and under them (total)
+        with self._lock:
+            _spans = sorted(self.spans.items(), key=lambda x: -x[1][1])
+            _stacks = dict(self.stacks)
+            _samples = self.samples
+        _lines = ['Rachio NodeServer %s profile, %.0f seconds, %i samples every %.3fs' % (VERSION, seconds, _samples, self.SAMPLE_INTERVAL), '',
+                  '%-60s %10s %12s %10s %10s' % ('span', 'count', 'total (s)', 'avg (ms)', 'max (ms)')]
+        for _name, (_count, _total, _max) in _spans:
+            _lines.append('%-60s %10i %12.3f %10.2f %10.2f' % (_name, _count, _total, _total / _count * 1000., _max * 1000.))
+        _self, _inclusive = {}, {}
+        for _stack, _count in _stacks.items():
+            _frames = _stack.split(';')[1:]
+            if _frames:
+                _self[_frames[-1]] = _self.get(_frames[-1], 0) + _count
+            for _function in set(_frames):
+                _inclusive[_function] = _inclusive.get(_function, 0) + _count
+        for _title, _counts in (('self', _self), ('total', _inclusive)):
+            _lines.extend(['', '%-90s %10s' % ('function (%s samples across all threads)' % _title, 'samples')])
+            for _function, _count in sorted(_counts.items(), key=lambda x: -x[1])[:self.TOP_FUNCTIONS]:
+                _lines.append('%-90s %10i' % (_function, _count))
+        return '\n'.join(_lines) + '\n'
+
+    def write(self, directory, seconds):
+        _base = os.path.join(directory, 'rachio_profile_' + time.strftime('%Y%m%d-%H%M%S'))
+        with open(_base + '.txt', 'w') as _file:
+            _file.write(self.report(seconds))
+        with self._lock:
+            _stacks = sorted(self.stacks.items())
+        with open(_base + '.folded', 'w') as _file:
+            for _stack, _count in _stacks:
+                _file.write('%s %i\n' % (_stack, _count))
+        return _base + '.txt'
+
+PROFILER = Profiler()
+
+
+def timed(name, byNodeType=False):
+    #Decorator recording each call as a PROFILER span while profiling is on.  byNodeType appends the node definition id, e.g. "update_info.rachio_zone"
+    def _decorate(func):
+        @functools.wraps(func)
+        def _timed(self, *args, **kwargs):
+            if not PROFILER.enabled:
+                return func(self, *args, **kwargs)
+            _start = time.perf_counter()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                PROFILER.record(name + '.' + str(self.id) if byNodeType else name, time.perf_counter() - _start)
+        return _timed
+    return _decorate
+
+
+class RachioAccount(object):
+    """
+    One Rachio account (API key) served by the bridge.  Each account has its own API client and connection
+    pool (RachioSession), API budget (RateLimitGovernor), refresh worker (RefreshScheduler) and warm start
+    snapshot, and Controller.discover runs the accounts' discoveries in parallel, so a slow or throttled
+    account never holds up discovery or refreshes of the others' controllers.
+
+    name: custom parameter the API key came from ('api_key', 'api_key_2', ...), also used in logs and metrics
+    prefix: '' for 'api_key', whose nodes keep the addresses used before additional accounts were supported
+            (controller MAC address, plus the zone number or the last 2 characters of the schedule id).  Other
+            accounts' controllers are addressed by 'x' and the parameter's suffix (e.g. 'x2') followed by the last
+            10 characters of the MAC address, so their zone and schedule addresses also fit the ISY's 14 characters.
+            'x' isn't a hex digit, so these addresses can't collide with a MAC address from the 'api_key' account
+    """
+    def __init__(self, controller, suffix=None):
+        self.controller = controller
+        self.name = 'api_key' if suffix is None else 'api_key_' + suffix
+        self.prefix = '' if suffix is None else 'x' + suffix
+        self.api_key = None
+        self.governor = RateLimitGovernor()
+        self.apiSession = None
+        self.r_api = None
+        self.refreshScheduler = RefreshScheduler(self.refreshDevice, 60., controller.cacheMaxAge * 0.9, self.governor.ttlFactor)
+        self.person_id = None
+        self.person = None
+        self.snapshotStore = None #Saved person/device snapshots used to warm start, see warmStart()
+        self.warmStarted = False
+
+    def configure(self, api_key, apiUrl, connectTimeout, readTimeout, reserve, idleInterval, activeInterval):
+        self.api_key = api_key
+        self.governor.reserve = reserve
+        self.refreshScheduler.idleInterval = idleInterval
+        self.refreshScheduler.activeInterval = activeInterval
+        self.apiSession = RachioSession(apiUrl, connectTimeout, readTimeout)
+        _file = SNAPSHOT_FILE if not self.prefix else SNAPSHOT_FILE.replace('.json', '_' + self.prefix + '.json')
+        self.snapshotStore = SnapshotStore(os.path.join(os.getcwd(), _file), api_key)
+
+    def deviceAddress(self, device):
+        #Node address of a Rachio controller on this account, see the class description
+        _mac = str(device['macAddress']).lower()
+        return self.prefix + _mac[-10:] if self.prefix else _mac
+
+    def devices(self):
+        #This account's controller nodes
+        return [n for n in list(self.controller.registry.devices.values()) if n.account is self]
+
+    @timed('RachioAccount.discover')
+    def discover(self):
+        LOGGER.info('Starting discovery of Rachio account %s', self.name)
+        try:
+            if self.apiSession is None:
+                self.apiSession = RachioSession()
+            self.r_api = self.apiSession.attach(Rachio(self.api_key), self.api_key)
+            if self.warmStart():
+                return True
+            if self.person_id is None: #The person id never changes, so it's only looked up once (or taken from the saved snapshot)
+                _person_id = self.governor.get('person.getInfo', self.r_api.person.getInfo)
+                self.person_id = _person_id[1]['id']
+            self.person = self.getPerson() #returns json containing all info associated with person (devices, zones, schedules, flex schedules, and notifications)
+            LOGGER.debug('Obtained Person ID (%s), %s/%s API requests remaining until %s', self.person_id, self.person[0].get('x-ratelimit-remaining'), self.person[0].get('x-ratelimit-limit'),self.person[0].get('x-ratelimit-reset'))
+            if self.snapshotStore is not None:
+                self.snapshotStore.updatePerson(self.person_id, self.person[1])
+        except Exception as ex:
+            LOGGER.error('Connection Error on discovery of Rachio account %s, may be temporary. %s.', self.name, ex)
+            return False
+
+        try:
+            #get devices
+            _devices = self.person[1]['devices']
+            LOGGER.info('%i Rachio controllers found on account %s. Adding to ISY', len(_devices), self.name)
+            self.reconcileDevices(_devices)
+            self.controller.reconcileWebhooks([str(d['id']) for d in _devices], self)
+
+        except Exception as ex:
+            LOGGER.error('Error during Rachio device discovery of account %s: %s', self.name, ex)
+
+        return True
+
+    def getPerson(self):
+        #person.get, with each device payload cut down to the fields the nodes use (see rachio_drivers.compactDevice) as soon as it arrives
+        _resp = self.governor.get('person.get', self.r_api.person.get, self.person_id)
+        _resp[1]['devices'] = [rachio_drivers.compactDevice(d) for d in _resp[1].get('devices', [])]
+        return _resp
+
+    def reconcileDevices(self, devices):
+        #Diffs the person.get device list against this account's controller nodes: devices new to the account are added, devices no longer on it
+        #are removed along with their zones and schedules, renamed devices are renamed, and every remaining device gets its fresh payload and
+        #reconciles its own zones and schedules against it (see RachioController.discover).  Returns the number of changes applied
+        _controller = self.controller
+        _desired = {}
+        for d in devices:
+            _other = _controller.registry.devices.get(str(d['id']))
+            if _other is not None and _other.account is not self:
+                LOGGER.warning('Rachio controller %s is on accounts %s and %s, only adding it for %s', d.get('name'), _other.account.name, self.name, _other.account.name)
+                continue
+            _desired[self.deviceAddress(d)] = d
+        _existing = dict((n.address, n) for n in self.devices())
+        _added, _removed, _renamed, _rekeyed, _children = 0, 0, 0, 0, 0
+        for _address, d in _desired.items():
+            _node = _existing.get(_address)
+            try:
+                if _node is not None and str(_node.device_id) != str(d['id']):
+                    #Same controller (MAC address) registered again under a new device id; rebuild its nodes so every id is current
+                    LOGGER.info('Rachio controller %s now has device id %s (was %s), re-adding its nodes', _address, d['id'], _node.device_id)
+                    _controller.removeDevice(_node)
+                    _node = None
+                    _rekeyed += 1
+                if _node is None:
+                    if _controller.addDevice(d, self) is not None:
+                        _added += 1
+                    continue
+                _node.cache.update(device=d)
+                if _node.name != str(d['name']):
+                    _controller.renameNode(_node, str(d['name']))
+                    _renamed += 1
+                if _node.discoverComplete:
+                    _children += _node.discover()
+            except Exception as ex:
+                LOGGER.error('Error reconciling Rachio controller %s: %s', _address, ex)
+        for _address, _node in _existing.items():
+            if _address not in _desired:
+                LOGGER.info('Rachio controller %s (%s) is no longer on account %s, removing it and its zones and schedules', _node.name, _address, self.name)
+                try:
+                    _controller.removeDevice(_node)
+                    _removed += 1
+                except Exception as ex:
+                    LOGGER.error('Error removing Rachio controller %s: %s', _address, ex)
+        LOGGER.info('Rachio controllers of account %s reconciled: %i added, %i removed, %i renamed, %i re-added under a new id, %i zone/schedule changes', self.name, _added, _removed, _renamed, _rekeyed, _children)
+        return _added + _removed + _renamed + _rekeyed + _children
+
+    def warmStart(self):
+        #On the first discovery after a restart, creates the nodes from the snapshot saved by the previous run so their drivers
+        #are populated right away, then reconciles with the Rachio API in the background.  Returns False if there's no usable snapshot
+        if self.warmStarted or self.snapshotStore is None:
+            return False
+        self.warmStarted = True
+        if not self.snapshotStore.load():
+            return False
+        self.person_id = self.snapshotStore.person_id
+        self.person = ({}, self.snapshotStore.personPayload())
+        _nodes = {}
+        for d in self.person[1]['devices']:
+            _saved = self.snapshotStore.devices[str(d['id'])]
+            _node = self.controller.addDevice(d, self, (_saved['currentSchedule'], _saved['updated']))
+            if _node is not None:
+                _nodes[str(d['id'])] = _node
+        LOGGER.info('%i Rachio controllers of account %s restored from snapshot. Adding to ISY and reconciling with the Rachio API in the background', len(_nodes), self.name)
+        threading.Thread(target=self._reconcileWarmStart, args=(_nodes,), daemon=True).start()
+        return True
+
+    def _reconcileWarmStart(self, nodes):
+        #One person.get refreshes every device payload at once, so each restored device only needs its current schedule fetched
+        try:
+            self.person = self.getPerson()
+            self.snapshotStore.updatePerson(self.person_id, self.person[1])
+        except Exception as ex:
+            LOGGER.error('Error reconciling snapshot of account %s with the Rachio API, saved values are shown until the next refresh: %s', self.name, ex)
+            return False
+
+        _device_ids = []
+        for d in self.person[1]['devices']:
+            _device_id = str(d['id'])
+            _device_ids.append(_device_id)
+            _node = nodes.get(_device_id)
+            if _node is None:
+                continue
+            try:
+                _node.cache.update(d, _node.fetchCurrentSchedule() if self.governor.allowRefresh() else None)
+                if _node.address in self.controller.nodes:
+                    _node.update_info(force=False, queryAPI=False)
+                    for _child in self.controller.registry.deviceChildren(_device_id):
+                        _child.update_info(force=False, queryAPI=False)
+            except Exception as ex:
+                LOGGER.error('Error reconciling snapshot of Rachio device %s: %s', _device_id, ex)
+        self.reconcileDevices(self.person[1]['devices']) #Picks up devices, zones and schedules added, removed or renamed since the snapshot was saved
+        self.controller.reconcileWebhooks(_device_ids, self)
+        LOGGER.info('Snapshot of account %s reconciled with the Rachio API for %i Rachio controller(s)', self.name, len(_device_ids))
+        return True
+
+    def snapshotUpdated(self, device_id, device, currentSchedule, updated):
+        self.refreshScheduler.updated(device_id, device, currentSchedule, updated)
+        if self.snapshotStore is not None:
+            self.snapshotStore.updateDevice(device_id, device, currentSchedule, updated)
+
+    def refreshDevice(self, device_id):
+        #Scheduled refresh: fetch the device's snapshot and re-render the controller and all of its zones and schedules
+        _controller = self.controller.registry.devices.get(device_id)
+        if _controller is None:
+            return False
+        _controller.getSnapshot(force=True)
+        for _node in [_controller] + self.controller.registry.deviceChildren(device_id):
+            _node.update_info(force=False, queryAPI=False)
+        return True
+
 
 class Controller(polyinterface.Controller):
     """
@@ -59,29 +1314,42 @@ class Controller(polyinterface.Controller):
                   which never happens.
     """
     def __init__(self, polyglot):
+        self.registry = NodeRegistry() #Created before the superclass initializes in case it adds nodes right away
         super(Controller, self).__init__(polyglot)
         self.name = 'Rachio Bridge'
-        #Queue for nodes to be added in order to prevent a flood of nodes from being created on discovery.  Added version 2.2.0
-        self.nodeQueue = {}
-        _msg = "Connection timer created for node addition queue"
-        self.timer = Timer(1,LOGGER.debug,[_msg])
+        #Queue for nodes to be added in order to prevent a flood of nodes from being created on discovery.  Added version 2.2.0, batched and paced by Polyglot's acknowledgements since
         self.nodeAdditionInterval = 1
+        self.nodeAdditions = NodeAdditionQueue(self.addNode, self.nodeAdditionInterval, onProgress=self.nodeAdditionProgress)
         self.httpPort = 3001
         self.httpHost = ''
         self.device_id = ''
+        self.cacheRefreshInterval = 5 #Minimum seconds between Rachio API refreshes of a device's snapshot
+        self.cacheMaxAge = 3600 #Seconds after which a device's snapshot is refreshed even if not requested
+        self.webhookQueue = None
+        self.commandExecutor = CommandExecutor(onStatus=self.commandStatus)
+        self.driverUpdates = {} #node definition id -> [published, suppressed] driver update counts
+        self._driverUpdatesLock = threading.Lock()
+        self.webhookEvents = {} #WS_EVENT_TYPES key (or "unknown") -> webhook events received
+        self.webhookSetupWorkers = 4
+        self.webhookSetupPool = None #Created on first discovery so 'webhookSetupWorkers' can be configured
+        self.webhookSummary = {} #Account name -> results of its most recent webhook reconciliation, see reconcileWebhooks()
+        self.webhooksVerified = set() #Device ids whose webhook was confirmed or fixed since the node server started
+        self.webhookCoalescer = WebhookCoalescer(self.flushWebhookEvents)
+        self.accounts = [RachioAccount(self)] #One per API key, the first from 'api_key'.  See RachioAccount
+        self.profileRequested = None #Last 'profileSeconds' value a profiling run was started for
 
     def start(self):
         LOGGER.info('Starting Rachio Polyglot v2 NodeServer version {}'.format(VERSION))
+        self.checkProfile()
         try:
-            if 'api_key' in self.polyConfig['customParams']:
-                self.api_key = self.polyConfig['customParams']['api_key']
-            else:
+            _apiKeys = self.apiKeys()
+            if None not in _apiKeys:
                 LOGGER.error('Rachio API key required in order to establish connection.  Enter custom parameter of \'api_key\' in Polyglot configuration.  See "https://rachio.readme.io/v1.0/docs" for instructions on how to obtain Rachio API Key.')
                 sys.exit(0)
                 return False
         
         except Exception as ex:
-            LOGGER.error('Error reading Rachio API Key from Polyglot Configuration: %s', str(ex))
+            LOGGER.error('Error reading Rachio API Key from Polyglot Configuration: %s', ex)
             return False
             
         ###Start HTTP Server for Websockets####
@@ -89,10 +1357,10 @@ class Controller(polyinterface.Controller):
             if 'port' in self.polyConfig['customParams']:
                 self.httpPort = self.polyConfig['customParams']['port']
             else:
-                LOGGER.error('No HTTP Port specified in Rachio configuration for Websocket endpoint.  Using port %s for now.  Enter custom parameter of \'port\' in Polyglot configuration.', str(self.httpPort))
-            LOGGER.info('Ensure router/firewall is set to forward requests to polyglot host on port %s',str(self.httpPort))
+                LOGGER.error('No HTTP Port specified in Rachio configuration for Websocket endpoint.  Using port %s for now.  Enter custom parameter of \'port\' in Polyglot configuration.', self.httpPort)
+            LOGGER.info('Ensure router/firewall is set to forward requests to polyglot host on port %s',self.httpPort)
         except Exception as ex:
-            LOGGER.error('Error reading webSocket Port from Polyglot Configuration: %s', str(ex))
+            LOGGER.error('Error reading webSocket Port from Polyglot Configuration: %s', ex)
             sys.exit(0)
             return False
             
@@ -103,17 +1371,21 @@ class Controller(polyinterface.Controller):
                 LOGGER.error('No HTTP Host specified in Rachio configuration for websocket endpoint.  Enter custom parameter of \'host\' in Polyglot configuration.')
                 sys.exit(0)
         except Exception as ex:
-            LOGGER.error('Error reading webSocket host name from Polyglot Configuration: %s', str(ex))
+            LOGGER.error('Error reading webSocket host name from Polyglot Configuration: %s', ex)
             sys.exit(0)
             return False
         
         try:
             LOGGER.debug('Starting Websocket HTTP Server')
-            self.webSocketServer = HTTPServer(('', int(self.httpPort)), webSocketHandler)
+            _workers = int(self.getNumericParam('webhookWorkers', 4, 1, 32))
+            _queueSize = int(self.getNumericParam('webhookQueueSize', 200, 1, 10000))
+            self.webhookQueue = WebhookQueue(self.routeWebhookEvent, _workers, _queueSize)
+            self.webhookCoalescer.window = self.getNumericParam('webhookCoalesceWindow', self.webhookCoalescer.window, 0, 30)
+            self.webSocketServer = WebhookHTTPServer(('', int(self.httpPort)), webSocketHandler)
             self.webSocketServer.controller = self #To allow handler to access this class when receiving a request from Rachio servers
             self.httpThread = threading.Thread(target=self.webSocketServer.serve_forever, daemon=True).start()
         except Exception as ex:
-            LOGGER.error('Error starting webSocket server: %s', str(ex))
+            LOGGER.error('Error starting webSocket server: %s', ex)
             sys.exit(0)
             return False
 
@@ -121,15 +1393,39 @@ class Controller(polyinterface.Controller):
             #Get Node Addition Interval from Polyglot Configuration (Added version 2.2.0)
             try:
                 if 'nodeAdditionInterval' in self.polyConfig['customParams']:
-                    _nodeAdditionInterval = self.polyConfig['customParams']['nodeAdditionInterval']
+                    _nodeAdditionInterval = float(self.polyConfig['customParams']['nodeAdditionInterval']) #Polyglot passes custom parameters as strings
                     if _nodeAdditionInterval >= 0 and _nodeAdditionInterval <= 60:
                         self.nodeAdditionInterval = _nodeAdditionInterval
+                        self.nodeAdditions.interval = _nodeAdditionInterval
                     else:
-                        LOGGER.error('Node Addition Interval configured but outside of permissible range of 0 - 60 seconds, defaulting to %s second(s)', str(self.nodeAdditionInterval))
+                        LOGGER.error('Node Addition Interval configured but outside of permissible range of 0 - 60 seconds, defaulting to %s second(s)', self.nodeAdditionInterval)
                 else:
-                    LOGGER.info('Node Addition Interval not configured, defaulting to %s second(s).  If a different time is needed, enter a custom parameter with a key of \'nodeAdditionInterval\' and a value in seconds in order to change interval.', str(self.nodeAdditionInterval))
+                    LOGGER.info('Node Addition Interval not configured, defaulting to %s second(s).  If a different time is needed, enter a custom parameter with a key of \'nodeAdditionInterval\' and a value in seconds in order to change interval.', self.nodeAdditionInterval)
             except Exception as ex:
-                LOGGER.error('Error reading Rachio Node Addition Interval from Polyglot Configuration: %s', str(ex))
+                LOGGER.error('Error reading Rachio Node Addition Interval from Polyglot Configuration: %s', ex)
+
+            self.cacheRefreshInterval = self.getNumericParam('cacheRefreshInterval', self.cacheRefreshInterval, 0, 3600)
+            self.cacheMaxAge = self.getNumericParam('cacheMaxAge', self.cacheMaxAge, 60, 86400)
+            _activeInterval = self.getNumericParam('activeRefreshInterval', 60., 10, 3600)
+            _reserve = int(self.getNumericParam('apiReserve', 100, 0, 10000))
+            self.commandExecutor.retries = int(self.getNumericParam('commandRetries', self.commandExecutor.retries, 0, 10))
+            self.commandExecutor.dedupeWindow = self.getNumericParam('commandDedupeWindow', self.commandExecutor.dedupeWindow, 0, 60)
+            self.nodeAdditions.maxBatch = int(self.getNumericParam('nodeAdditionMaxBatch', self.nodeAdditions.maxBatch, 1, 256))
+            self.webhookSetupWorkers = int(self.getNumericParam('webhookSetupWorkers', self.webhookSetupWorkers, 1, 32))
+            _apiUrl = self.polyConfig['customParams'].get('apiUrl', RACHIO_API_URL)
+            if _apiUrl != RACHIO_API_URL:
+                LOGGER.warning('Using Rachio API at %s instead of %s', _apiUrl, RACHIO_API_URL)
+            _connectTimeout = self.getNumericParam('apiConnectTimeout', 10, 1, 120)
+            _readTimeout = self.getNumericParam('apiReadTimeout', 30, 1, 300)
+            _accounts = []
+            for _suffix, _key in sorted(_apiKeys.items(), key=lambda k: k[0] or ''):
+                _account = self.accounts[0] if _suffix is None else RachioAccount(self, _suffix)
+                #Scheduled refreshes run before the cache's own maxAge check would fire
+                _account.configure(_key, _apiUrl, _connectTimeout, _readTimeout, _reserve, self.cacheMaxAge * 0.9, _activeInterval)
+                _accounts.append(_account)
+            self.accounts = _accounts
+            if len(_accounts) > 1:
+                LOGGER.info('Serving %i Rachio accounts: %s', len(_accounts), ', '.join(a.name for a in _accounts))
 
             self.discover()
         else:
@@ -139,10 +1435,77 @@ class Controller(polyinterface.Controller):
         
         LOGGER.debug('Rachio "start" routine complete')
         
+    def checkProfile(self):
+        #Polyglot doesn't reload the ISY profile when the node server is updated, so install it whenever profile/version.txt differs
+        #from the version last installed (kept in the node server's custom data).  Otherwise new drivers and commands show up unnamed on the ISY
+        try:
+            with open(PROFILE_VERSION_FILE) as _file:
+                _version = _file.read().strip()
+            _customData = dict(self.polyConfig.get('customData') or {})
+            if _customData.get('profile_version') == _version:
+                return False
+            LOGGER.info('Installing node server profile version %s (previously installed: %s)', _version, _customData.get('profile_version'))
+            self.poly.installprofile()
+            _customData['profile_version'] = _version
+            self.saveCustomData(_customData)
+            return True
+        except Exception as ex:
+            LOGGER.error('Error checking the installed node server profile version: %s', ex)
+            return False
+
+    def apiKeys(self):
+        #Returns the API keys from the Polyglot configuration as {suffix: key}: None for 'api_key' and e.g. '2' for 'api_key_2'.
+        #Additional accounts use a single letter or digit suffix, which becomes part of their nodes' addresses (see RachioAccount)
+        _keys = {}
+        for _param, _value in self.polyConfig['customParams'].items():
+            if _param != 'api_key' and not _param.startswith('api_key_'):
+                continue
+            _suffix = None if _param == 'api_key' else _param[len('api_key_'):].lower()
+            if _suffix is not None and (len(_suffix) != 1 or _suffix not in '0123456789abcdefghijklmnopqrstuvwxyz'):
+                LOGGER.error('Ignoring custom parameter \'%s\', additional Rachio API keys are entered as \'api_key_\' followed by a single letter or digit (e.g. \'api_key_2\')', _param)
+                continue
+            _value = str(_value).strip()
+            if not _value:
+                continue
+            if _value in _keys.values():
+                LOGGER.warning('Ignoring custom parameter \'%s\', its Rachio API key is already configured', _param)
+                continue
+            _keys[_suffix] = _value
+        return _keys
+
+    def refreshSchedule(self):
+        #Refresh plan of every account's controllers, for the /refreshSchedule page
+        _schedule = []
+        for _account in self.accounts:
+            for _entry in _account.refreshScheduler.schedule():
+                _entry['account'] = _account.name
+                _schedule.append(_entry)
+        return sorted(_schedule, key=lambda e: e['nextRefresh'])
+
+    def accountFor(self, device_id):
+        #The account a Rachio device's controller node belongs to (the first account if it isn't known yet)
+        _node = self.registry.devices.get(device_id)
+        return _node.account if _node is not None else self.accounts[0]
+
+    def getNumericParam(self, key, default, minValue, maxValue):
+        #Reads an optional numeric custom parameter from the Polyglot configuration, falling back to the default if missing or out of range
+        try:
+            if key not in self.polyConfig['customParams']:
+                return default
+            _value = float(self.polyConfig['customParams'][key])
+            if _value < minValue or _value > maxValue:
+                LOGGER.error('Custom parameter \'%s\' configured but outside of permissible range of %s - %s, defaulting to %s', key, minValue, maxValue, default)
+                return default
+            LOGGER.info('Custom parameter \'%s\' set to %s', key, _value)
+            return _value
+        except Exception as ex:
+            LOGGER.error('Error reading custom parameter \'%s\' from Polyglot Configuration, defaulting to %s: %s', key, default, ex)
+            return default
+
     def testWebSocketConnectivity(self, host, port):
         try:
             _url = 'http://' + host + ':' + port + '/test'
-            LOGGER.info('Testing connectivity to %s:%s', str(host), str(port))
+            LOGGER.info('Testing connectivity to %s:%s', host, port)
             _headers = {'Content-Type': 'application/json'}
             (_resp, _content) = _HTTP.request(_url, 'GET', headers=_headers)
             content_type = _resp.get('content-type')
@@ -150,23 +1513,27 @@ class Controller(polyinterface.Controller):
                 _content = json.loads(_content.decode('UTF-8'))
                 if 'success' in _content:
                     if _content['success'] == "True":
-                        LOGGER.info('Connectivity test to %s:%s succeeded', str(host), str(port))
+                        LOGGER.info('Connectivity test to %s:%s succeeded', host, port)
                         return True
                     else:
-                        LOGGER.error('Connectivity test to %s:%s was not successful', str(host), str(port))
+                        LOGGER.error('Connectivity test to %s:%s was not successful', host, port)
                         return False
                 else:
-                    LOGGER.error('Connectivity test to %s:%s was not successful, unexpected content', str(host), str(port))
+                    LOGGER.error('Connectivity test to %s:%s was not successful, unexpected content', host, port)
                     return False
             else:
-                LOGGER.error('Connectivity test to %s:%s was not successful, unexpected response', str(host), str(port))
+                LOGGER.error('Connectivity test to %s:%s was not successful, unexpected response', host, port)
                 return False
         except Exception as ex:
-            LOGGER.error('Error reaching specified host:port externally (%s:%s).  Please ensure entries are correct and the appropriate firewall ports have been opened: %s', str(host), str(port), str(ex))
+            LOGGER.error('Error reaching specified host:port externally (%s:%s).  Please ensure entries are correct and the appropriate firewall ports have been opened: %s', host, port, ex)
             return False
             
-    def configureWebSockets(self, WS_deviceID):
-        #Get the webSockets configured for the specified device.  Delete any older, inappropriate websockets and create new ones as needed
+    @timed('configureWebSockets')
+    def configureWebSockets(self, WS_deviceID, account):
+        #Get the webSockets configured for the specified device, using the API client and budget of the account it belongs to.  Delete any older, inappropriate websockets and create new ones as needed
+        #Returns a dictionary with the action taken ('unchanged', 'updated', 'created' or 'failed'), the number of duplicate websockets deleted and any errors encountered
+        _result = {'action': 'unchanged', 'deleted': 0, 'errors': []}
+        _governor, _api = account.governor, account.r_api
         _url = 'http://' + self.httpHost + ':' + self.httpPort
         
         #Build event types array:
@@ -175,8 +1542,8 @@ class Controller(polyinterface.Controller):
             _eventTypes.append({'id':str(value)})
         
         try:
-            _ws = self.r_api.notification.getDeviceWebhook(WS_deviceID)
-            LOGGER.debug('Obtained webHook information for %s, %s/%s API requests remaining until %s', str(WS_deviceID), str(_ws[0]['x-ratelimit-remaining']), str(_ws[0]['x-ratelimit-limit']),str(_ws[0]['x-ratelimit-reset']))
+            _ws = _governor.get('notification.getDeviceWebhook', _api.notification.getDeviceWebhook, WS_deviceID)
+            LOGGER.debug('Obtained webHook information for %s, %s/%s API requests remaining until %s', WS_deviceID, _ws[0].get('x-ratelimit-remaining'), _ws[0].get('x-ratelimit-limit'),_ws[0].get('x-ratelimit-reset'))
             _websocketFound = False
             _wsId = ''
             for _websocket in _ws[1]:
@@ -184,389 +1551,1041 @@ class Controller(polyinterface.Controller):
                     if _websocket['externalId'] == 'polyglot' and not _websocketFound: #This is the first polyglot-created websocket
                         if self.httpHost not in _websocket['url']:
                             #Polyglot websocket but url does not match currently configured host and port
-                            LOGGER.info('Websocket %s found but url (%s) is not correct, updating', str(_websocket['id']), str(_websocket['url']))
+                            LOGGER.info('Websocket %s found but url (%s) is not correct, updating', _websocket['id'], _websocket['url'])
                             try:
-                                _updateWS = self.r_api.notification.putWebhook(_websocket['id'], 'polyglot', _url, _eventTypes)
-                                LOGGER.debug('Updated webhook %s, %s/%s API requests remaining until %s', str(_websocket['id']), str(_updateWS[0]['x-ratelimit-remaining']), str(_updateWS[0]['x-ratelimit-limit']),str(_updateWS[0]['x-ratelimit-reset']))
+                                _updateWS = _governor.call('notification.putWebhook', _api.notification.putWebhook, _websocket['id'], 'polyglot', _url, _eventTypes)
+                                LOGGER.debug('Updated webhook %s, %s/%s API requests remaining until %s', _websocket['id'], _updateWS[0].get('x-ratelimit-remaining'), _updateWS[0].get('x-ratelimit-limit'),_updateWS[0].get('x-ratelimit-reset'))
                                 _websocketFound = True
                                 _wsId = _websocket['id']
+                                _result['action'] = 'updated'
                             except Exception as ex:
-                                LOGGER.error('Error updating websocket %s url to "%s": %s', str(_websocket['id']), str(_url), str(ex))
+                                LOGGER.error('Error updating websocket %s url to "%s": %s', _websocket['id'], _url, ex)
+                                _result['errors'].append('update url: ' + str(ex))
                         else:
                             #URL is OK, check that all websocket event types are included:
                             _allEventsPresent = True
                             for key, value in WS_EVENT_TYPES.items():
-                                _allEventsPresent = _allEventsPresent and any(key in d for d in _websocket['eventTypes'])
+                                _allEventsPresent = _allEventsPresent and any(d.get('name') == key or str(d.get('id')) == str(value) for d in _websocket['eventTypes'])
                             
                             if not _allEventsPresent:
                                 #at least one websocket event is missing from the definition on the Rachio servers, updated the websocket:
-                                LOGGER.info('Websocket %s found but websocket event is missing, updating', str(_websocket['id']))
+                                LOGGER.info('Websocket %s found but websocket event is missing, updating', _websocket['id'])
                                 try:
-                                    _updateWS = self.r_api.notification.putWebhook(_websocket['id'], 'polyglot', _url, _eventTypes)
-                                    LOGGER.debug('Updated webhook %s, %s/%s API requests remaining until %s', str(_websocket['id']), str(_updateWS[0]['x-ratelimit-remaining']), str(_updateWS[0]['x-ratelimit-limit']),str(_updateWS[0]['x-ratelimit-reset']))
+                                    _updateWS = _governor.call('notification.putWebhook', _api.notification.putWebhook, _websocket['id'], 'polyglot', _url, _eventTypes)
+                                    LOGGER.debug('Updated webhook %s, %s/%s API requests remaining until %s', _websocket['id'], _updateWS[0].get('x-ratelimit-remaining'), _updateWS[0].get('x-ratelimit-limit'),_updateWS[0].get('x-ratelimit-reset'))
                                     _websocketFound = True
                                     _wsId = _websocket['id']
+                                    _result['action'] = 'updated'
                                 except Exception as ex:
-                                    LOGGER.error('Error updating websocket %s events: %s', str(_websocket['id']), str(ex))
+                                    LOGGER.error('Error updating websocket %s events: %s', _websocket['id'], ex)
+                                    _result['errors'].append('update events: ' + str(ex))
                             else:
                                 #Websocket definition is OK!
                                 _websocketFound = True
                                 _wsId = _websocket['id']
                                 
                     elif  _websocket['externalId'] == 'polyglot' and _websocketFound: #This is an additional polyglot-created websocket
-                        LOGGER.info('Polyglot websocket %s found but polyglot already has a websocket defined (%s).  Deleting this websocket', str(_websocket['id']), str(_wsId))
-                        _deleteWs = self.r_api.notification.deleteWebhook(_websocket['id'])
-                        LOGGER.debug('Deleted webhook %s, %s/%s API requests remaining until %s', str(_websocket['id']), str(_deleteWS[0]['x-ratelimit-remaining']), str(_deleteWS[0]['x-ratelimit-limit']),str(_deleteWS[0]['x-ratelimit-reset']))
+                        LOGGER.info('Polyglot websocket %s found but polyglot already has a websocket defined (%s).  Deleting this websocket', _websocket['id'], _wsId)
+                        try:
+                            _deleteWS = _governor.call('notification.deleteWebhook', _api.notification.deleteWebhook, _websocket['id'])
+                            LOGGER.debug('Deleted webhook %s, %s/%s API requests remaining until %s', _websocket['id'], _deleteWS[0].get('x-ratelimit-remaining'), _deleteWS[0].get('x-ratelimit-limit'),_deleteWS[0].get('x-ratelimit-reset'))
+                            _result['deleted'] += 1
+                        except Exception as ex:
+                            LOGGER.error('Error deleting duplicate websocket %s: %s', _websocket['id'], ex)
+                            _result['errors'].append('delete duplicate: ' + str(ex))
             
             if not _websocketFound:
                 #No Polyglot websockets were found, create one:
-                LOGGER.info('No Polyglot websockets were found for device %s, creating a new websocket for Polyglot', str(WS_deviceID))
+                LOGGER.info('No Polyglot websockets were found for device %s, creating a new websocket for Polyglot', WS_deviceID)
                 try:
-                    _createWS = self.r_api.notification.postWebhook(WS_deviceID, 'polyglot', _url, _eventTypes)
+                    _createWS = _governor.call('notification.postWebhook', _api.notification.postWebhook, WS_deviceID, 'polyglot', _url, _eventTypes)
                     _resp = str(_createWS[1])
-                    LOGGER.debug('Created webhook for device %s. "%s". %s/%s API requests remaining until %s', str(WS_deviceID), str(_resp), str(_createWS[0]['x-ratelimit-remaining']), str(_createWS[0]['x-ratelimit-limit']),str(_createWS[0]['x-ratelimit-reset']))
+                    LOGGER.debug('Created webhook for device %s. "%s". %s/%s API requests remaining until %s', WS_deviceID, _resp, _createWS[0].get('x-ratelimit-remaining'), _createWS[0].get('x-ratelimit-limit'),_createWS[0].get('x-ratelimit-reset'))
+                    _result['action'] = 'created'
                 except Exception as ex:
-                    LOGGER.error('Error creating websocket for device %s: %s', str(WS_deviceID), str(ex))
+                    LOGGER.error('Error creating websocket for device %s: %s', WS_deviceID, ex)
+                    _result['errors'].append('create: ' + str(ex))
+                    _result['action'] = 'failed'
         except Exception as ex:
-            LOGGER.error('Error configuring websockets for device %s: %s', str(WS_deviceID), str(ex))
+            LOGGER.error('Error configuring websockets for device %s: %s', WS_deviceID, ex)
+            _result['errors'].append(str(ex))
+            _result['action'] = 'failed'
+        return _result
+
+    def reconcileWebhooks(self, device_ids, account):
+        #Runs configureWebSockets for each of an account's devices on a bounded pool so node creation doesn't wait on the webhook API round trips.
+        #A background thread collects each device's result, time taken and errors into the account's entry of self.webhookSummary and logs it once all devices finish
+        try:
+            device_ids = [i for i in device_ids if i not in self.webhooksVerified] #The webhook URL can't change while running, so each device only needs checking once
+            if not device_ids:
+                LOGGER.debug('Webhooks of all Rachio controllers already verified')
+                return True
+            if self.webhookSetupPool is None:
+                self.webhookSetupPool = ThreadPoolExecutor(max_workers=self.webhookSetupWorkers)
+            _started = time.time()
+            _futures = {}
+            for _device_id in device_ids:
+                _futures[_device_id] = self.webhookSetupPool.submit(self._reconcileDeviceWebhooks, _device_id, account)
+            threading.Thread(target=self._summarizeWebhooks, args=(_futures, _started, account), daemon=True).start()
+            return True
+        except Exception as ex:
+            LOGGER.error('Error starting webhook reconciliation: %s', ex)
+            return False
+
+    def _reconcileDeviceWebhooks(self, device_id, account):
+        _start = time.time()
+        _result = self.configureWebSockets(device_id, account)
+        _result['seconds'] = round(time.time() - _start, 3)
+        return _result
+
+    def _summarizeWebhooks(self, futures, started, account):
+        _devices = {}
+        for _device_id, _future in futures.items():
+            try:
+                _devices[_device_id] = _future.result()
+            except Exception as ex:
+                _devices[_device_id] = {'action': 'failed', 'deleted': 0, 'errors': [str(ex)], 'seconds': None}
+        _actions = {}
+        for _device_id, _result in _devices.items():
+            _actions[_result['action']] = _actions.get(_result['action'], 0) + 1
+            if _result['action'] != 'failed':
+                self.webhooksVerified.add(_device_id)
+            if _result['errors']:
+                LOGGER.warning('Webhook reconciliation for device %s: %s', _device_id, '; '.join(_result['errors']))
+        _timings = [_result['seconds'] for _result in _devices.values() if _result['seconds'] is not None]
+        _summary = {'started': started, 'seconds': round(time.time() - started, 3), 'actions': _actions, 'devices': _devices}
+        self.webhookSummary[account.name] = _summary
+        LOGGER.info('Webhook reconciliation for %i device(s) of account %s finished in %.2fs (slowest device %.2fs): %s', len(_devices), account.name, _summary['seconds'], max(_timings) if _timings else 0., ', '.join('%i %s' % (v, k) for k, v in sorted(_actions.items())) or 'nothing to do')
+        return _summary
 
     
+    def webhookEventType(self, event):
+        #Returns the WS_EVENT_TYPES key for a webhook payload.  Rachio sends e.g. "ZONE_STATUS" for events registered as "ZONE_STATUS_EVENT"
+        _type = str(event.get('type', ''))
+        for key in (_type, _type + '_EVENT'):
+            if key in WS_EVENT_TYPES:
+                return key
+        return None
+
+    @timed('webhook.route')
+    def routeWebhookEvent(self, event):
+        #Applies the event's payload to the device's cached snapshot and re-renders the nodes it affects straight away.  Events that can't be
+        #applied that way go to the coalescer, which calls flushWebhookEvents once per device per coalescing window.  Returns False if the event was ignored
+        if 'deviceId' not in event:
+            return False
+        _deviceID = event['deviceId']
+        _controller = self.registry.devices.get(_deviceID)
+        if _controller is None:
+            LOGGER.debug('Webhook event received for unknown device %s', _deviceID)
+            return False
+        _previous = _controller.currentSchedule
+        _result = _controller.cache.apply(self.webhookEventType(event), event)
+        if _result is None:
+            self.webhookCoalescer.add(_deviceID, event, time.time())
+        elif _result == 'applied':
+            _targets = self.webhookTargets(_controller, event)
+            #The zone/schedule that was running before the event may have stopped too (e.g. a manual run switched to another zone)
+            for _node in (self.registry.zones.get(_previous.get('zoneId')), self.registry.schedules.get(_previous.get('scheduleRuleId'))):
+                if _node is not None and _node not in _targets:
+                    _targets.append(_node)
+            for _node in _targets:
+                _node.update_info(force=False, queryAPI=False)
+        else:
+            LOGGER.debug('Ignoring out of order %s %s event for device %s', event.get('type'), event.get('subType'), _deviceID)
+        return True
+
+    def flushWebhookEvents(self, device_id, events, since):
+        #Refreshes the device once with a fetch started after the last event in the window arrived, then re-renders only the nodes those
+        #events apply to.  Returns the number of nodes updated
+        _controller = self.registry.devices.get(device_id)
+        if _controller is None:
+            return 0
+        _targets = {}
+        for _event in events:
+            for _node in self.webhookTargets(_controller, _event):
+                _targets[_node.address] = _node
+        _controller.getSnapshot(force=True, since=since)
+        for node in _targets.values():
+            node.update_info(force=False, queryAPI=False)
+        return len(_targets)
+
+    def webhookTargets(self, controller, event):
+        #Returns the nodes a webhook event applies to
+        _deviceID = controller.device_id
+        _eventType = self.webhookEventType(event)
+        if _eventType is None:
+            LOGGER.info('Unrecognized webhook event type "%s" for device %s, updating all of its nodes', event.get('type'), _deviceID)
+            _routes = ('controller', 'zones', 'schedules')
+        else:
+            _routes = WS_EVENT_ROUTES[_eventType]
+
+        _targets = []
+        if 'controller' in _routes:
+            _targets.append(controller)
+        _children = self.registry.deviceChildren(_deviceID)
+        if 'zones' in _routes or ('zone' in _routes and 'zoneId' not in event):
+            _targets.extend([n for n in _children if isinstance(n, RachioZone)])
+        elif 'zone' in _routes and event['zoneId'] in self.registry.zones:
+            _targets.append(self.registry.zones[event['zoneId']])
+        _scheduleID = event.get('scheduleId', event.get('scheduleRuleId'))
+        if 'schedules' in _routes or ('schedule' in _routes and _scheduleID is None):
+            _targets.extend([n for n in _children if not isinstance(n, RachioZone)])
+        elif 'schedule' in _routes and _scheduleID in self.registry.schedules:
+            _targets.append(self.registry.schedules[_scheduleID])
+        return _targets
+
     def shortPoll(self):
-        pass
+        #Keeps the rain delay and schedule countdowns live between refreshes, from cached data only
+        _now = time.time()
+        for _node in list(self.registry.devices.values()):
+            try:
+                _node.tick(_now)
+            except Exception as ex:
+                LOGGER.error('Error updating countdowns on %s Rachio Controller: %s', _node.name, ex)
+
+    def checkProfiling(self):
+        #Starts a profiling run when the 'profileSeconds' custom parameter is set to a new value (0 or missing: off), see Profiler
+        _value = self.polyConfig['customParams'].get('profileSeconds')
+        if _value is None or _value == self.profileRequested:
+            return False
+        self.profileRequested = _value
+        _seconds = self.getNumericParam('profileSeconds', 0, 0, 3600)
+        if _seconds <= 0:
+            return False
+        return PROFILER.start(_seconds, os.getcwd())
 
     def longPoll(self):
         try:
+            self.checkProfiling()
+            LOGGER.flush()
             for node in self.nodes:
                 self.nodes[node].update_info(force=False,queryAPI=False)
+            LOGGER.debug('Device snapshot cache: %s', self.cacheStats())
+            for _account in self.accounts:
+                LOGGER.debug('Refresh scheduler (%s): %s', _account.name, _account.refreshScheduler.stats())
+                LOGGER.debug('Rachio API budget (%s): %s', _account.name, _account.governor.stats())
+                if _account.apiSession is not None:
+                    LOGGER.debug('Rachio API transport (%s): %s', _account.name, _account.apiSession.stats())
+            LOGGER.debug('Command executor: %s', self.commandExecutor.stats())
+            LOGGER.debug('Driver updates published/suppressed: %s', self.driverUpdates)
+            if self.webhookQueue is not None:
+                _stats = self.webhookQueue.stats()
+                LOGGER.debug('Webhook queue: %s', _stats)
+                LOGGER.debug('Webhook events received/merged into an open window/refreshes issued: %s', self.webhookCoalescer.stats())
+                if _stats['dropped'] > 0:
+                    LOGGER.warning('%s webhook event(s) dropped because the webhook queue was full, consider increasing \'webhookQueueSize\' or \'webhookWorkers\'', _stats['dropped'])
         except Exception as ex:
-            LOGGER.error('Error running longPoll on %s: %s', self.name, str(ex))
-
+            LOGGER.error('Error running longPoll on %s: %s', self.name, ex)
+
+    def countWebhookEvent(self, event):
+        _eventType = self.webhookEventType(event) or 'unknown'
+        with self._driverUpdatesLock:
+            self.webhookEvents[_eventType] = self.webhookEvents.get(_eventType, 0) + 1
+
+    def countDriverUpdates(self, nodeDef, published, suppressed):
+        with self._driverUpdatesLock:
+            _counts = self.driverUpdates.setdefault(nodeDef, [0, 0])
+            _counts[0] += published
+            _counts[1] += suppressed
+
+    def cacheStats(self):
+        #Totals the snapshot cache hit/miss counters across all Rachio Controllers
+        _stats = {'hits': 0, 'misses': 0, 'waits': 0, 'reduced': 0, 'stale': 0}
+        for node in list(self.nodes.values()):
+            if isinstance(node, RachioController):
+                for key, value in node.cache.stats().items():
+                    _stats[key] += value
+        return _stats
+
+    def metrics(self):
+        #Returns the /metrics page, collected from the stats each component already keeps
+        _page = MetricsPage()
+        #API metrics are labelled with the account they belong to
+        _requests, _latency, _reconnects = [], [], []
+        for _account in self.accounts:
+            if _account.apiSession is None:
+                continue
+            _results, _histogram, _count = _account.apiSession.counters()
+            _requests.extend(({'account': _account.name, 'endpoint': k[0], 'result': k[1]}, v) for k, v in sorted(_results.items()))
+            _latency.extend(({'account': _account.name, 'endpoint': k}, v[0], v[1]) for k, v in sorted(_histogram.items()))
+            _reconnects.append(({'account': _account.name}, _count))
+        if _reconnects:
+            _page.add('rachio_api_requests_total', 'counter', 'Rachio API requests by endpoint and result (HTTP status or "error")', _requests)
+            _page.histogram('rachio_api_request_duration_seconds', 'Rachio API request latency by endpoint', RachioSession.LATENCY_BUCKETS, _latency)
+            _page.add('rachio_api_reconnects_total', 'counter', 'Requests retried on a fresh connection after a pooled one was found closed', _reconnects)
+        _page.add('rachio_api_ratelimit_remaining', 'gauge', 'Last x-ratelimit-remaining reported by the Rachio API', [({'account': a.name}, a.governor.remaining) for a in self.accounts])
+        _page.add('rachio_api_ratelimit_limit', 'gauge', 'Last x-ratelimit-limit reported by the Rachio API', [({'account': a.name}, a.governor.limit) for a in self.accounts])
+        _page.add('rachio_api_deferred_total', 'counter', 'Refreshes skipped because the remaining API budget is reserved for commands', [({'account': a.name}, a.governor.deferred) for a in self.accounts])
+        _page.add('rachio_api_ttl_factor', 'gauge', 'Multiplier currently applied to refresh intervals to stay within the API budget', [({'account': a.name}, a.governor.ttlFactor()) for a in self.accounts])
+
+        with self._driverUpdatesLock:
+            _events = dict(self.webhookEvents)
+            _drivers = dict((k, list(v)) for k, v in self.driverUpdates.items())
+        _page.add('rachio_webhook_events_received_total', 'counter', 'Webhook events received by event type',
+                  [({'type': k}, v) for k, v in sorted(_events.items())])
+        if self.webhookQueue is not None:
+            _queue = self.webhookQueue.stats()
+            _page.add('rachio_webhook_queue_depth', 'gauge', 'Webhook events waiting to be processed', [({}, _queue['depth'])])
+            _page.add('rachio_webhook_events_dropped_total', 'counter', 'Webhook events dropped because the queue was full', [({}, _queue['dropped'])])
+        _coalescer = self.webhookCoalescer.stats()
+        _page.add('rachio_webhook_registrations', 'gauge', 'Controllers by result of their most recent webhook registration check, per account',
+                  [({'account': a, 'action': k}, v) for a, _summary in sorted(list(self.webhookSummary.items())) for k, v in sorted(_summary['actions'].items())])
+        _page.add('rachio_webhook_refreshes_total', 'counter', 'Refreshes issued for webhook events that could not be applied from their payload', [({}, _coalescer['refreshes'])])
+        _page.add('rachio_driver_updates_total', 'counter', 'Driver updates by node type, "published" to the ISY or "suppressed" as unchanged',
+                  [({'node_type': k, 'result': r}, v[i]) for k, v in sorted(_drivers.items()) for i, r in enumerate(('published', 'suppressed'))])
+
+        _additions = self.nodeAdditions.stats()
+        _page.add('rachio_node_addition_queue_depth', 'gauge', 'Nodes waiting to be added to Polyglot (including a batch awaiting acknowledgement)', [({}, _additions['queued'])])
+        _page.add('rachio_nodes_added_total', 'counter', 'Nodes added to Polyglot', [({}, _additions['added'])])
+        _page.add('rachio_nodes_failed', 'gauge', 'Nodes Polyglot did not acknowledge', [({}, _additions['failed'])])
+
+        _cache = self.cacheStats()
+        _page.add('rachio_snapshot_cache_requests_total', 'counter', 'Device snapshot requests answered from the cache ("hit"), by an API refresh ("miss") or by joining one in flight ("wait")',
+                  [({'result': 'hit'}, _cache['hits']), ({'result': 'miss'}, _cache['misses']), ({'result': 'wait'}, _cache['waits'])])
+        _page.add('rachio_snapshot_webhook_events_total', 'counter', 'Webhook events applied to device snapshots from their payload, or rejected as out of order',
+                  [({'result': 'applied'}, _cache['reduced']), ({'result': 'stale'}, _cache['stale'])])
+        _page.add('rachio_devices', 'gauge', 'Rachio controllers being tracked', [({}, len(self.registry.devices))])
+        _page.add('rachio_log_messages_suppressed_total', 'counter', 'Repeated warnings/errors counted instead of logged', [({}, LOGGER.suppressed)])
+        return _page.text()
+
+    @timed('update_info', byNodeType=True)
     def update_info(self, force=False, queryAPI=True):
-        #Nothing to update for this node
-        pass
+        # GV0 -> Rachio API requests remaining (of the account with the fewest left)
+        try:
+            _remaining = [a.governor.remaining for a in self.accounts if a.governor.remaining is not None]
+            if _remaining:
+                self.setDriver('GV0', min(_remaining))
+        except Exception as ex:
+            LOGGER.error('Error updating API requests remaining on %s. %s', self.name, ex)
 
     def query(self):
         try:
             for node in self.nodes:
                 self.nodes[node].update_info(force=True)
         except Exception as ex:
-            LOGGER.error('Error running query on %s: %s', self.name, str(ex))
+            LOGGER.error('Error running query on %s: %s', self.name, ex)
+
+    def runCommand(self, device_id, key, description, endpoint, func, *args):
+        #Queues a Rachio API command on the command executor and returns right away, counted against the budget of the device's account.  Status is reported on the device's GV11 driver
+        _governor = self.accountFor(device_id).governor
+        def _send():
+            _resp = _governor.call(endpoint, func, *args, command=True)
+            _status = int(_resp[0].get('status', 200))
+            if _status == 429 or _status >= 500:
+                raise IOError('Rachio API returned HTTP status %s' % str(_status))
+            elif _status >= 400:
+                raise CommandRejected('Rachio API returned HTTP status %s' % str(_status))
+            LOGGER.info('%s succeeded', description)
+        return self.commandExecutor.submit(device_id, key, description, _send)
+
+    def commandStatus(self, device_id, status):
+        _node = self.registry.devices.get(device_id)
+        if _node is not None:
+            _node.setDriver('GV11', status)
+            _node.flushDrivers()
 
     def discoverCMD(self, command=None):
-        # This is command called by ISY discover button
-        for node in self.nodes:
-            self.nodes[node].discover()
+        # This is command called by ISY discover button.  Controller.discover reconciles every device, which in turn reconciles its zones and schedules
+        self.discover()
 
+    @timed('Controller.discover')
     def discover(self, command=None):
-        LOGGER.info('Starting discovery on %s', self.name)
+        #Discovers every account, in parallel when there's more than one so a slow or throttled account doesn't hold up the others.  Returns True if all of them succeeded
+        LOGGER.info('Starting Rachio Discovery')
+        if len(self.accounts) == 1:
+            return self.accounts[0].discover()
+        _pool = ThreadPoolExecutor(max_workers=len(self.accounts), thread_name_prefix='rachio-discover')
         try:
-            self.r_api = Rachio(self.api_key)
-            _person_id = self.r_api.person.getInfo()
-            self.person_id = _person_id[1]['id']
-            self.person = self.r_api.person.get(self.person_id) #returns json containing all info associated with person (devices, zones, schedules, flex schedules, and notifications)
-            LOGGER.debug('Obtained Person ID (%s), %s/%s API requests remaining until %s', str(self.person_id), str(_person_id[0]['x-ratelimit-remaining']), str(_person_id[0]['x-ratelimit-limit']),str(_person_id[0]['x-ratelimit-reset']))
-        except Exception as ex:
-            try:
-                LOGGER.error('Connection Error on RachioControl discovery, may be temporary. %s. %s/%s API requests remaining until %s', str(ex), str(_person_id[0]['x-ratelimit-remaining']), str(_person_id[0]['x-ratelimit-limit']),str(_person_id[0]['x-ratelimit-reset']))
-            except:
-                LOGGER.error('Connection Error on RachioControl discovery, may be temporary. %s.',str(ex))
-            return False
+            _results = list(_pool.map(lambda a: a.discover(), self.accounts))
+        finally:
+            _pool.shutdown(wait=False)
+        return all(_results)
+
+    def addDevice(self, device, account=None, saved=None):
+        #Queues a RachioController node for the device unless it already exists.  Returns the new node, or None if it already existed
+        #"saved" is the (currentSchedule, updated) of a warm start snapshot, restored into the node's cache before the node can be started
+        _account = account or self.accounts[0]
+        _name = str(device['name'])
+        _address = _account.deviceAddress(device)
+        if _address in self.nodes or self.nodeAdditions.contains(_address):
+            return None
+        #LOGGER.info('Adding Rachio Controller: %s(%s)', _name, _address)
+        _node = RachioController(self, _address, _address, _name, device, _account)
+        if saved is not None:
+            _node.cache.restore(*saved)
+        self.addNodeQueue(_node)
+        return _node
+
+    def removeDevice(self, node):
+        #Deletes a controller node along with its zone and schedule nodes
+        for _child in self.registry.deviceChildren(node.device_id):
+            self.delNode(_child.address)
+        self.delNode(node.address)
+
+    def renameNode(self, node, name):
+        #polyinterface sends the node's new name to Polyglot when an existing node is added again with update=True
+        LOGGER.info('Renaming %s node %s to %s', node.address, node.name, name)
+        node.name = name
+        self.addNode(node, update=True)
+
+    def addNode(self, node, *args, **kwargs):
+        _result = super(Controller, self).addNode(node, *args, **kwargs)
+        self.registry.register(node)
+        if isinstance(node, RachioController):
+            node.account.refreshScheduler.track(node.device_id, node.name, node.device, node.currentSchedule, node.cache.lastUpdateTime)
+        return _result
+
+    def delNode(self, address):
+        _node = self.nodes.get(address)
+        if _node is not None:
+            self.registry.unregister(_node)
+            if isinstance(_node, RachioController):
+                _node.account.refreshScheduler.forget(_node.device_id)
+        return super(Controller, self).delNode(address)
 
+    def addNodeQueue(self, node):
+        #Queue the node for addition rather than adding it to ISY immediately.  Added version 2.2.0
         try:
-            #get devices
-            _devices = self.person[1]['devices']
-            LOGGER.info('%i Rachio controllers found. Adding to ISY', len(_devices))
-            for d in _devices:
-                _device_id = str(d['id'])
-                _name = str(d['name'])
-                _address = str(d['macAddress']).lower()
-                if _address not in self.nodes:
-                    #LOGGER.info('Adding Rachio Controller: %s(%s)', _name, _address)
-                    self.addNodeQueue(RachioController(self, _address, _address, _name, d))
-                self.configureWebSockets(_device_id)
-
+            LOGGER.debug('Request received to add node: %s (%s)', node.name, node.address)
+            self.nodeAdditions.put(node)
         except Exception as ex:
-            LOGGER.error('Error during Rachio device discovery: %s', str(ex))
+            LOGGER.error('Error queuing node for addition: %s', ex)
 
-        return True
+    def nodeAcknowledged(self, address):
+        #Polyglot starts a node once it confirms the node was added
+        self.nodeAdditions.acknowledged(address)
 
-    def addNodeQueue(self, node):
-        #If node is not already in ISY, add the node.  Otherwise, queue it for addition and start the interval timer.  Added version 2.2.0
+    def nodeAdditionProgress(self, stats):
+        self.setDriver('GV1', stats['queued'])
+        self.setDriver('GV2', stats['added'])
+        self.setDriver('GV3', stats['failed'])
+
+
+    def delete(self):
+        LOGGER.info('Deleting %s', self.name)
+
+    id = 'rachio'
+    commands = {'DISCOVER': discoverCMD, 'QUERY': query}
+    drivers = rachio_drivers.driverList('rachio')
+
+
+class SnapshotStore(object):
+    """
+    Keeps the latest person and per-device (device, currentSchedule) payloads on disk so a restart can
+    populate nodes straight away instead of waiting on (and spending API budget for) a full discovery.
+
+    The file is gzipped compact JSON, rewritten atomically (temporary file + os.replace) at most once
+    every "delay" seconds however many devices refresh in between.  It is tied to the API key it was
+    written with and ignored if the key changes.
+    """
+    FORMAT = 1
+
+    def __init__(self, path, api_key, delay=5.):
+        self.path = path
+        self.delay = delay
+        self._key = hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+        self.person_id = None
+        self.person = {} #person payload without its "devices" list
+        self.deviceOrder = []
+        self.devices = {} #device id -> {'device': ..., 'currentSchedule': ..., 'updated': epoch seconds}
+        self.writes = 0
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def load(self):
+        #Returns True if a snapshot for this API key was read from disk
         try:
-            LOGGER.debug('Request received to add node: %s (%s)', node.name, node.address)
-            self.nodeQueue[node.address] = node
-            self._startNodeAdditionDelayTimer()
+            with gzip.open(self.path, 'rt', encoding='utf-8') as _file:
+                _data = json.load(_file)
+            if _data.get('format') != self.FORMAT or _data.get('key') != self._key:
+                LOGGER.info('Ignoring snapshot %s, it was written by a different version or for a different API key', self.path)
+                return False
+            with self._lock:
+                self.person_id = _data['person_id']
+                self.person = _data['person']
+                self.deviceOrder = _data['deviceOrder']
+                self.devices = _data['devices']
+                for _entry in self.devices.values():
+                    _entry['device'] = rachio_drivers.compactDevice(_entry['device'])
+            LOGGER.info('Loaded snapshot of %i Rachio controller(s) from %s', len(self.devices), self.path)
+            return True
+        except FileNotFoundError:
+            return False
         except Exception as ex:
-            LOGGER.error('Error queuing node for addition: %s'. str(ex))
+            LOGGER.error('Error reading snapshot %s, running a full discovery instead: %s', self.path, ex)
+            return False
 
-    def _startNodeAdditionDelayTimer(self): #Added version 2.2.0
+    def personPayload(self):
+        #Rebuilds the person.get payload from the snapshot
+        with self._lock:
+            _person = dict(self.person)
+            _person['devices'] = [self.devices[i]['device'] for i in self.deviceOrder if i in self.devices]
+        return _person
+
+    def updatePerson(self, person_id, person):
+        with self._lock:
+            self.person_id = person_id
+            self.person = dict((k, v) for k, v in person.items() if k != 'devices')
+            self.deviceOrder = [str(d['id']) for d in person.get('devices', [])]
+            for _device in person.get('devices', []):
+                self.devices.setdefault(str(_device['id']), {'device': _device, 'currentSchedule': {}, 'updated': 0.})['device'] = _device
+            for _device_id in list(self.devices):
+                if _device_id not in self.deviceOrder:
+                    del self.devices[_device_id]
+        self._scheduleSave()
+
+    def updateDevice(self, device_id, device, currentSchedule, updated):
+        with self._lock:
+            self.devices[str(device_id)] = {'device': device, 'currentSchedule': currentSchedule, 'updated': updated}
+        self._scheduleSave()
+
+    def _scheduleSave(self):
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = Timer(self.delay, self.save)
+            self._timer.daemon = True
+            self._timer.start()
+
+    @timed('snapshot.save')
+    def save(self):
+        with self._lock:
+            self._timer = None
+            _data = json.dumps({'format': self.FORMAT, 'key': self._key, 'person_id': self.person_id, 'person': self.person,
+                                'deviceOrder': self.deviceOrder, 'devices': self.devices}, separators=(',', ':'), default=rachio_drivers.PayloadState.asDict)
+        _tmp = self.path + '.tmp'
         try:
-            if self.timer is not None:
-                self.timer.cancel()
-            self.timer = Timer(self.nodeAdditionInterval, self._addNodesFromQueue)
-            self.timer.start()
-            LOGGER.debug("Starting node addition delay timer for %s second(s)", str(self.nodeAdditionInterval))
+            with gzip.open(_tmp, 'wt', encoding='utf-8') as _file:
+                _file.write(_data)
+                _file.flush()
+                os.fsync(_file.fileno())
+            os.replace(_tmp, self.path)
+            self.writes += 1
             return True
         except Exception as ex:
-            LOGGER.error('Error starting node addition delay timer: %s', str(ex))
+            LOGGER.error('Error writing snapshot %s: %s', self.path, ex)
             return False
 
-    def _addNodesFromQueue(self): #Added version 2.2.0
+
+class DeviceSnapshotCache(object):
+    """
+    Per-device cache of the Rachio "device" and "current_schedule" payloads.
+
+    Zones, schedules and the controller itself all read from the same snapshot, kept in the compact form
+    produced by rachio_drivers.compactDevice().  Concurrent
+    callers (webhook thread, longPoll thread, ISY queries) share a single in-flight refresh,
+    so one refresh costs exactly one device.get plus one getCurrentSchedule no matter how
+    many child nodes ask for it.
+
+    refreshInterval: Minimum number of seconds between API requests for this device
+    maxAge: Number of seconds after which the snapshot is refreshed even if not forced
+    onUpdate: optional callable(device_id, device, currentSchedule, updated) run after each complete refresh or applied webhook event
+    hits/misses/waits: Requests answered from the cache / that triggered an API refresh / that joined a refresh already in flight
+
+    Webhook events whose type has a reducer (WS_EVENT_REDUCERS) are applied to the snapshot directly by apply().  Each
+    reducer updates one part of the snapshot (the current run, rain delay, on/off, online status), and an event older
+    than the last one applied to that part, or older than the start of the last API fetch, is rejected as out of order.
+    Event times come from Rachio's clock, so fetch start times are converted to it with "serverTime" (optional callable
+    taking a local epoch time, RateLimitGovernor.serverTime) rather than assuming the local clock is in sync.
+    Events applied while a fetch is in flight are re-applied to its result in case the fetch missed them.
+    reduced/stale: webhook events applied / rejected as out of order
+    """
+    REPLAY = 32 #Most recent applied events kept for re-applying to an in-flight fetch's result
+    def __init__(self, device_id, fetch, device=None, refreshInterval=5, maxAge=3600, ttlFactor=None, onUpdate=None, serverTime=None):
+        self.device_id = device_id
+        self.device = {}
+        self.zones = {} #zone id -> ZoneState (number, name, etc.), rebuilt from each device snapshot.  Zone nodes are found by id in Controller.registry
+        self.scheduleRules = {} #schedule rule id -> ScheduleRuleState
+        self.flexScheduleRules = {} #flex schedule rule id -> ScheduleRuleState
+        self._setDevice(device if device is not None else {})
+        self.currentSchedule = {}
+        self.refreshInterval = refreshInterval
+        self.maxAge = maxAge
+        self.lastUpdateTime = 0.
+        self.lastAttemptTime = 0.
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self._fetch = fetch #callable returning (device, currentSchedule), either may be None if the request failed
+        self._ttlFactor = ttlFactor #optional callable returning a multiplier for both TTLs, used to stretch them as the API budget runs low
+        self._onUpdate = onUpdate
+        self._serverTime = serverTime
+        self._lock = threading.Lock()
+        self._inFlight = None
+        self.fetchedAt = 0. #start time of the last complete fetch on Rachio's clock, webhook events older than this are already reflected in the snapshot
+        self.reduced = 0
+        self.stale = 0
+        self._eventTimes = {} #snapshot part -> time of the last event applied to it
+        self._applied = deque(maxlen=self.REPLAY) #(event time, event type, event) applied since fetchedAt
+
+    def get(self, force=False, since=None):
+        #Returns (device, currentSchedule), refreshing from the Rachio API first if the snapshot is stale.
+        #"since" (epoch seconds, e.g. when a webhook arrived) requires a snapshot fetched after that time: it refreshes regardless of
+        #refreshInterval unless a fetch started at or after "since" already did, or is in flight
+        while True:
+            with self._lock:
+                _now = time.time()
+                _sinceAttempt = _now - self.lastAttemptTime
+                _sinceUpdate = _now - self.lastUpdateTime
+                _factor = self._ttlFactor() if self._ttlFactor is not None else 1.
+                if self._inFlight is not None:
+                    _event = self._inFlight
+                    _leader = False
+                    _stale = since is not None and self.lastAttemptTime < since #in-flight fetch started before the change, fetch again after it
+                    self.waits += 1
+                elif (since is not None and self.lastAttemptTime < since) or \
+                        (_sinceAttempt > self.refreshInterval * _factor and (force or _sinceUpdate > self.maxAge * _factor)):
+                    _event = self._inFlight = threading.Event()
+                    _leader = True
+                    self.lastAttemptTime = _now
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                    return self.device, self.currentSchedule
+
+            if _leader:
+                break
+            _event.wait(60)
+            if not _stale:
+                return self.device, self.currentSchedule
+
         try:
-            if len(self.nodeQueue) > 0:
-                for _address in self.nodeQueue:
-                    LOGGER.debug('Adding %s(%s) from queue', self.name, self.address)
-                    self.addNode(self.nodeQueue[_address])
-                    del self.nodeQueue[_address]
-                    break #only add one node at a time
-        
-            if len(self.nodeQueue) > 0: #Check for more nodes after addition, if there are more to add, restart the timer
-                self._startNodeAdditionDelayTimer()
-            else:
-                LOGGER.info('No nodes pending addition')
+            _device, _schedule = self._fetch()
+            self.update(_device, _schedule, started=_now)
         except Exception as ex:
-            LOGGER.error('Error encountered adding node from queue: %s', str(ex))
+            LOGGER.error('Error refreshing snapshot for Rachio device %s: %s', self.device_id, ex)
+        finally:
+            with self._lock:
+                self._inFlight = None
+            _event.set()
+        return self.device, self.currentSchedule
+
+    def update(self, device=None, currentSchedule=None, started=None):
+        #Applies freshly fetched payloads.  Either may be None if it wasn't fetched; the snapshot only counts as updated once both are current.
+        #"started" is when the fetch began: webhook events applied since then are re-applied on top in case the fetch missed them
+        with self._lock:
+            if device is not None:
+                self._setDevice(device)
+            if currentSchedule is not None:
+                self.currentSchedule = currentSchedule
+            if device is None or currentSchedule is None:
+                return False
+            self.lastUpdateTime = time.time()
+            if started is not None:
+                self.fetchedAt = self.rachioTime(started) #fetches run one at a time, so this only moves forward (give or take the clock offset's 1 second resolution)
+            _replay = sorted([e for e in self._applied if e[0] >= self.fetchedAt], key=lambda e: e[0])
+            self._applied.clear()
+            if _replay:
+                _device, _schedule = dict(self.device), dict(self.currentSchedule)
+                for _entry in _replay:
+                    self._reduce(_entry[1], _entry[2], _entry[0], _device, _schedule)
+                    self._applied.append(_entry)
+                self.device, self.currentSchedule = _device, _schedule
+            _device, _schedule, _updated = self.device, self.currentSchedule, self.lastUpdateTime
+        if self._onUpdate is not None:
+            self._onUpdate(self.device_id, _device, _schedule, _updated)
+        return True
+
+    def restore(self, currentSchedule, updated):
+        #Seeds the snapshot from disk.  "updated" is when it was fetched, so an old snapshot is still refreshed once it exceeds maxAge
+        with self._lock:
+            self.currentSchedule = currentSchedule
+            self.lastUpdateTime = min(updated, time.time())
+            self.fetchedAt = self.rachioTime(self.lastUpdateTime)
+
+    def rachioTime(self, localTime):
+        return self._serverTime(localTime) if self._serverTime is not None else localTime
+
+    def activeZoneId(self):
+        #Id (as a string) of the zone watering now according to the current schedule, or None
+        _schedule = self.currentSchedule
+        if str(_schedule.get('status', '')) != 'PROCESSING' or 'zoneId' not in _schedule:
+            return None
+        return str(_schedule['zoneId'])
+
+    def activeZone(self):
+        #Payload (zoneNumber, name, etc.) of the zone watering now, looked up in the zone index, or None if no zone is running or it isn't indexed
+        _zone_id = self.activeZoneId()
+        return self.zones.get(_zone_id) if _zone_id is not None else None
+
+    @staticmethod
+    def eventTime(event):
+        #Epoch seconds a webhook event happened, from its "eventDate" (ms) or ISO 8601 "timestamp".  None if it has neither
+        if 'eventDate' in event:
+            return event['eventDate'] / 1000.
+        _timestamp = str(event.get('timestamp', '')).rstrip('Z')
+        for _format in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'):
+            try:
+                return (datetime.strptime(_timestamp, _format) - datetime(1970, 1, 1)).total_seconds()
+            except ValueError:
+                pass
+        return None
+
+    def apply(self, eventType, event):
+        #Applies a webhook event to the snapshot.  Returns 'applied', 'stale' (out of order, ignored) or None if the event can't be
+        #applied without refreshing from the API (type/subType without a reducer, no timestamp, payload missing a field)
+        _eventTime = self.eventTime(event)
+        if eventType not in WS_EVENT_REDUCERS or _eventTime is None:
+            return None
+        with self._lock:
+            _device, _schedule = dict(self.device), dict(self.currentSchedule)
+            try:
+                _part = self._reduce(eventType, event, _eventTime, _device, _schedule)
+            except (KeyError, TypeError, ValueError) as ex:
+                LOGGER.debug('Could not apply %s event to Rachio device %s, refreshing instead: %s', eventType, self.device_id, ex)
+                _part = None
+            if _part is None:
+                return None
+            if _eventTime < self.fetchedAt or _eventTime < self._eventTimes.get(_part, 0.):
+                self.stale += 1
+                return 'stale'
+            self._eventTimes[_part] = _eventTime
+            self._applied.append((_eventTime, eventType, event))
+            self.device, self.currentSchedule = _device, _schedule
+            self.reduced += 1
+            _updated = time.time()
+        if self._onUpdate is not None:
+            self._onUpdate(self.device_id, _device, _schedule, _updated)
+        return 'applied'
+
+    def _reduce(self, eventType, event, eventTime, device, currentSchedule):
+        #Runs the event type's reducer on copies of the payloads.  Returns the snapshot part it changed, or None if it doesn't handle the subType
+        return getattr(self, WS_EVENT_REDUCERS[eventType])(event, eventTime, device, currentSchedule)
+
+    def reduceZoneStatus(self, event, eventTime, device, currentSchedule):
+        _subType = event.get('subType')
+        if _subType == 'ZONE_STARTED':
+            _start = event.get('startTime', int(eventTime * 1000))
+            if str(currentSchedule.get('status', '')) != 'PROCESSING' or 'scheduleRuleId' not in currentSchedule:
+                #Not part of a schedule run, the zone's run is the whole run
+                currentSchedule.clear()
+                currentSchedule.update({'type': 'MANUAL', 'status': 'PROCESSING', 'deviceId': self.device_id, 'startDate': _start, 'duration': event['duration'],
+                                        'cycling': False, 'cycleCount': 1, 'totalCycleCount': 1})
+            currentSchedule.update({'zoneId': event['zoneId'], 'zoneNumber': event['zoneNumber'], 'zoneStartDate': _start, 'zoneDuration': event['duration']})
+            return 'run'
+        if _subType in ('ZONE_STOPPED', 'ZONE_COMPLETED'):
+            if currentSchedule.get('zoneId', event['zoneId']) != event['zoneId']:
+                return 'run' #another zone is running now
+            if _subType == 'ZONE_COMPLETED' and 'scheduleRuleId' in currentSchedule:
+                #The schedule carries on with its next zone (or reports its own completion)
+                for _key in ('zoneId', 'zoneNumber', 'zoneStartDate', 'zoneDuration'):
+                    currentSchedule.pop(_key, None)
+            else:
+                currentSchedule.clear()
+            return 'run'
+        return None
+
+    def reduceScheduleStatus(self, event, eventTime, device, currentSchedule):
+        _subType = event.get('subType')
+        if _subType == 'SCHEDULE_STARTED':
+            if currentSchedule.get('scheduleRuleId') != event['scheduleId']:
+                currentSchedule.clear()
+                currentSchedule.update({'type': 'AUTOMATIC', 'status': 'PROCESSING', 'deviceId': self.device_id, 'scheduleRuleId': event['scheduleId'],
+                                        'startDate': int(eventTime * 1000), 'duration': event['duration'], 'cycling': False, 'cycleCount': 1, 'totalCycleCount': 1})
+            return 'run'
+        if _subType in ('SCHEDULE_STOPPED', 'SCHEDULE_COMPLETED'):
+            if currentSchedule.get('scheduleRuleId', event['scheduleId']) == event['scheduleId']:
+                currentSchedule.clear()
+            return 'run'
+        if _subType == 'SCHEDULE_RULE_SKIPPED':
+            return 'skip' #nothing cached changes
+        return None
+
+    def reduceRainDelay(self, event, eventTime, device, currentSchedule):
+        _subType = event.get('subType')
+        if _subType == 'RAIN_DELAY_ON':
+            device['rainDelayExpirationDate'] = event['endTime']
+            return 'rainDelay'
+        if _subType == 'RAIN_DELAY_OFF':
+            if 'endTime' in event:
+                device['rainDelayExpirationDate'] = event['endTime']
+            else:
+                device.pop('rainDelayExpirationDate', None)
+            return 'rainDelay'
+        return None
+
+    def reduceDeviceStatus(self, event, eventTime, device, currentSchedule):
+        _subType = event.get('subType')
+        if _subType in ('SLEEP_MODE_ON', 'SLEEP_MODE_OFF'):
+            device['on'] = (_subType == 'SLEEP_MODE_OFF')
+            return 'on'
+        if _subType in ('ONLINE', 'OFFLINE'):
+            device['status'] = _subType
+            return 'status'
+        return None
+
+    def _setDevice(self, device):
+        #Indexes the zones and schedules of a new device snapshot by id so nodes can find their own payload in O(1).  Only the
+        #compact form of the payload is kept (a no-op for payloads that are already compact, apart from the top level copy)
+        device = rachio_drivers.compactDevice(device)
+        self.zones = dict((str(z['id']), z) for z in device.get('zones', []))
+        self.scheduleRules = dict((str(r['id']), r) for r in device.get('scheduleRules', []))
+        self.flexScheduleRules = dict((str(r['id']), r) for r in device.get('flexScheduleRules', []))
+        self.device = device
 
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'waits': self.waits, 'reduced': self.reduced, 'stale': self.stale}
 
-    def delete(self):
-        LOGGER.info('Deleting %s', self.name)
 
-    id = 'rachio'
-    commands = {'DISCOVER': discoverCMD, 'QUERY': query}
-    drivers = [{'driver': 'ST', 'value': 0, 'uom': 2}]
+class RachioNode(polyinterface.Node):
+    """
+    Base class for the Rachio device, zone and schedule nodes.
+
+    Each subclass's drivers are declared in rachio_drivers: "drivers" is generated from its table and
+    extractDrivers, compiled from the same table, turns the sources returned by driverSources() into
+    driver values.  renderDrivers() runs it once per update.
+
+    setDriver only records the new value.  flushDrivers(), called once at the end of each
+    update cycle, publishes the drivers whose value changed since it was last reported (by more
+    than the driver's entry in driverTolerances, if any) as one batch, and counts published and
+    suppressed updates on the controller.  Webhook workers, shortPoll, the refresh scheduler and
+    queries can flush the same node at once, so each flush records and sends under _publishLock:
+    values reach the ISY in the order they were recorded as reported.
+    """
+    driverTolerances = {}
 
+    def __init__(self, parent, primary, address, name):
+        super().__init__(parent, primary, address, name)
+        self._pendingDrivers = {}
+        self._reportedDrivers = rachio_drivers.DRIVER_VALUES[self.id]() #last value published for each driver, unset until the first
+        self._driverLock = threading.Lock() #guards _pendingDrivers
+        self._publishLock = threading.Lock() #serializes flushes, covering both _reportedDrivers and the sends
+
+    def setDriver(self, driver, value, report=True, force=False, uom=None):
+        with self._driverLock:
+            self._pendingDrivers[driver] = value
+
+    def driverSources(self, now):
+        #Sources the node's driver table (rachio_drivers) reads from, see compileExtractor()
+        return {'now': now}
+
+    def renderDrivers(self, now=None):
+        #Fills all of the node's table-driven drivers from its cached Rachio data in one pass and returns their values
+        _values, _missing = self.extractDrivers(self.driverSources(now if now is not None else time.time()))
+        with self._driverLock:
+            self._pendingDrivers.update(_values)
+        if _missing:
+            LOGGER.error('No value for %s in the Rachio data for %s, leaving unchanged', ', '.join(_missing), self.name)
+        return _values
+
+    def _driverChanged(self, driver, value):
+        _last = getattr(self._reportedDrivers, driver, None)
+        if _last is None:
+            return True
+        _tolerance = self.driverTolerances.get(driver, 0)
+        if _tolerance:
+            try:
+                return round(abs(float(value) - float(_last)), 6) >= _tolerance
+            except (TypeError, ValueError):
+                pass
+        return str(value) != str(_last)
 
-class RachioController(polyinterface.Node):
-    def __init__(self, parent, primary, address, name, device):
+    def start(self):
+        self.parent.nodeAcknowledged(self.address)
+
+    def reportDrivers(self):
+        #polyinterface reports drivers through setDriver, so publish the last known values directly instead
+        with self._driverLock:
+            for _driver in self.drivers:
+                self._pendingDrivers.setdefault(_driver['driver'], _driver['value'])
+        self.flushDrivers(force=True)
+
+    @timed('flushDrivers', byNodeType=True)
+    def flushDrivers(self, force=False):
+        #Publishes the changed drivers (all pending drivers if force is set) and returns how many were sent
+        with self._publishLock:
+            with self._driverLock:
+                _pending = self._pendingDrivers
+                self._pendingDrivers = {}
+            _changed = [(d, v) for d, v in _pending.items() if force or self._driverChanged(d, v)]
+            for _driver, _value in _changed:
+                setattr(self._reportedDrivers, _driver, _value)
+                super().setDriver(_driver, _value, report=True, force=True)
+        self.parent.countDriverUpdates(self.id, len(_changed), len(_pending) - len(_changed))
+        return len(_changed)
+
+
+class RachioController(RachioNode):
+    def __init__(self, parent, primary, address, name, device, account=None):
         super().__init__(parent, primary, address, name)
         self.isPrimary = True
         self.primary = primary
         self.parent = parent
-        self.device = device
+        self.account = account or parent.accounts[0] #RachioAccount whose API client and budget serve this controller, its zones and schedules
         self.device_id = device['id']
-        self.lastDeviceUpdateTime = datetime(1970,1,1)
+        self.cache = DeviceSnapshotCache(self.device_id, self._fetchSnapshot, device, parent.cacheRefreshInterval, parent.cacheMaxAge, self.account.governor.ttlFactor, self.account.snapshotUpdated, self.account.governor.serverTime)
         
         self.rainDelay_minutes_remaining = 0
-        self.currentSchedule = []
-        self.lastSchedUpdateTime = datetime(1970,1,1)
-        
-        self._tries = 0
-        self.runTypes = {0: "NONE",
-                              1: "AUTOMATIC",
-                              2: "MANUAL",
-                              3: "OTHER"}
-                              
         self.discoverComplete = False
 
     def start(self):
-        self.update_info(force=True,queryAPI=True)
-        self.discoverComplete = self.discover()
+        super().start()
+        self.update_info(force=False,queryAPI=False) #Polyglot also starts the node again after a rename, which shouldn't cost a refresh
+        self.discover()
+        self.discoverComplete = True
+
+    def desiredChildren(self):
+        #Returns address -> (node class, Rachio id, name, payload) for every zone and schedule in the current device snapshot
+        _desired = {}
+        for z in self.device.get('zones', []):
+            _desired[self.address + str(z['zoneNumber'])] = (RachioZone, str(z['id']), str(z['name']), z) #mac address of controller appended with zone number because ISY limit is 14 characters
+        for _class, _rules in ((RachioSchedule, self.device.get('scheduleRules', [])), (RachioFlexSchedule, self.device.get('flexScheduleRules', []))):
+            for s in _rules:
+                _address = self.scheduleAddress(str(s['id']), _desired)
+                if _address is not None:
+                    _desired[_address] = (_class, str(s['id']), str(s['name']), s)
+        return _desired
+
+    def scheduleAddress(self, schedule_id, desired):
+        #mac address of controller appended with last 2 characters of schedule unique id.  If a zone or another schedule on this
+        #controller already has that address, the next 2 characters from the end of the id are used instead, and the collision is logged
+        _suffixes = [schedule_id[i - 2:i] for i in range(len(schedule_id), 1, -1) if schedule_id[i - 2:i].isalnum()]
+        for _suffix in _suffixes:
+            _address = self.address + _suffix
+            if _address not in desired:
+                if _suffix != _suffixes[0]:
+                    LOGGER.warning('Schedule %s on Rachio Controller %s shares address %s with %s, using address %s instead', schedule_id, self.name, self.address + _suffixes[0], desired[self.address + _suffixes[0]][1], _address)
+                return _address
+        LOGGER.error('No free node address for schedule %s on Rachio Controller %s, it will not be added', schedule_id, self.name)
+        return None
 
     def discover(self, command=None):
-        _success = True
+        #Diffs the zones and schedules in the device snapshot against this controller's existing nodes and applies only the differences:
+        #new ones are queued for addition, deleted ones are removed, renamed ones are renamed, and a node whose address now belongs to a
+        #different Rachio id (e.g. a zone deleted and re-created with the same number) is re-keyed in place.  Returns the number of changes
         LOGGER.info('Discovering nodes on Rachio Controller %s (%s)', self.name, self.address)
+        if 'id' not in self.device:
+            #No device payload has been received yet, an empty snapshot must not remove the zones and schedules
+            LOGGER.warning('No data received yet for Rachio Controller %s (%s), skipping discovery of its zones and schedules', self.name, self.address)
+            return 0
         try:
-            _zones = self.device['zones']
-            LOGGER.info('%i Rachio zones found on "%s" controller. Adding to ISY', len(_zones), self.name)
-            for z in _zones:
-                _zone_id = str(z['id'])
-                _zone_num = str(z['zoneNumber'])
-                _zone_addr = self.address + _zone_num #construct address for this zone (mac address of controller appended with zone number) because ISY limit is 14 characters
-                _zone_name = str(z['name'])
-                if _zone_addr not in self.parent.nodes:
-                    #LOGGER.info('Adding new Rachio Zone to %s Controller, %s(%s)', self.name, _zone_name, _zone_addr)
-                    self.parent.addNodeQueue(RachioZone(self.parent, self.address, _zone_addr, _zone_name, z, self.device_id, self)) #v2.2.0, updated to add node to queue, rather that adding to ISY immediately
-        except Exception as ex:
-            _success = False
-            LOGGER.error('Error discovering and adding Zones on Rachio Controller %s (%s): %s', self.name, self.address, str(ex))
-        
-        try:
-            _schedules = self.device['scheduleRules']
-            LOGGER.info('%i Rachio schedules found on "%s" controller. Adding to ISY', len(_schedules), self.name)
-            for s in _schedules:
-                _sched_id = str(s['id'])
-                _sched_addr = self.address + _sched_id[-2:] #construct address for this schedule (mac address of controller appended with last 2 characters of schedule unique id) because ISY limit is 14 characters
-                _sched_name = str(s['name'])
-                if _sched_addr not in self.parent.nodes:
-                    #LOGGER.info('Adding new Rachio Schedule to %s Controller, %s(%s)', self.name, _sched_name, _sched_addr)
-                    self.parent.addNodeQueue(RachioSchedule(self.parent, self.address, _sched_addr, _sched_name, s, self.device_id, self)) #v2.2.0, updated to add node to queue, rather that adding to ISY immediately
+            _desired = self.desiredChildren()
         except Exception as ex:
-            _success = False
-            LOGGER.error('Error discovering and adding Schedules on Rachio Controller %s (%s): %s', self.name, self.address, str(ex))
+            LOGGER.error('Error reading Zones and Schedules of Rachio Controller %s (%s): %s', self.name, self.address, ex)
+            return 0
+        _existing = dict((n.address, n) for n in self.parent.registry.deviceChildren(self.device_id))
+        _added, _removed, _renamed, _rekeyed = 0, 0, 0, 0
 
-        try:
-            _flex_schedules = self.device['flexScheduleRules']
-            LOGGER.info('%i Rachio Flex schedules found on "%s" controller. Adding to ISY', len(_flex_schedules), self.name)
-            for f in _flex_schedules:
-                _flex_sched_id = str(f['id'])
-                _flex_sched_addr = self.address + _flex_sched_id[-2:] #construct address for this schedule (mac address of controller appended with last 2 characters of schedule unique id) because ISY limit is 14 characters
-                _flex_sched_name = str(f['name'])
-                if _flex_sched_addr not in self.parent.nodes:
-                    #LOGGER.info('Adding new Rachio Flex Schedule to %s Controller, %s(%s)',self.name, _flex_sched_name, _flex_sched_addr)
-                    self.parent.addNodeQueue(RachioFlexSchedule(self.parent, self.address, _flex_sched_addr, _flex_sched_name, f, self.device_id, self)) #v2.2.0, updated to add node to queue, rather that adding to ISY immediately
-        except Exception as ex:
-            _success = False
-            LOGGER.error('Error discovering and adding Flex Schedules on Rachio Controller %s (%s): %s', self.name, self.address, str(ex))
+        for _address, (_class, _id, _name, _payload) in _desired.items():
+            _node = _existing.get(_address)
+            try:
+                if _node is not None and not isinstance(_node, _class):
+                    #e.g. a schedule replaced by a flex schedule whose id ends in the same 2 characters, the node definition differs so re-create it
+                    self.parent.delNode(_address)
+                    _removed += 1
+                    _node = None
+                if _node is None:
+                    if _address not in self.parent.nodes and not self.parent.nodeAdditions.contains(_address):
+                        self.parent.addNodeQueue(_class(self.parent, self.address, _address, _name, _payload, self.device_id, self))
+                        _added += 1
+                    continue
+                if _node.rachioId() != _id:
+                    LOGGER.info('Node %s now represents Rachio id %s (was %s)', _address, _id, _node.rachioId())
+                    _node.rekey(_id, _payload)
+                    _rekeyed += 1
+                if _node.name != _name:
+                    self.parent.renameNode(_node, _name)
+                    _renamed += 1
+            except Exception as ex:
+                LOGGER.error('Error reconciling node %s on Rachio Controller %s (%s): %s', _address, self.name, self.address, ex)
 
-        return _success
-        
-    def getDeviceInfo(self, force=False):
-        try:
-            #Get latest device info and populate drivers
-            _secSinceDeviceUpdate = (datetime.now() - self.lastDeviceUpdateTime).total_seconds()
-            if (_secSinceDeviceUpdate > 5 and force and self.discoverComplete) or _secSinceDeviceUpdate > 3600:
-                _device = self.parent.r_api.device.get(self.device_id)
-                self.device = _device[1]
-                self.lastDeviceUpdateTime = datetime.now()
-                LOGGER.debug('Obtained Device Info for %s, %s/%s API requests remaining until %s', str(self.device_id), str(_device[0]['x-ratelimit-remaining']), str(_device[0]['x-ratelimit-limit']),str(_device[0]['x-ratelimit-reset']))
-                            
-        except Exception as ex:
-            LOGGER.error('Connection Error on %s Rachio Controller API Request. This could mean an issue with internet connectivity or Rachio servers, normally safe to ignore. %s', self.name, str(ex))
-            
-        return self.device
-            
-    def getCurrentSchedule(self, force=False):
-        try:
-              
-            _secSinceSchedUpdate = (datetime.now() - self.lastSchedUpdateTime).total_seconds()
-            if (_secSinceSchedUpdate > 5 and force and self.discoverComplete) or _secSinceSchedUpdate > 3600:
-                _sched = self.parent.r_api.device.getCurrentSchedule(self.device_id)
-                self.currentSchedule = _sched[1]
-                self.lastSchedUpdateTime = datetime.now()
-                LOGGER.debug('Obtained Device Schedule for %s, %s/%s API requests remaining until %s', str(self.device_id), str(_sched[0]['x-ratelimit-remaining']), str(_sched[0]['x-ratelimit-limit']),str(_sched[0]['x-ratelimit-reset']))
+        for _address, _node in _existing.items():
+            if _address not in _desired:
+                LOGGER.info('%s (%s) no longer exists on Rachio Controller %s, removing it', _node.name, _address, self.name)
+                try:
+                    self.parent.delNode(_address)
+                    _removed += 1
+                except Exception as ex:
+                    LOGGER.error('Error removing node %s from Rachio Controller %s (%s): %s', _address, self.name, self.address, ex)
 
-        except Exception as ex:
-            LOGGER.error('Connection Error on %s Rachio Controller current schedule API Request. This could mean an issue with internet connectivity or Rachio servers, normally safe to ignore. %s', self.name, str(ex))
-            return False
-            
-        return self.currentSchedule
+        LOGGER.info('Rachio Controller %s: %i zones/schedules, %i added, %i removed, %i renamed, %i re-keyed', self.name, len(_desired), _added, _removed, _renamed, _rekeyed)
+        return _added + _removed + _renamed + _rekeyed
 
-    def update_info(self, force=False, queryAPI=True):
-        _running = False #initialize variable so that it could be used even if there was not a need to update the running status of the controller
-        self.getDeviceInfo(force=queryAPI)
-        self.getCurrentSchedule(force=queryAPI)
-            
-        # ST -> Status (whether Rachio is running a schedule or not)
-        try:
-            if 'status' in self.currentSchedule:
-                _running = (str(self.currentSchedule['status']) == "PROCESSING")
-                self.setDriver('ST',(0,100)[_running])
-            else:
-                self.setDriver('ST',0)
-        except Exception as ex:
-            LOGGER.error('Error updating current schedule running status on %s Rachio Controller. %s', self.name, str(ex))
+    @property
+    def device(self):
+        return self.cache.device
 
-        # GV0 -> "Connected"
-        try:
-            _connected = (self.device['status'] == "ONLINE")
-            self.setDriver('GV0',int(_connected))
-        except Exception as ex:
-            self.setDriver('GV0',0)
-            LOGGER.error('Error updating connection status on %s Rachio Controller. %s', self.name, str(ex))
+    @property
+    def currentSchedule(self):
+        return self.cache.currentSchedule
 
-        # GV1 -> "Enabled"
-        try:
-            self.setDriver('GV1',int(self.device['on']))
-        except Exception as ex:
-            self.setDriver('GV1',0)
-            LOGGER.error('Error updating status on %s Rachio Controller. %s', self.name, str(ex))
+    def _fetchSnapshot(self):
+        #Called by the snapshot cache, only ever runs one at a time for this device
+        if not self.account.governor.allowRefresh():
+            LOGGER.info('Skipping refresh of %s Rachio Controller, remaining API requests of %s are reserved for commands until %s', self.name, self.account.name, self.account.governor.resetText())
+            return None, None
+        return self.fetchDevice(), self.fetchCurrentSchedule()
 
-        # GV2 -> "Paused"
+    def fetchDevice(self):
+        #Returns the device payload from the Rachio API, or None if the request failed
+        _device = None
         try:
-            if 'paused' in self.device:
-                self.setDriver('GV2', int(self.device['paused']))
-            else:
-                self.setDriver('GV2', 0)
+            _resp = self.account.governor.get('device.get', self.account.r_api.device.get, self.device_id)
+            _device = _resp[1]
+            LOGGER.debug('Obtained Device Info for %s, %s/%s API requests remaining until %s', self.device_id, _resp[0].get('x-ratelimit-remaining'), _resp[0].get('x-ratelimit-limit'),_resp[0].get('x-ratelimit-reset'))
         except Exception as ex:
-            LOGGER.error('Error updating paused status on %s Rachio Controller. %s', self.name, str(ex))
+            LOGGER.error('Connection Error on %s Rachio Controller API Request. This could mean an issue with internet connectivity or Rachio servers, normally safe to ignore. %s', self.name, ex)
+        return _device
 
-        # GV3 -> "Rain Delay Remaining" in Minutes
-        try:
-            if 'rainDelayExpirationDate' in self.device: 
-                _current_time = int(time.time())
-                _rainDelayExpiration = self.device['rainDelayExpirationDate'] / 1000.
-                _rainDelay_minutes_remaining = int(max(_rainDelayExpiration - _current_time,0) / 60.)
-                self.setDriver('GV3', _rainDelay_minutes_remaining)
-                self.rainDelay_minutes_remaining = _rainDelay_minutes_remaining
-            else: self.setDriver('GV3', 0)
-        except Exception as ex:
-            LOGGER.error('Error updating remaining rain delay duration on %s Rachio Controller. %s', self.name, str(ex))
-        
-        # GV10 -> Active Run Type
+    def fetchCurrentSchedule(self):
+        #Returns the current_schedule payload from the Rachio API, or None if the request failed
+        _schedule = None
         try:
-            if 'type' in self.currentSchedule: # True when a schedule is running
-                _runType = self.currentSchedule['type']
-                _runVal = 3 #default to "OTHER"
-                for key in self.runTypes:
-                    if self.runTypes[key].lower() == _runType.lower():
-                        _runVal = key
-                        break
-                self.setDriver('GV10', _runVal)
-            else: 
-                self.setDriver('GV10', 0)
+            _resp = self.account.governor.get('device.getCurrentSchedule', self.account.r_api.device.getCurrentSchedule, self.device_id)
+            _schedule = _resp[1]
+            LOGGER.debug('Obtained Device Schedule for %s, %s/%s API requests remaining until %s', self.device_id, _resp[0].get('x-ratelimit-remaining'), _resp[0].get('x-ratelimit-limit'),_resp[0].get('x-ratelimit-reset'))
         except Exception as ex:
-            LOGGER.error('Error updating active run type on %s Rachio Controller. %s', self.name, str(ex))
+            LOGGER.error('Connection Error on %s Rachio Controller current schedule API Request. This could mean an issue with internet connectivity or Rachio servers, normally safe to ignore. %s', self.name, ex)
+        return _schedule
 
-        # GV4 -> Active Zone #
-        if 'zoneId' in self.currentSchedule:
-            try:
-                if queryAPI:
-                    _active_zone = self.currentSchedule['zoneId']
-                    self.setDriver('GV4',_active_zone[1]['zoneNumber'])
-            except Exception as ex:
-                LOGGER.error('Error updating active zone on %s Rachio Controller. %s', self.name, str(ex))
-        else: #no schedule running:
-            self.setDriver('GV4',0)
-        
-        # GV5 -> Active Schedule remaining minutes and GV6 -> Active Schedule minutes elapsed
-        try:
-            if 'startDate' in self.currentSchedule and 'duration' in self.currentSchedule:
-                _current_time = int(time.time())
-                _start_time = int(self.currentSchedule['startDate'] / 1000)
-                _duration = int(self.currentSchedule['duration'])
-
-                _seconds_elapsed = max(_current_time - _start_time,0)
-                _minutes_elapsed = round(_seconds_elapsed / 60. ,1)
-                
-                _seconds_remaining = max(_duration - _seconds_elapsed,0)
-                _minutes_remaining = round(_seconds_remaining / 60. ,1)
-
-                self.setDriver('GV5',_minutes_remaining)
-                self.setDriver('GV6',_minutes_elapsed)
-                #LOGGER.info('%f minutes elapsed and %f minutes remaining on %s Rachio Controller. %s', _minutes_elapsed, _minutes_remaining, self.name)
-            else: 
-                self.setDriver('GV5',0.0)
-                self.setDriver('GV6',0.0)
-        except Exception as ex:
-            LOGGER.error('Error trying to retrieve active schedule minutes remaining/elapsed on %s Rachio Controller. %s', self.name, str(ex))
+    def getSnapshot(self, force=False, since=None):
+        #Returns (device, currentSchedule) from the shared cache.  Forced refreshes are only honored once discovery is complete
+        return self.cache.get(force=(force and self.discoverComplete), since=(since if self.discoverComplete else None))
 
-        # GV7 -> Cycling (true/false)
-        try:
-            if 'cycling' in self.currentSchedule:
-                self.setDriver('GV7',int(self.currentSchedule['cycling']))
-            else: self.setDriver('GV7', 0) #no schedule active
-        except Exception as ex:
-            LOGGER.error('Error trying to retrieve cycling status on %s Rachio Controller. %s', self.name, str(ex))
-        
-        # GV8 -> Cycle Count
-        try:
-            if 'cycleCount' in self.currentSchedule:
-                self.setDriver('GV8',self.currentSchedule['cycleCount'])
-            else: self.setDriver('GV8',0) #no schedule active
-        except Exception as ex:
-            LOGGER.error('Error trying to retrieve cycle count on %s Rachio Controller. %s', self.name, str(ex))
+    def getDeviceInfo(self, force=False):
+        return self.getSnapshot(force)[0]
+            
+    def getCurrentSchedule(self, force=False):
+        return self.getSnapshot(force)[1]
 
-        # GV9 -> Total Cycle Count
+    @timed('update_info', byNodeType=True)
+    def update_info(self, force=False, queryAPI=True):
+        self.getSnapshot(force=queryAPI)
         try:
-            if 'totalCycleCount' in self.currentSchedule:
-                self.setDriver('GV9',self.currentSchedule['totalCycleCount'])
-            else: self.setDriver('GV9',0) #no schedule active
+            _values = self.renderDrivers()
+            self.rainDelay_minutes_remaining = _values.get('GV3', 0)
         except Exception as ex:
-            LOGGER.error('Error trying to retrieve total cycle count on %s Rachio Controller. %s', self.name, str(ex))
-       
-        if force: self.reportDrivers()
+            LOGGER.error('Error updating drivers on %s Rachio Controller. %s', self.name, ex)
+        self.flushDrivers(force)
         return True
-    
+
+    def driverSources(self, now):
+        _schedule = self.currentSchedule
+        _activeZone = self.cache.activeZone()
+        if _activeZone is None and self.cache.activeZoneId() is not None: #zone not in the device snapshot yet (e.g. just added), use the number reported with the run
+            _activeZone = {'zoneNumber': _schedule.get('zoneNumber', 0)}
+        return {'device': self.device, 'schedule': _schedule, 'activeZone': _activeZone or {}, 'now': now}
+
+    def tick(self, now=None):
+        #Called every shortPoll.  Re-derives the countdown drivers (GV3, GV5, GV6) from the cached snapshot without any API requests and
+        #publishes one only when its displayed whole minute changes (or it reaches zero).  Returns the number of drivers published
+        if self.rainDelay_minutes_remaining == 0 and 'startDate' not in self.currentSchedule and not getattr(self._reportedDrivers, 'GV5', 0) and not getattr(self._reportedDrivers, 'GV6', 0):
+            return 0 #Nothing counting down (and zeros already shown)
+        _values = self.extractDrivers(self.driverSources(now if now is not None else time.time()))[0]
+        self.rainDelay_minutes_remaining = _values['GV3']
+        _changed = 0
+        for _driver in ('GV3', 'GV5', 'GV6'):
+            _value = _values[_driver]
+            try:
+                _last = float(getattr(self._reportedDrivers, _driver, -1))
+            except (TypeError, ValueError):
+                _last = -1.
+            if int(_last) != int(_value) or (_last == 0) != (_value == 0):
+                self.setDriver(_driver, _value)
+                _changed += 1
+        if _changed:
+            self.flushDrivers()
+        return _changed
 
     def query(self, command = None):
         LOGGER.info('query command received on %s Rachio Controller.', self.name)
@@ -574,46 +2593,17 @@ class RachioController(polyinterface.Node):
         return True
 
     def enable(self, command): #Enables Rachio (schedules, weather intelligence, water budget, etc...)
-        self._tries = 0
-        while self._tries < 2: #TODO: the first command to the Rachio server fails frequently for some reason with an SSL WRONG_VERSION_NUMBER error.  This is a temporary workaround to try a couple of times before giving up
-            try:
-                self.parent.r_api.device.on(self.device_id)
-                #self.update_info() Rely on webhook to update on device's change in status
-                LOGGER.info('Command received to enable %s Controller',self.name)
-                self._tries = 0
-                return True
-            except Exception as ex:
-                LOGGER.error('Error turning on %s. %s', self.name, str(ex))
-                self._tries = self._tries + 1
-        return False
+        LOGGER.info('Command received to enable %s Controller',self.name)
+        #Rely on webhook to update on device's change in status
+        return self.parent.runCommand(self.device_id, (self.address, 'DON'), 'Enable ' + self.name, 'device.on', self.account.r_api.device.on, self.device_id)
 
     def disable(self, command): #Disables Rachio (schedules, weather intelligence, water budget, etc...)
-        self._tries = 0
-        while self._tries < 2: #TODO: the first command to the Rachio server fails frequently for some reason with an SSL WRONG_VERSION_NUMBER error.  This is a temporary workaround to try a couple of times before giving up
-            try:
-                self.parent.r_api.device.off(self.device_id)
-                #self.update_info() Rely on webhook to update on device's change in status
-                LOGGER.info('Command received to disable %s Controller',self.name)
-                self._tries = 0
-                return True
-            except Exception as ex:
-                LOGGER.error('Error turning off %s. %s', self.name, str(ex))
-                self._tries = self._tries + 1
-        return False
+        LOGGER.info('Command received to disable %s Controller',self.name)
+        return self.parent.runCommand(self.device_id, (self.address, 'DOF'), 'Disable ' + self.name, 'device.off', self.account.r_api.device.off, self.device_id)
 
     def stopCmd(self, command):
-        self._tries = 0
-        while self._tries < 2: #TODO: the first command to the Rachio server fails frequently for some reason with an SSL WRONG_VERSION_NUMBER error.  This is a temporary workaround to try a couple of times before giving up
-            try:
-                self.parent.r_api.device.stopWater(self.device_id)
-                LOGGER.info('Command received to stop watering on %s Controller',self.name)
-                #self.update_info() Rely on webhook to update on device's change in status
-                self._tries = 0
-                return True
-            except Exception as ex:
-                LOGGER.error('Error stopping watering on %s. %s', self.name, str(ex))
-                self._tries = self._tries + 1
-        return False
+        LOGGER.info('Command received to stop watering on %s Controller',self.name)
+        return self.parent.runCommand(self.device_id, (self.address, 'STOP'), 'Stop watering on ' + self.name, 'device.stopWater', self.account.r_api.device.stopWater, self.device_id)
     
     def rainDelay(self, command):
         _minutes = command.get('value')
@@ -621,38 +2611,22 @@ class RachioController(polyinterface.Node):
             LOGGER.error('Rain Delay requested on %s Rachio Controller but no duration specified', self.name)
             return False
         else:
-            LOGGER.info('Received rain Delay command on %s Rachio Controller for %s minutes', self.name, str(_minutes))
-            self._tries = 0
-            while self._tries < 2: #TODO: the first command to the Rachio server fails frequently for some reason with an SSL WRONG_VERSION_NUMBER error.  This is a temporary workaround to try a couple of times before giving up
-                try:
-                    _seconds = int(float(_minutes) * 60.)
-                    self.parent.r_api.device.rainDelay(self.device_id, _seconds)
-                    #self.update_info() Rely on webhook to update on device's change in status
-                    self._tries = 0
-                    return True
-                except Exception as ex:
-                    LOGGER.error('Error setting rain delay on %s Rachio Controller (%s)', self.name, str(ex))
-                    self._tries = self._tries +1
-            return False
+            LOGGER.info('Received rain Delay command on %s Rachio Controller for %s minutes', self.name, _minutes)
+            try:
+                _seconds = int(float(_minutes) * 60.)
+            except Exception as ex:
+                LOGGER.error('Error setting rain delay on %s Rachio Controller (%s)', self.name, ex)
+                return False
+            return self.parent.runCommand(self.device_id, (self.address, 'RAIN_DELAY', _seconds), 'Rain delay of ' + str(_minutes) + ' minutes on ' + self.name, 'device.rainDelay', self.account.r_api.device.rainDelay, self.device_id, _seconds)
 
-    drivers = [{'driver': 'ST', 'value': 0, 'uom': 78}, #Status (On/Off)
-               {'driver': 'GV0', 'value': 0, 'uom': 2}, #Connected (True/False)
-               {'driver': 'GV1', 'value': 0, 'uom': 2}, #Enabled (True/False)
-               {'driver': 'GV2', 'value': 0, 'uom': 2}, #Paused (True/False)
-               {'driver': 'GV3', 'value': 0, 'uom': 45}, #Rain Delay Minutes Remaining (Minutes)
-               {'driver': 'GV4', 'value': 0, 'uom': 56}, #Active Zone # (Raw Value)
-               {'driver': 'GV5', 'value': 0, 'uom': 45}, #Active Schedule Minutes Remaining (Minutes)
-               {'driver': 'GV6', 'value': 0, 'uom': 45}, #Active Schedule Minutes Elapsed (Minutes)
-               {'driver': 'GV7', 'value': 0, 'uom': 2}, #Cycling (True/False)
-               {'driver': 'GV8', 'value': 0, 'uom': 56}, #Cycle Count (Raw Value)
-               {'driver': 'GV9', 'value': 0, 'uom': 56}, #Total Cycle Count (Raw Value)
-               {'driver': 'GV10', 'value': 0, 'uom': 25} #Current Schedule Type (Enumeration)
-               ]
+    drivers = rachio_drivers.driverList('rachio_device')
+    extractDrivers = staticmethod(rachio_drivers.compileExtractor('rachio_device'))
 
+    driverTolerances = {'GV5': 0.1, 'GV6': 0.1} #Schedule minutes remaining/elapsed are reported to a tenth of a minute
     id = 'rachio_device'
     commands = {'DON': enable, 'DOF': disable, 'QUERY': query, 'STOP': stopCmd, 'RAIN_DELAY': rainDelay}
 
-class RachioZone(polyinterface.Node):
+class RachioZone(RachioNode):
     def __init__(self, parent, primary, address, name, zone, device_id, device):
         super().__init__(parent, primary, address, name)
         self.device_id = device_id
@@ -661,124 +2635,47 @@ class RachioZone(polyinterface.Node):
         self.zone_id = zone['id']
         self.name = name
         self.address = address
-        self.rainDelayExpiration = 0
-        self.currentSchedule = []
-        self._tries = 0
 
     def start(self):
-        self.update_info(force=True,queryAPI=True)
+        super().start()
+        self.update_info(force=False,queryAPI=False) #The controller node has already loaded (or restored) the snapshot this node reads from
 
     def discover(self, command=None):
         # No discovery needed (no nodes are subordinate to Zones)
         pass
 
+    def rachioId(self):
+        return str(self.zone_id)
+
+    def rekey(self, zone_id, zone):
+        #Points this node at a different Rachio zone that now has this node's address (zone number)
+        self.parent.registry.unregister(self)
+        self.zone_id = zone_id
+        self.zone = zone
+        self.parent.registry.register(self)
+        self.update_info(force=False, queryAPI=False)
+
+    @timed('update_info', byNodeType=True)
     def update_info(self, force=False, queryAPI=True):
-        _running = False #initialize variable so that it could be used even if there was not a need to update the running status of the zone
         #Updating info for zone %s with id %s, force=%s',self.address, str(self.zone_id), str(force))
         try:
-            _deviceInfo = self.device.getDeviceInfo(force=queryAPI)
-            for z in _deviceInfo['zones']:
-                _zone_id = str(z['id'])
-                if _zone_id == self.zone_id:
-                    self.zone = z
-                    break
-            
-            self.currentSchedule = self.device.getCurrentSchedule(force=queryAPI)
+            self.device.getSnapshot(force=queryAPI)
+            self.zone = self.device.cache.zones.get(str(self.zone_id), self.zone)
 
         except Exception as ex:
-            LOGGER.error(' Error retrieving zone info for "%s"', self.name, str(ex))
+            LOGGER.error(' Error retrieving zone info for "%s": %s', self.name, ex)
             return False
-            
-        # ST -> Status (whether Rachio zone is running a schedule or not)
-        try:
-            if 'status' in self.currentSchedule and 'zoneId' in self.currentSchedule:
-                _running = (str(self.currentSchedule['status']) == "PROCESSING") and (self.currentSchedule['zoneId'] == self.zone_id)
-                self.setDriver('ST',(0,100)[_running])
-            else:
-                self.setDriver('ST',0)
-        except Exception as ex:
-            LOGGER.error('Error updating current schedule running status on %s Rachio Zone. %s', self.name, str(ex))
 
-        # GV0 -> "Enabled"
         try:
-            self.setDriver('GV0',int(self.zone['enabled']))
+            self.renderDrivers()
         except Exception as ex:
-            self.setDriver('GV0',0)
-            LOGGER.error('Error updating enable status on %s Rachio Zone. %s', self.name, str(ex))
-
-        # GV1 -> "Zone Number"
-        try:
-            self.setDriver('GV1', self.zone['zoneNumber'])
-        except Exception as ex:
-            LOGGER.error('Error updating zone number on %s Rachio Zone. %s', self.name, str(ex))
-
-        # GV2 -> Available Water
-        # TODO: Not 100% sure what this is or if the units are correct, need to see if Rachio has any additional info
-        try:
-            self.setDriver('GV2', self.zone['availableWater'])
-        except Exception as ex:
-            LOGGER.error('Error updating available water on %s Rachio Zone. %s', self.name, str(ex))
-
-        # GV3 -> root zone depth
-        # TODO: Not 100% sure what this is or if the units are correct, need to see if Rachio has any additional info
-        try:
-            self.setDriver('GV3', self.zone['rootZoneDepth'])
-        except Exception as ex:
-            LOGGER.error('Error updating root zone depth on %s Rachio Zone. %s', self.name, str(ex))
-
-        # GV4 -> allowed depletion
-        # TODO: Not 100% sure what this is or if the units are correct, need to see if Rachio has any additional info
-        try:
-            self.setDriver('GV4', self.zone['managementAllowedDepletion'])
-        except Exception as ex:
-            LOGGER.error('Error updating allowed depletion on %s Rachio Zone. %s', self.name, str(ex))
-
-        # GV5 -> efficiency
-        try:
-            self.setDriver('GV5', int(self.zone['efficiency'] * 100.))
-        except Exception as ex:
-            LOGGER.error('Error updating efficiency on %s Rachio Zone. %s', self.name, str(ex))
-
-        # GV6 -> square feet
-        # TODO: This is in square feet, but there's no unit available in the ISY for square feet.  Update if UDI makes it available
-        try:
-            self.setDriver('GV6', self.zone['yardAreaSquareFeet'])
-        except Exception as ex:
-            LOGGER.error('Error updating square footage on %s Rachio Zone. %s', self.name, str(ex))
-
-        # GV7 -> irrigation amount
-        # TODO: Not 100% sure what this is or if the units are correct, need to see if Rachio has any additional info
-        try:
-            if 'irrigationAmount' in self.zone:
-                self.setDriver('GV7', self.zone['irrigationAmount'])
-            else:
-                self.setDriver('GV7', 0)
-        except Exception as ex:
-            LOGGER.error('Error updating irrigation amount on %s Rachio Zone. %s', self.name, str(ex))
-
-        # GV8 -> depth of water
-        # TODO: Not 100% sure what this is or if the units are correct, need to see if Rachio has any additional info
-        try:
-            self.setDriver('GV8', self.zone['depthOfWater'])
-        except Exception as ex:
-            LOGGER.error('Error updating depth of water on %s Rachio Zone. %s', self.name, str(ex))
-
-        # GV9 -> runtime
-        # TODO: Not 100% sure what this is or if the units are correct, need to see if Rachio has any additional info
-        try:
-            self.setDriver('GV9', self.zone['runtime'])
-        except Exception as ex:
-            LOGGER.error('Error updating runtime on %s Rachio Zone. %s', self.name, str(ex))
-
-        # GV10 -> inches per hour
-        try:
-            self.setDriver('GV10', self.zone['customNozzle']['inchesPerHour'])
-        except Exception as ex:
-            LOGGER.error('Error updating inches per hour on %s Rachio Zone. %s', self.name, str(ex))
-        
-        if force: self.reportDrivers()
+            LOGGER.error('Error updating drivers on %s Rachio Zone. %s', self.name, ex)
+        self.flushDrivers(force)
         return True
 
+    def driverSources(self, now):
+        return {'zone': self.zone, 'state': {'running': self.device.cache.activeZoneId() == str(self.zone_id)}, 'now': now}
+
     def query(self, command = None):
         LOGGER.info('query command received on %s Rachio Zone', self.name)
         self.update_info(force=True,queryAPI=True)
@@ -789,42 +2686,26 @@ class RachioZone(polyinterface.Node):
         if _minutes is None:
             LOGGER.error('Zone %s requested to start but no duration specified', self.name)
             return False
-        else:
-            self._tries = 0
-            while self._tries < 2: #TODO: the first command to the Rachio server fails frequently for some reason with an SSL WRONG_VERSION_NUMBER error.  This is a temporary workaround to try a couple of times before giving up
-                try:
-                    if _minutes == 0:
-                        LOGGER.error('Zone %s requested to start but duration specified was zero', self.name)
-                        return False
-                    _seconds = int(float(_minutes) * 60.)
-                    self.parent.r_api.zone.start(self.zone_id, _seconds)
-                    LOGGER.info('Command received to start watering zone %s for %s minutes',self.name, str(_minutes))
-                    #self.update_info() Rely on webhook to update on device's change in status
-                    self._tries = 0
-                    return True
-                except Exception as ex:
-                    LOGGER.error('Error starting watering on zone %s. %s', self.name, str(ex))
-                    self._tries = self._tries + 1
+        elif _minutes == 0:
+            LOGGER.error('Zone %s requested to start but duration specified was zero', self.name)
             return False
+        else:
+            try:
+                _seconds = int(float(_minutes) * 60.)
+            except Exception as ex:
+                LOGGER.error('Error starting watering on zone %s. %s', self.name, ex)
+                return False
+            LOGGER.info('Command received to start watering zone %s for %s minutes',self.name, _minutes)
+            #Rely on webhook to update on device's change in status
+            return self.parent.runCommand(self.device_id, (self.address, 'START', _seconds), 'Start watering zone ' + self.name + ' for ' + str(_minutes) + ' minutes', 'zone.start', self.device.account.r_api.zone.start, self.zone_id, _seconds)
 
-    drivers = [{'driver': 'ST', 'value': 0, 'uom': 78}, #Running (On/Off)
-               {'driver': 'GV0', 'value': 0, 'uom': 2}, #Enabled (True/False)
-               {'driver': 'GV1', 'value': 0, 'uom': 56}, #Zone Number (Raw Value)
-               {'driver': 'GV2', 'value': 0, 'uom': 105}, #Available Water (Inches)
-               {'driver': 'GV3', 'value': 0, 'uom': 105}, #Root Zone Depth (Inches)
-               {'driver': 'GV4', 'value': 0, 'uom': 105}, #Allowed Depletion (Inches)
-               {'driver': 'GV5', 'value': 0, 'uom': 51}, #Efficiency (Percent)
-               {'driver': 'GV6', 'value': 0, 'uom': 18}, #Zone Area (*Square* Feet)
-               {'driver': 'GV7', 'value': 0, 'uom': 105}, #Irrigation Amount (Inches)
-               {'driver': 'GV8', 'value': 0, 'uom': 105}, #Depth of Water (Inches)
-               {'driver': 'GV9', 'value': 0, 'uom': 45}, #Runtime (Minutes)
-               {'driver': 'GV10', 'value': 0, 'uom': 24} #Inches per Hour
-               ]
+    drivers = rachio_drivers.driverList('rachio_zone')
+    extractDrivers = staticmethod(rachio_drivers.compileExtractor('rachio_zone'))
 
     id = 'rachio_zone'
     commands = {'QUERY': query, 'START': startCmd}
 
-class RachioSchedule(polyinterface.Node):
+class RachioSchedule(RachioNode):
     def __init__(self, parent, primary, address, name, schedule, device_id, device):
         super().__init__(parent, primary, address, name)
         self.device_id = device_id
@@ -833,141 +2714,80 @@ class RachioSchedule(polyinterface.Node):
         self.schedule_id = schedule['id']
         self.name = name
         self.address = address
-        self.currentSchedule = []
-        self.scheduleItems = []
-        self._tries = 0
 
     def start(self):
-        self.update_info(force=True,queryAPI=True)
+        super().start()
+        self.update_info(force=False,queryAPI=False) #The controller node has already loaded (or restored) the snapshot this node reads from
 
     def discover(self, command=None):
         # No discovery needed (no nodes are subordinate to Schedules)
         pass
+
+    def rachioId(self):
+        return str(self.schedule_id)
+
+    def rekey(self, schedule_id, schedule):
+        #Points this node at a different Rachio schedule whose id ends in the same 2 characters
+        self.parent.registry.unregister(self)
+        self.schedule_id = schedule_id
+        self.schedule = schedule
+        self.parent.registry.register(self)
+        self.update_info(force=False, queryAPI=False)
         
+    @timed('update_info', byNodeType=True)
     def update_info(self, force=False, queryAPI=True):
-        _running = False #initialize variable so that it could be used even if there was not a need to update the running status of the schedule
         try:
-            _deviceInfo = self.device.getDeviceInfo(force=queryAPI)
-            for s in _deviceInfo['scheduleRules']:
-                _sched_id = str(s['id'])
-                if _sched_id == self.schedule_id:
-                    self.schedule = s
-                    break
-            
-            self.currentSchedule = self.device.getCurrentSchedule(force=queryAPI)
+            self.device.getSnapshot(force=queryAPI)
+            self.schedule = self.device.cache.scheduleRules.get(str(self.schedule_id), self.schedule)
 
         except Exception as ex:
-            LOGGER.error(' Error retrieving schedule info for "%s"', self.name, str(ex))
+            LOGGER.error(' Error retrieving schedule info for "%s": %s', self.name, ex)
             return False
-                  
-        # ST -> Status (whether Rachio schedule is running a schedule or not)
-        try:
-            if 'scheduleRuleId' in self.currentSchedule:
-                _running = (self.currentSchedule['scheduleRuleId'] == self.schedule_id)
-                self.setDriver('ST',(0,100)[_running])
-            else:
-                self.setDriver('ST',0)
-        except Exception as ex:
-            LOGGER.error('Error updating current schedule running status on %s Rachio Schedule. %s', self.name, str(ex))
 
-        # GV0 -> "Enabled"
         try:
-            self.setDriver('GV0',int(self.schedule['enabled']))
-        except Exception as ex:
-            LOGGER.error('Error updating enable status on %s Rachio Schedule. %s', self.name, str(ex))
-
-        # GV1 -> "rainDelay" status
-        try:
-            if 'rainDelay' in self.schedule:
-                self.setDriver('GV1',int(self.schedule['rainDelay']))
-            else:
-                self.setDriver('GV1',0)
+            self.renderDrivers()
         except Exception as ex:
-            LOGGER.error('Error updating schedule rain delay on %s Rachio Schedule. %s', self.name, str(ex))
+            LOGGER.error('Error updating drivers on %s Rachio Schedule. %s', self.name, ex)
+        self.flushDrivers(force)
+        return True
 
-        # GV2 -> duration (minutes)
-        try:
-            _seconds = float(self.schedule['totalDuration'])
-            _minutes = int(_seconds / 60.)
-            self.setDriver('GV2', _minutes)
-        except Exception as ex:
-            LOGGER.error('Error updating total duration on %s Rachio Schedule. %s', self.name, str(ex))
+    def driverSources(self, now):
+        return {'rule': self.schedule, 'state': {'running': self.device.currentSchedule.get('scheduleRuleId') == self.schedule_id}, 'now': now}
 
-        # GV3 -> seasonal adjustment
-        try:
-            if 'seasonalAdjustment' in self.schedule:
-                _seasonalAdjustment = float(self.schedule['seasonalAdjustment']) * 100.
-                self.setDriver('GV3', _seasonalAdjustment)
-        except Exception as ex:
-            LOGGER.error('Error updating seasonal adjustment on %s Rachio Schedule. %s', self.name, str(ex))
-
-        if force: self.reportDrivers()
-        return True
-        
     def query(self, command = None):
         LOGGER.info('query command received on %s Rachio Schedule.', self.name)
         self.update_info(force=True,queryAPI=True)
         return True
 
     def startCmd(self, command):
-        self._tries = 0
-        while self._tries < 2: #TODO: the first command to the Rachio server fails frequently for some reason with an SSL WRONG_VERSION_NUMBER error.  This is a temporary workaround to try a couple of times before giving up
-            try:
-                self.parent.r_api.schedulerule.start(self.schedule_id)
-                LOGGER.info('Command received to start watering schedule %s',self.name)
-                #self.update_info() Rely on webhook to update on device's change in status
-                self._tries = 0
-                return True
-            except Exception as ex:
-                LOGGER.error('Error starting watering on schedule %s. %s', self.name, str(ex))
-                self._tries = self._tries + 1
-        return False
+        LOGGER.info('Command received to start watering schedule %s',self.name)
+        #Rely on webhook to update on device's change in status
+        return self.parent.runCommand(self.device_id, (self.address, 'START'), 'Start watering schedule ' + self.name, 'schedulerule.start', self.device.account.r_api.schedulerule.start, self.schedule_id)
     
     def skip(self, command):
-        self._tries = 0
-        while self._tries < 2: #TODO: the first command to the Rachio server fails frequently for some reason with an SSL WRONG_VERSION_NUMBER error.  This is a temporary workaround to try a couple of times before giving up
-            try:
-                self.parent.r_api.schedulerule.skip(self.schedule_id)
-                LOGGER.info('Command received to skip watering schedule %s',self.name)
-                #self.update_info() Rely on webhook to update on device's change in status
-                self._tries = 0
-                return True
-            except Exception as ex:
-                LOGGER.error('Error skipping watering on schedule %s. %s', self.name, str(ex))
-                self._tries = self._tries = 1
-        return False
+        LOGGER.info('Command received to skip watering schedule %s',self.name)
+        return self.parent.runCommand(self.device_id, (self.address, 'SKIP'), 'Skip watering schedule ' + self.name, 'schedulerule.skip', self.device.account.r_api.schedulerule.skip, self.schedule_id)
 
     def seasonalAdjustment(self, command):
-        self._tries = 0
-        while self._tries < 2: #TODO: the first command to the Rachio server fails frequently for some reason with an SSL WRONG_VERSION_NUMBER error.  This is a temporary workaround to try a couple of times before giving up
-            try:
-                _value = float(command.get('value'))
-                if _value is not None:
-                    _value = _value / 100.
-                    self.parent.r_api.schedulerule.seasonalAdjustment(self.schedule_id, _value)
-                    LOGGER.info('Command received to change seasonal adjustment on schedule %s to %s',self.name, str(_value))
-                    #self.update_info() Rely on webhook to update on device's change in status
-                    self._tries = 0
-                    return True
-                else:
-                    LOGGER.error('Command received to change seasonal adjustment on schedule %s but no value supplied',self.name)
-                    return False
-            except Exception as ex:
-                LOGGER.error('Error changing seasonal adjustment on schedule %s. %s', self.name, str(ex))
-                self._tries = self._tries + 1
-        return False
+        _value = command.get('value')
+        if _value is None:
+            LOGGER.error('Command received to change seasonal adjustment on schedule %s but no value supplied',self.name)
+            return False
+        try:
+            _value = float(_value) / 100.
+        except Exception as ex:
+            LOGGER.error('Error changing seasonal adjustment on schedule %s. %s', self.name, ex)
+            return False
+        LOGGER.info('Command received to change seasonal adjustment on schedule %s to %s',self.name, _value)
+        return self.parent.runCommand(self.device_id, (self.address, 'ADJUST', _value), 'Seasonal adjustment of ' + str(_value) + ' on schedule ' + self.name, 'schedulerule.seasonalAdjustment', self.device.account.r_api.schedulerule.seasonalAdjustment, self.schedule_id, _value)
 
-    drivers = [{'driver': 'ST', 'value': 0, 'uom': 78}, #Running (On/Off)
-               {'driver': 'GV0', 'value': 0, 'uom': 2}, #Enabled (True/False)
-               {'driver': 'GV1', 'value': 0, 'uom': 2}, #Rain Delay (True/False)
-               {'driver': 'GV2', 'value': 0, 'uom': 45}, #Duration (Minutes)
-               {'driver': 'GV3', 'value': 0, 'uom': 51} #Seasonal Adjustment (Percent)
-               ]
+    drivers = rachio_drivers.driverList('rachio_schedule')
+    extractDrivers = staticmethod(rachio_drivers.compileExtractor('rachio_schedule'))
 
     id = 'rachio_schedule'
     commands = {'QUERY': query, 'START': startCmd, 'SKIP':skip, 'ADJUST':seasonalAdjustment}
 
-class RachioFlexSchedule(polyinterface.Node):
+class RachioFlexSchedule(RachioNode):
     def __init__(self, parent, primary, address, name, schedule, device_id, device):
         super().__init__(parent, primary, address, name)
         self.device_id = device_id
@@ -976,96 +2796,103 @@ class RachioFlexSchedule(polyinterface.Node):
         self.schedule_id = schedule['id']
         self.name = name
         self.address = address
-        self.currentSchedule = []
-        self._tries = 0
 
     def start(self):
-        self.update_info(force=True,queryAPI=True)
+        super().start()
+        self.update_info(force=False,queryAPI=False) #The controller node has already loaded (or restored) the snapshot this node reads from
 
     def discover(self, command=None):
         # No discovery needed (no nodes are subordinate to Flex Schedules)
         pass
 
+    def rachioId(self):
+        return str(self.schedule_id)
+
+    def rekey(self, schedule_id, schedule):
+        #Points this node at a different Rachio schedule whose id ends in the same 2 characters
+        self.parent.registry.unregister(self)
+        self.schedule_id = schedule_id
+        self.schedule = schedule
+        self.parent.registry.register(self)
+        self.update_info(force=False, queryAPI=False)
+
+    @timed('update_info', byNodeType=True)
     def update_info(self, force=False, queryAPI=True):
-        _running = False #initialize variable so that it could be used even if there was not a need to update the running status of the schedule
         try:
-            _deviceInfo = self.device.getDeviceInfo(force=queryAPI)
-            for s in _deviceInfo['flexScheduleRules']:
-                _sched_id = str(s['id'])
-                if _sched_id == self.schedule_id:
-                    self.schedule = s
-                    break
-            
-            self.currentSchedule = self.device.getCurrentSchedule(force=queryAPI)
+            self.device.getSnapshot(force=queryAPI)
+            self.schedule = self.device.cache.flexScheduleRules.get(str(self.schedule_id), self.schedule)
 
         except Exception as ex:
-            LOGGER.error(' Error retrieving flex schedule info for "%s"', self.name, str(ex))
+            LOGGER.error(' Error retrieving flex schedule info for "%s": %s', self.name, ex)
             return False
-        
-        # ST -> Status (whether Rachio schedule is running a schedule or not)
-        try:
-            if 'scheduleRuleId' in self.currentSchedule:
-                _running = (self.currentSchedule['scheduleRuleId'] == self.schedule_id)
-                self.setDriver('ST',(0,100)[_running])
-            else:
-                self.setDriver('ST',0)
-        except Exception as ex:
-            LOGGER.error('Error updating current schedule running status on %s Rachio FlexSchedule. %s', self.name, str(ex))
 
-        # GV0 -> "Enabled"
         try:
-            self.setDriver('GV0',int(self.schedule['enabled']))
+            self.renderDrivers()
         except Exception as ex:
-            LOGGER.error('Error updating enable status on %s Rachio FlexSchedule. %s', self.name, str(ex))
+            LOGGER.error('Error updating drivers on %s Rachio FlexSchedule. %s', self.name, ex)
+        self.flushDrivers(force)
+        return True
 
-        # GV2 -> duration (minutes)
-        try:
-            _seconds = float(self.schedule['totalDuration'])
-            _minutes = int(_seconds / 60.)
-            self.setDriver('GV2', _minutes)
-        except Exception as ex:
-            LOGGER.error('Error updating total duration on %s Rachio FlexSchedule. %s', self.name, str(ex))
-      
-        if force: self.reportDrivers()
+    def driverSources(self, now):
+        return {'rule': self.schedule, 'state': {'running': self.device.currentSchedule.get('scheduleRuleId') == self.schedule_id}, 'now': now}
 
     def query(self, command = None):
         LOGGER.info('query command received on %s Rachio Flex Schedule', self.name)
         self.update_info(force=True,queryAPI=True)
         return True
 
-    drivers = [{'driver': 'ST', 'value': 0, 'uom': 78}, #Running (On/Off)
-               {'driver': 'GV0', 'value': 0, 'uom': 2}, #Enabled (True/False)
-               {'driver': 'GV2', 'value': 0, 'uom': 45} #Duration (Minutes)
-               ]
+    drivers = rachio_drivers.driverList('rachio_flexschedule')
+    extractDrivers = staticmethod(rachio_drivers.compileExtractor('rachio_flexschedule'))
 
     id = 'rachio_flexschedule'
     commands = {'QUERY': query}
     
 class webSocketHandler(BaseHTTPRequestHandler): #From example at https://gist.github.com/mdonkers/63e115cc0c79b4f6b8b3a6b797e485c7
        
+    @timed('webhook.do_POST')
     def do_POST(self):
         try:
             self.data_string = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
-            _json_data = json.loads(self.data_string)
-            LOGGER.debug('Received websocket notification from Rachio: %s',str(_json_data))
+            with PROFILER.span('webhook.json'):
+                _json_data = json.loads(self.data_string)
+            LOGGER.debug('Received websocket notification from Rachio: %s',_json_data)
+            self.server.controller.countWebhookEvent(_json_data)
             
-            if 'deviceId' in _json_data:
-                _deviceID = _json_data['deviceId']
-                for node in self.server.controller.nodes:
-                    if self.server.controller.nodes[node].device_id == _deviceID:
-                        self.server.controller.nodes[node].update_info(force=False,queryAPI=True)
-                        break
+            #Acknowledge right away, the event is processed by the webhook queue's workers
+            if not self.server.controller.webhookQueue.put(_json_data):
+                LOGGER.error('Webhook queue full, dropping %s event for device %s', _json_data.get('type'), _json_data.get('deviceId'))
                         
             self.send_response(200)
+            self.end_headers()
                         
         except Exception as ex:
-            LOGGER.error('Error processing POST request to HTTP Server: %s', str(ex))
+            LOGGER.error('Error processing POST request to HTTP Server: %s', ex)
             self.send_error(404)
         return
             
     def do_GET(self):
         try:
-            if None != re.search('/test*', self.path):
+            if self.path.startswith('/refreshSchedule'):
+                #Debug view of when each device is next refreshed and why, only served to the local network
+                if not ipaddress.ip_address(self.client_address[0]).is_private:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type','application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps(self.server.controller.refreshSchedule(), indent=2).encode('utf-8'))
+            elif self.path.startswith('/metrics'):
+                #Prometheus scrape endpoint, also only served to the local network
+                if not ipaddress.ip_address(self.client_address[0]).is_private:
+                    self.send_error(404)
+                    return
+                _body = self.server.controller.metrics().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', MetricsPage.CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(_body)))
+                self.end_headers()
+                self.wfile.write(_body)
+            elif None != re.search('/test*', self.path):
                 self.send_response(200)
                 self.send_header('Content-Type','application/json')
                 self.end_headers()
@@ -1076,7 +2903,7 @@ class webSocketHandler(BaseHTTPRequestHandler): #From example at https://gist.gi
                 self.send_header('Content-Type','application/json')
                 self.end_headers()
         except Exception as ex:
-            LOGGER.error('Error processing GET request to HTTP Server: %s', str(ex))
+            LOGGER.error('Error processing GET request to HTTP Server: %s', ex)
             self.send_error(404)
         return
     
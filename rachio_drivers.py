@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Driver tables for the Rachio NodeServer's node types.
+
+Each node definition lists its drivers in the order the ISY shows them.  A driver reads a value from one of the
+"sources" its node hands to the extractor (the Rachio payload the driver describes, or a small dict of values the
+node derives itself), follows "path" into it, converts it with "transform" and falls back to "default" when the
+path is missing or the value can't be converted.  A default of None leaves the driver at its last value and reports
+it missing, KEEP does the same silently for fields Rachio only sends some of the time.  Drivers without a source
+(e.g. command status) are set by the node server directly.
+
+The same tables produce the "drivers" list of each node class (driverList()), the extractor its update_info uses
+(compileExtractor()), the profile's nodedef/nodedefs.xml and the compact form device payloads are kept in
+(compactDevice()): only the fields some driver or the node server itself reads are kept, with zones and schedule
+rules held in slotted PayloadState objects instead of dicts.  After editing a table, regenerate the profile with
+    python3 rachio_drivers.py
+(the zipprofile script does this before zipping the profile).
+"""
+
+import os
+import sys
+from collections import namedtuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+Driver = namedtuple('Driver', ['driver', 'uom', 'editor', 'source', 'path', 'transform', 'default', 'description'])
+Command = namedtuple('Command', ['id', 'editor', 'init']) #editor/init describe the command's parameter, if it takes one
+NodeDef = namedtuple('NodeDef', ['id', 'nls', 'comment', 'drivers', 'commands'])
+
+KEEP = 'keep' #Driver default for optional fields: leave the driver unchanged without reporting the value missing
+RUN_TYPES = {'NONE': 0, 'AUTOMATIC': 1, 'MANUAL': 2} #Current schedule type -> GV10 value, 3 for any other type
+
+
+# Transforms, called as transform(value, sources)
+
+def onOff(value, sources):
+    return 100 if value else 0
+
+def flag(value, sources):
+    return int(value)
+
+def equals(expected):
+    def _equals(value, sources):
+        return int(value == expected)
+    return _equals
+
+def processing(value, sources):
+    return 100 if str(value) == 'PROCESSING' else 0
+
+def runType(value, sources):
+    return RUN_TYPES.get(str(value).upper(), 3)
+
+def percent(value, sources):
+    #Fraction (0.75) to percent (75.0)
+    return float(value) * 100.
+
+def wholePercent(value, sources):
+    return int(float(value) * 100.)
+
+def wholeMinutes(value, sources):
+    #Seconds to whole minutes
+    return int(float(value) / 60.)
+
+def minutesUntil(value, sources):
+    #Epoch milliseconds to whole minutes from sources['now'] until then, 0 once it has passed
+    return int(max(value / 1000. - int(sources['now']), 0) / 60.)
+
+def runMinutesRemaining(value, sources):
+    #Run start (epoch milliseconds) to minutes left of the run's duration, to a tenth of a minute
+    _elapsed = max(int(sources['now']) - int(value / 1000), 0)
+    return round(max(int(sources['schedule']['duration']) - _elapsed, 0) / 60., 1)
+
+def runMinutesElapsed(value, sources):
+    #Run start (epoch milliseconds) to minutes since, to a tenth of a minute
+    return round(max(int(sources['now']) - int(value / 1000), 0) / 60., 1)
+
+
+NODE_DEFS = [
+    NodeDef('rachio', 'rapi', 'RachioBridge (Virtual Cloud Interface)', [
+        Driver('ST', 2, 'bool', None, None, None, None, 'Node Server Connected (True/False)'),
+        Driver('GV0', 56, 'apicount', None, None, None, None, 'Rachio API Requests Remaining (Raw Value)'),
+        Driver('GV1', 56, 'nodecount', None, None, None, None, 'Nodes Queued for Addition'),
+        Driver('GV2', 56, 'nodecount', None, None, None, None, 'Nodes Added'),
+        Driver('GV3', 56, 'nodecount', None, None, None, None, 'Nodes Failed to Add'),
+        ], [Command('DISCOVER', None, None), Command('QUERY', None, None)]),
+
+    NodeDef('rachio_device', 'rdev', 'RachioController', [
+        Driver('ST', 78, 'onoff', 'schedule', ('status',), processing, 0, 'Status (On/Off)'),
+        Driver('GV0', 2, 'truefalse', 'device', ('status',), equals('ONLINE'), 0, 'Connected (True/False)'),
+        Driver('GV1', 2, 'truefalse', 'device', ('on',), flag, 0, 'Enabled (True/False)'),
+        Driver('GV2', 2, 'truefalse', 'device', ('paused',), flag, 0, 'Paused (True/False)'),
+        Driver('GV3', 45, 'raindelay', 'device', ('rainDelayExpirationDate',), minutesUntil, 0, 'Rain Delay Minutes Remaining (Minutes)'),
+        Driver('GV10', 25, 'runtypes', 'schedule', ('type',), runType, 0, 'Current Schedule Type (Enumeration)'),
+        Driver('GV4', 56, 'zonenum', 'activeZone', ('zoneNumber',), None, 0, 'Active Zone # (Raw Value)'),
+        Driver('GV5', 45, 'minutes', 'schedule', ('startDate',), runMinutesRemaining, 0.0, 'Active Schedule Minutes Remaining (Minutes)'),
+        Driver('GV6', 45, 'minutes', 'schedule', ('startDate',), runMinutesElapsed, 0.0, 'Active Schedule Minutes Elapsed (Minutes)'),
+        Driver('GV7', 2, 'truefalse', 'schedule', ('cycling',), flag, 0, 'Cycling (True/False)'),
+        Driver('GV8', 56, 'cycle', 'schedule', ('cycleCount',), None, 0, 'Cycle Count (Raw Value)'),
+        Driver('GV9', 56, 'cycle', 'schedule', ('totalCycleCount',), None, 0, 'Total Cycle Count (Raw Value)'),
+        Driver('GV11', 25, 'cmdstatus', None, None, None, None, 'Last Command Status (Enumeration)'),
+        ], [Command('DON', None, None), Command('DOF', None, None), Command('STOP', None, None), Command('QUERY', None, None),
+            Command('RAIN_DELAY', 'raindelay', 'GV3')]),
+
+    NodeDef('rachio_zone', 'rzone', None, [
+        Driver('ST', 78, 'onoff', 'state', ('running',), onOff, 0, 'Running (On/Off)'),
+        Driver('GV0', 2, 'truefalse', 'zone', ('enabled',), flag, 0, 'Enabled (True/False)'),
+        Driver('GV1', 56, 'zonenum', 'zone', ('zoneNumber',), None, None, 'Zone Number (Raw Value)'),
+        Driver('GV2', 105, 'inches', 'zone', ('availableWater',), None, None, 'Available Water (Inches)'),
+        Driver('GV3', 105, 'inches', 'zone', ('rootZoneDepth',), None, None, 'Root Zone Depth (Inches)'),
+        Driver('GV4', 105, 'inches', 'zone', ('managementAllowedDepletion',), None, None, 'Allowed Depletion (Inches)'),
+        Driver('GV5', 51, 'pct', 'zone', ('efficiency',), wholePercent, None, 'Efficiency (Percent)'),
+        Driver('GV6', 18, 'sqft', 'zone', ('yardAreaSquareFeet',), None, None, 'Zone Area (*Square* Feet)'),
+        Driver('GV7', 105, 'inches', 'zone', ('irrigationAmount',), None, 0, 'Irrigation Amount (Inches)'),
+        Driver('GV8', 105, 'inches', 'zone', ('depthOfWater',), None, None, 'Depth of Water (Inches)'),
+        Driver('GV9', 45, 'minutes', 'zone', ('runtime',), None, None, 'Runtime (Minutes)'),
+        Driver('GV10', 24, 'inchhr', 'zone', ('customNozzle', 'inchesPerHour'), None, None, 'Inches per Hour'),
+        ], [Command('START', 'minutes', '2'), Command('QUERY', None, None)]),
+
+    NodeDef('rachio_schedule', 'rsched', None, [
+        Driver('ST', 78, 'onoff', 'state', ('running',), onOff, 0, 'Running (On/Off)'),
+        Driver('GV0', 2, 'truefalse', 'rule', ('enabled',), flag, None, 'Enabled (True/False)'),
+        Driver('GV1', 2, 'truefalse', 'rule', ('rainDelay',), flag, 0, 'Rain Delay (True/False)'),
+        Driver('GV2', 45, 'minutes', 'rule', ('totalDuration',), wholeMinutes, None, 'Duration (Minutes)'),
+        Driver('GV3', 51, 'seasonal', 'rule', ('seasonalAdjustment',), percent, KEEP, 'Seasonal Adjustment (Percent)'),
+        ], [Command('START', None, None), Command('SKIP', None, None), Command('ADJUST', 'seasonal', 'GV3'), Command('QUERY', None, None)]),
+
+    NodeDef('rachio_flexschedule', 'rflex', None, [
+        Driver('ST', 78, 'onoff', 'state', ('running',), onOff, 0, 'Running (On/Off)'),
+        Driver('GV0', 2, 'truefalse', 'rule', ('enabled',), flag, None, 'Enabled (True/False)'),
+        Driver('GV2', 45, 'minutes', 'rule', ('totalDuration',), wholeMinutes, None, 'Duration (Minutes)'),
+        ], [Command('QUERY', None, None)]),
+    ]
+
+NODE_DRIVERS = dict((n.id, n.drivers) for n in NODE_DEFS)
+
+
+class PayloadState(object):
+    """
+    Slotted copy of the fields of a Rachio payload listed in "fields" (field -> None, or the PayloadState class
+    a nested payload is copied into).  Fields missing from the payload are left unset.  state[field] is plain
+    attribute access, so reading a missing field raises AttributeError rather than the dict's KeyError.
+    Subclasses are built by stateClass().
+    """
+    __slots__ = ()
+    fields = {}
+
+    def __init__(self, payload=None):
+        for _key, _nested in self.fields.items():
+            try:
+                _value = payload[_key]
+                if _nested is not None and not isinstance(_value, _nested):
+                    _value = _nested(_value)
+            except (KeyError, IndexError, TypeError):
+                continue
+            setattr(self, _key, _value)
+
+    __getitem__ = object.__getattribute__ #update_info reads these on every call, keep the lookup in C
+
+    def __contains__(self, key):
+        return key in self.fields and hasattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.fields else default
+
+    def asDict(self):
+        #Used as json's "default" when saving snapshots, nested states are converted by further calls
+        return dict((k, getattr(self, k)) for k in self.fields if hasattr(self, k))
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.asDict())
+
+
+def stateClass(name, spec):
+    #PayloadState subclass for a field spec (field -> None or a nested spec)
+    _fields = dict((k, stateClass(name + '_' + k, v) if v is not None else None) for k, v in spec.items())
+    return type(name, (PayloadState,), {'__slots__': tuple(_fields), 'fields': _fields})
+
+
+def payloadSpec(sources, fields=()):
+    #Field spec of everything the tables read from the given sources, plus "fields" the node server reads itself
+    _spec = dict((k, None) for k in fields)
+    for _nodeDef in NODE_DEFS:
+        for _driver in _nodeDef.drivers:
+            if _driver.source not in sources:
+                continue
+            _level = _spec
+            for _key in _driver.path[:-1]:
+                if _level.get(_key) is None:
+                    _level[_key] = {}
+                _level = _level[_key]
+            _level.setdefault(_driver.path[-1], None)
+    return _spec
+
+
+ZoneState = stateClass('ZoneState', payloadSpec(('zone', 'activeZone'), ('id', 'name', 'zoneNumber')))
+ScheduleRuleState = stateClass('ScheduleRuleState', payloadSpec(('rule',), ('id', 'name')))
+DEVICE_FIELDS = tuple(payloadSpec(('device',), ('id', 'name', 'macAddress'))) #None of the device level drivers read nested fields
+
+DRIVER_VALUES = dict((n.id, type(n.id + '_drivers', (object,), {'__slots__': tuple(d.driver for d in n.drivers)})) for n in NODE_DEFS) #node definition id -> slotted class with an attribute per driver
+
+
+def compactDevice(device):
+    """
+    Copy of a Rachio device payload with just the fields in DEVICE_FIELDS and its zones, schedule rules and flex
+    schedule rules as ZoneState/ScheduleRuleState objects.  Applied to every device payload as it arrives, so a
+    refresh no longer keeps the full API response (soil, crop, nozzle, location details, etc.) alive.
+    """
+    _compact = dict((k, device[k]) for k in DEVICE_FIELDS if k in device)
+    _compact['zones'] = [z if isinstance(z, ZoneState) else ZoneState(z) for z in device.get('zones', [])]
+    for _key in ('scheduleRules', 'flexScheduleRules'):
+        _compact[_key] = [r if isinstance(r, ScheduleRuleState) else ScheduleRuleState(r) for r in device.get(_key, [])]
+    return _compact
+
+
+def driverList(nodeDef):
+    #polyinterface "drivers" list for a node definition id
+    return [{'driver': d.driver, 'value': 0, 'uom': d.uom} for d in NODE_DRIVERS[nodeDef]]
+
+
+def compileExtractor(nodeDef):
+    """
+    Returns extract(sources) for a node definition id, which fills all of its sourced drivers in one pass and
+    returns ({driver: value}, [drivers left unchanged because their value was missing]).  Drivers defaulting to KEEP are
+    left out of both.  "sources" maps each
+    source name used by the table to a dict, plus "now" (epoch seconds) for the time based transforms.
+    """
+    _steps = tuple((d.driver, d.source, d.path, d.transform, d.default) for d in NODE_DRIVERS[nodeDef] if d.source is not None)
+
+    def extract(sources):
+        _values = {}
+        _missing = []
+        for _driver, _source, _path, _transform, _default in _steps:
+            try:
+                _value = sources[_source]
+                for _key in _path:
+                    _value = _value[_key]
+                if _transform is not None:
+                    _value = _transform(_value, sources)
+            except (KeyError, IndexError, TypeError, ValueError, AttributeError):
+                if _default is None:
+                    _missing.append(_driver)
+                    continue
+                if _default is KEEP:
+                    continue
+                _value = _default
+            _values[_driver] = _value
+        return _values, _missing
+    return extract
+
+
+def nodeDefsXml():
+    #Text of profile/nodedef/nodedefs.xml, with the CRLF line endings and no final line break of the hand-written file it replaced
+    _lines = ['<nodeDefs>', '  <!-- Generated from rachio_drivers.py, edit the tables there and run "python3 rachio_drivers.py" -->', '']
+    for _nodeDef in NODE_DEFS:
+        if _nodeDef.comment:
+            _lines.append('  <!-- %s -->' % _nodeDef.comment)
+        _lines.append('  <nodeDef id="%s" nls="%s">' % (_nodeDef.id, _nodeDef.nls))
+        _lines.append('    <editors />')
+        _lines.append('    <sts>')
+        for _driver in _nodeDef.drivers:
+            _lines.append('      <st id="%s" editor="%s" />' % (_driver.driver, _driver.editor))
+        _lines.append('    </sts>')
+        _lines.extend(['    <cmds>', '      <sends />', '      <accepts>'])
+        for _command in _nodeDef.commands:
+            if _command.editor is None:
+                _lines.append('        <cmd id="%s" />' % _command.id)
+            else:
+                _lines.append('        <cmd id="%s">' % _command.id)
+                _lines.append('          <p id="" editor="%s" init="%s" />' % (_command.editor, _command.init))
+                _lines.append('        </cmd>')
+        _lines.extend(['      </accepts>', '    </cmds>', '  </nodeDef>', ''])
+    _lines[-1] = '</nodeDefs>'
+    return '\r\n'.join(_lines)
+
+
+def writeProfile(path=os.path.join(HERE, 'profile', 'nodedef', 'nodedefs.xml')):
+    #Rewrites nodedefs.xml from the tables, returns True if it changed
+    _text = nodeDefsXml()
+    try:
+        with open(path, newline='') as _file:
+            if _file.read() == _text:
+                return False
+    except IOError:
+        pass
+    with open(path, 'w', newline='') as _file:
+        _file.write(_text)
+    return True
+
+
+if __name__ == '__main__':
+    _changed = writeProfile(*sys.argv[1:2])
+    print('nodedefs.xml %s' % ('updated' if _changed else 'unchanged'))
@@ -0,0 +1,555 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Rachio cloud API, used to exercise the Rachio NodeServer offline.
+
+Implements the endpoints used through rachiopy (person info/get, device get/current_schedule and
+commands, webhook get/post/put/delete, zone start and schedule rule start/skip/seasonal adjustment)
+against a synthetic account of any size, emulates the x-ratelimit-* headers, latency and HTTP 429
+responses, and pushes webhook events to the URLs registered by the NodeServer.
+
+Example (100 controllers with 16 zones each, webhooks at 20 events/second):
+    python3 rachio_simulator.py --controllers 100 --zones 16 --port 8080 --webhook-rate 20
+then set the NodeServer's 'apiUrl' custom parameter to http://<host>:8080/1/public
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit
+
+LOGGER = logging.getLogger('rachio_simulator')
+API_PREFIX = '/1/public/'
+ID_PATTERN = re.compile('[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}')
+
+
+def _ms(seconds):
+    return int(seconds * 1000)
+
+
+class SimulatedAccount(object):
+    """
+    Synthetic Rachio account: a person owning "controllers" devices, each with "zones" zones,
+    "schedules" schedule rules and "flexSchedules" flex schedule rules.  Generation is seeded so
+    the same arguments always produce the same ids.
+    """
+    def __init__(self, controllers=1, zones=8, schedules=2, flexSchedules=1, seed=1):
+        self._rng = random.Random(seed)
+        self.person_id = self._uuid()
+        self.devices = {}
+        for d in range(controllers):
+            _device = {'id': self._uuid(),
+                       'name': 'Simulated Controller %i' % (d + 1),
+                       'macAddress': '%012X' % self._rng.getrandbits(48),
+                       'serialNumber': 'SIM%08i' % d,
+                       'model': 'GENERATION2_16ZONE',
+                       'status': 'ONLINE',
+                       'on': True,
+                       'paused': False,
+                       'deleted': False,
+                       'zones': [],
+                       'scheduleRules': [],
+                       'flexScheduleRules': []}
+            for z in range(zones):
+                _device['zones'].append({'id': self._uuid(),
+                                         'zoneNumber': z + 1,
+                                         'name': 'Zone %i' % (z + 1),
+                                         'enabled': True,
+                                         'availableWater': round(self._rng.uniform(0.1, 0.2), 2),
+                                         'rootZoneDepth': self._rng.choice([4.0, 6.0, 8.0, 12.0]),
+                                         'managementAllowedDepletion': 0.5,
+                                         'efficiency': round(self._rng.uniform(0.6, 0.9), 2),
+                                         'yardAreaSquareFeet': self._rng.randint(100, 5000),
+                                         'irrigationAmount': round(self._rng.uniform(0.2, 1.0), 2),
+                                         'depthOfWater': round(self._rng.uniform(0.2, 1.0), 2),
+                                         'runtime': self._rng.randint(5, 40) * 60,
+                                         'lastWateredDate': _ms(time.time() - 86400),
+                                         'customNozzle': {'name': 'Fixed Spray Head', 'inchesPerHour': round(self._rng.uniform(0.5, 2.0), 2)}})
+                _device['zones'][-1].update(self._zoneDetails(_device['zones'][-1]))
+            for s in range(schedules):
+                _device['scheduleRules'].append(self._schedule(_device, 'Schedule %i' % (s + 1), seasonalAdjustment=0.))
+            for f in range(flexSchedules):
+                _device['flexScheduleRules'].append(self._schedule(_device, 'Flex Schedule %i' % (f + 1)))
+            _device.update(self._deviceDetails(d))
+            self.devices[_device['id']] = _device
+        self.currentSchedules = dict((i, {}) for i in self.devices)
+        self.webhooks = {} #webhook id -> webhook definition (including "deviceId")
+        self.lock = threading.RLock()
+
+    def _uuid(self):
+        return str(uuid.UUID(int=self._rng.getrandbits(128), version=4))
+
+    def _schedule(self, device, name, **extra):
+        _zones = device['zones']
+        _rule = {'id': self._uuid(),
+                 'name': name,
+                 'enabled': True,
+                 'rainDelay': False,
+                 'totalDuration': sum(z['runtime'] for z in _zones),
+                 'zones': [{'zoneId': z['id'], 'zoneNumber': z['zoneNumber'], 'duration': z['runtime'], 'sortOrder': i} for i, z in enumerate(_zones)]}
+        _rule.update({'summary': 'Every %i days at 6:00 AM' % (len(name) % 3 + 2), 'type': 'FIXED', 'operator': 'AFTER', 'startDate': _ms(time.time() - 30 * 86400),
+                      'cycleSoak': False, 'cycleSoakStatus': 'OFF', 'etSkip': True, 'weatherIntelligenceSensitivity': 0.5, 'externalName': name,
+                      'scheduleJobTypes': ['INTERVAL_%i' % (len(name) % 3 + 2)], 'startHour': 6, 'startMinute': 0, 'startDay': 1, 'startMonth': 1, 'startYear': 2018})
+        _rule.update(extra)
+        return _rule
+
+    @staticmethod
+    def _zoneDetails(zone):
+        #Fields of the real API's zone payload the node server doesn't read, so payload sizes are realistic
+        return {'imageUrl': 'https://prod-media-photo.rach.io/%s' % zone['id'],
+                'maxRuntime': 10800, 'fixedRuntime': 0, 'scheduleDataModified': False, 'saturatedDepthOfWater': round(zone['depthOfWater'] * 1.4, 2),
+                'customSoil': {'createDate': 1430244468000, 'lastUpdateDate': 1430244468000, 'id': 'aa8b3a4d-0f3a-4d1b-9c7b-1c4a0b4f1c01', 'name': 'Loam',
+                               'imageUrl': 'https://prod-media-photo.rach.io/soil/loam.png', 'category': 'LOAM', 'infiltrationRate': 0.35, 'editable': False,
+                               'percentAvailableWater': 0.17},
+                'customSlope': {'createDate': 1430244468000, 'lastUpdateDate': 1430244468000, 'id': 'bb8b3a4d-0f3a-4d1b-9c7b-1c4a0b4f1c02', 'name': 'Flat',
+                                'imageUrl': 'https://prod-media-photo.rach.io/slope/flat.png', 'sortOrder': 0},
+                'customCrop': {'createDate': 1430244468000, 'lastUpdateDate': 1430244468000, 'id': 'cc8b3a4d-0f3a-4d1b-9c7b-1c4a0b4f1c03', 'name': 'Cool Season Grass',
+                               'imageUrl': 'https://prod-media-photo.rach.io/crop/grass.png', 'coefficient': 0.8, 'editable': False},
+                'customShade': {'createDate': 1430244468000, 'lastUpdateDate': 1430244468000, 'id': 'dd8b3a4d-0f3a-4d1b-9c7b-1c4a0b4f1c04', 'name': 'Lots of sun',
+                                'imageUrl': 'https://prod-media-photo.rach.io/shade/sun.png', 'description': '6-8 hours of sun', 'exposure': 1.0},
+                'wateringAdjustmentRuntimes': dict((str(i), zone['runtime'] * (6 - i) // 3) for i in range(1, 6))}
+
+    @staticmethod
+    def _deviceDetails(index):
+        #Fields of the real API's device payload the node server doesn't read
+        return {'createDate': 1430244468000, 'timeZone': 'America/Denver', 'latitude': 39.7 + index * 0.001, 'longitude': -105.0 - index * 0.001,
+                'zip': '80202', 'elevation': 1609.3, 'utcOffset': -25200000, 'homeKitCompatible': True, 'scheduleModeType': 'SCHEDULED',
+                'rainSensorTripped': False, 'flexScheduleRulesEnabled': True, 'firmwareVersion': '2.2.0.17', 'lastHeardFromDate': _ms(time.time())}
+
+    def person(self):
+        return {'id': self.person_id, 'username': 'simulated', 'fullName': 'Simulated Account', 'devices': list(self.devices.values())}
+
+    def findRule(self, rule_id):
+        for _device in self.devices.values():
+            for _rule in _device['scheduleRules'] + _device['flexScheduleRules']:
+                if _rule['id'] == rule_id:
+                    return _device, _rule
+        return None, None
+
+    def findZone(self, zone_id):
+        for _device in self.devices.values():
+            for _zone in _device['zones']:
+                if _zone['id'] == zone_id:
+                    return _device, _zone
+        return None, None
+
+
+class RateLimiter(object):
+    #Per API key daily budget mirroring Rachio's x-ratelimit-* headers
+    def __init__(self, limit=1700):
+        self.limit = limit
+        self._remaining = {}
+        self._lock = threading.Lock()
+
+    def _nextReset(self):
+        _now = datetime.now(timezone.utc)
+        return datetime(_now.year, _now.month, _now.day, tzinfo=timezone.utc).timestamp() + 86400
+
+    def take(self, key):
+        #Returns (allowed, headers)
+        with self._lock:
+            _reset, _remaining = self._remaining.get(key, (self._nextReset(), self.limit))
+            if time.time() >= _reset:
+                _reset, _remaining = self._nextReset(), self.limit
+            _allowed = _remaining > 0
+            if _allowed:
+                _remaining -= 1
+            self._remaining[key] = (_reset, _remaining)
+        return _allowed, {'x-ratelimit-limit': str(self.limit),
+                          'x-ratelimit-remaining': str(_remaining),
+                          'x-ratelimit-reset': format_datetime(datetime.fromtimestamp(_reset, timezone.utc), usegmt=True)}
+
+
+class RachioSimulator(object):
+    """
+    Request handling, rate limiting and webhook delivery for a SimulatedAccount.
+
+    latency/jitter: Seconds added to every response (jitter is uniformly random)
+    throttleRate: Fraction of requests answered with HTTP 429 regardless of the remaining budget
+    timeScale: Zone and schedule runs complete duration/timeScale seconds after they start
+    webhookUrl: If set, events are pushed here instead of to the URLs registered through the API
+    """
+    def __init__(self, account, limit=1700, latency=0., jitter=0., throttleRate=0., timeScale=60., webhookUrl=None, seed=1):
+        self.account = account
+        self.rateLimiter = RateLimiter(limit)
+        self.latency = latency
+        self.jitter = jitter
+        self.throttleRate = throttleRate
+        self.timeScale = timeScale
+        self.webhookUrl = webhookUrl
+        self.requests = Counter() #"METHOD endpoint" -> count
+        self.responses = Counter() #HTTP status -> count
+        self.webhooksSent = Counter() #event type -> count
+        self.webhookErrors = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._routes = [('GET', re.compile('^person/info$'), self._personInfo),
+                        ('GET', re.compile('^person/([^/]+)$'), self._person),
+                        ('GET', re.compile('^device/([^/]+)/current_schedule$'), self._currentSchedule),
+                        ('GET', re.compile('^device/([^/]+)$'), self._device),
+                        ('PUT', re.compile('^device/(on|off|stop_water|rain_delay)$'), self._deviceCommand),
+                        ('GET', re.compile('^notification/([^/]+)/webhook$'), self._getWebhooks),
+                        ('POST', re.compile('^notification/webhook$'), self._postWebhook),
+                        ('PUT', re.compile('^notification/webhook$'), self._putWebhook),
+                        ('DELETE', re.compile('^notification/webhook/([^/]+)$'), self._deleteWebhook),
+                        ('PUT', re.compile('^zone/start$'), self._zoneStart),
+                        ('PUT', re.compile('^schedulerule/(start|skip|seasonal_adjustment)$'), self._ruleCommand)]
+
+    # Request dispatch
+
+    def handle(self, method, path, apiKey, body):
+        #Returns (status, headers, payload)
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self._rng.uniform(0, self.jitter))
+        _path = path.split('?')[0]
+        if not _path.startswith(API_PREFIX):
+            return self._count(method, _path, 404, {}, {'error': 'Not found'})
+        _path = _path[len(API_PREFIX):]
+        for _method, _pattern, _handler in self._routes:
+            _match = _pattern.match(_path)
+            if _method == method and _match:
+                _endpoint = ID_PATTERN.sub('{id}', _path)
+                _allowed, _headers = self.rateLimiter.take(apiKey)
+                if not _allowed or (self.throttleRate and self._rng.random() < self.throttleRate):
+                    return self._count(method, _endpoint, 429, _headers, {'error': 'Too many requests'})
+                try:
+                    _status, _payload = _handler(body, *_match.groups())
+                except Exception as ex:
+                    LOGGER.exception('Error handling %s %s', method, path)
+                    _status, _payload = 500, {'error': str(ex)}
+                return self._count(method, _endpoint, _status, _headers, _payload)
+        return self._count(method, _path, 404, {}, {'error': 'Not found'})
+
+    def _count(self, method, endpoint, status, headers, payload):
+        with self._lock:
+            self.requests[method + ' ' + endpoint] += 1
+            self.responses[status] += 1
+        return status, headers, payload
+
+    def stats(self):
+        with self._lock:
+            return {'requests': dict(self.requests), 'totalRequests': sum(self.requests.values()),
+                    'responses': dict((str(k), v) for k, v in self.responses.items()),
+                    'webhooksSent': dict(self.webhooksSent), 'webhookErrors': self.webhookErrors}
+
+    def resetStats(self):
+        with self._lock:
+            self.requests.clear()
+            self.responses.clear()
+            self.webhooksSent.clear()
+            self.webhookErrors = 0
+
+    # Endpoints
+
+    def _personInfo(self, body):
+        return 200, {'id': self.account.person_id}
+
+    def _person(self, body, person_id):
+        if person_id != self.account.person_id:
+            return 404, {'error': 'Person not found'}
+        with self.account.lock:
+            return 200, self.account.person()
+
+    def _device(self, body, device_id):
+        with self.account.lock:
+            if device_id not in self.account.devices:
+                return 404, {'error': 'Device not found'}
+            return 200, self.account.devices[device_id]
+
+    def _currentSchedule(self, body, device_id):
+        with self.account.lock:
+            if device_id not in self.account.devices:
+                return 404, {'error': 'Device not found'}
+            return 200, self.account.currentSchedules[device_id]
+
+    def _deviceCommand(self, body, command):
+        _device_id = body.get('id')
+        with self.account.lock:
+            _device = self.account.devices.get(_device_id)
+            if _device is None:
+                return 404, {'error': 'Device not found'}
+            if command == 'on' or command == 'off':
+                _device['on'] = (command == 'on')
+                self.sendEvent(_device_id, 'DEVICE_STATUS', 'SLEEP_MODE_OFF' if _device['on'] else 'SLEEP_MODE_ON')
+            elif command == 'stop_water':
+                self._finishRun(_device_id, 'ZONE_STOPPED')
+            elif command == 'rain_delay':
+                _duration = int(body.get('duration', 0))
+                _device['rainDelayExpirationDate'] = _ms(time.time() + _duration)
+                self.sendEvent(_device_id, 'RAIN_DELAY', 'RAIN_DELAY_ON' if _duration > 0 else 'RAIN_DELAY_OFF', endTime=_device['rainDelayExpirationDate'])
+        return 204, None
+
+    def _getWebhooks(self, body, device_id):
+        with self.account.lock:
+            return 200, [dict((k, v) for k, v in w.items() if k != 'deviceId') for w in self.account.webhooks.values() if w['deviceId'] == device_id]
+
+    def _webhookDefinition(self, body, webhook_id, device_id):
+        _eventTypes = [{'id': str(e['id']), 'name': EVENT_TYPE_NAMES.get(str(e['id']), str(e['id']))} for e in body.get('eventTypes', [])]
+        return {'id': webhook_id, 'deviceId': device_id, 'externalId': body.get('externalId'), 'url': body.get('url'), 'eventTypes': _eventTypes}
+
+    def _postWebhook(self, body):
+        _device_id = body.get('device', {}).get('id')
+        with self.account.lock:
+            if _device_id not in self.account.devices:
+                return 404, {'error': 'Device not found'}
+            _webhook = self._webhookDefinition(body, str(uuid.uuid4()), _device_id)
+            self.account.webhooks[_webhook['id']] = _webhook
+            return 200, dict((k, v) for k, v in _webhook.items() if k != 'deviceId')
+
+    def _putWebhook(self, body):
+        with self.account.lock:
+            _existing = self.account.webhooks.get(body.get('id'))
+            if _existing is None:
+                return 404, {'error': 'Webhook not found'}
+            _webhook = self._webhookDefinition(body, _existing['id'], _existing['deviceId'])
+            self.account.webhooks[_webhook['id']] = _webhook
+            return 200, dict((k, v) for k, v in _webhook.items() if k != 'deviceId')
+
+    def _deleteWebhook(self, body, webhook_id):
+        with self.account.lock:
+            if self.account.webhooks.pop(webhook_id, None) is None:
+                return 404, {'error': 'Webhook not found'}
+        return 204, None
+
+    def _zoneStart(self, body):
+        _duration = int(body.get('duration', 0))
+        with self.account.lock:
+            _device, _zone = self.account.findZone(body.get('id'))
+            if _zone is None:
+                return 404, {'error': 'Zone not found'}
+            self.startRun(_device['id'], _zone, _duration, 'MANUAL')
+        return 204, None
+
+    def _ruleCommand(self, body, command):
+        with self.account.lock:
+            _device, _rule = self.account.findRule(body.get('id'))
+            if _rule is None:
+                return 404, {'error': 'Schedule rule not found'}
+            if command == 'start':
+                _zone = _device['zones'][0] if _device['zones'] else None
+                self.startRun(_device['id'], _zone, _rule['totalDuration'], 'AUTOMATIC', _rule)
+            elif command == 'skip':
+                self.sendEvent(_device['id'], 'SCHEDULE_STATUS', 'SCHEDULE_RULE_SKIPPED', scheduleId=_rule['id'], scheduleName=_rule['name'])
+            elif command == 'seasonal_adjustment':
+                _rule['seasonalAdjustment'] = float(body.get('adjustment', 0))
+                self.sendEvent(_device['id'], 'DELTA', 'SCHEDULE_RULE_UPDATED')
+        return 204, None
+
+    # Watering state
+
+    def startRun(self, device_id, zone, duration, runType, rule=None):
+        #Starts watering "zone" (and "rule" if a schedule run) and completes it after duration/timeScale seconds
+        _now = time.time()
+        _schedule = {'type': runType, 'status': 'PROCESSING', 'deviceId': device_id, 'startDate': _ms(_now), 'duration': duration,
+                     'cycling': False, 'cycleCount': 1, 'totalCycleCount': 1}
+        if zone is not None:
+            _schedule.update({'zoneId': zone['id'], 'zoneNumber': zone['zoneNumber'], 'zoneStartDate': _ms(_now), 'zoneDuration': duration})
+        if rule is not None:
+            _schedule['scheduleRuleId'] = rule['id']
+            self.sendEvent(device_id, 'SCHEDULE_STATUS', 'SCHEDULE_STARTED', scheduleId=rule['id'], scheduleName=rule['name'], duration=duration)
+        self.account.currentSchedules[device_id] = _schedule
+        if zone is not None:
+            self.sendEvent(device_id, 'ZONE_STATUS', 'ZONE_STARTED', zoneId=zone['id'], zoneNumber=zone['zoneNumber'], zoneName=zone['name'], duration=duration, startTime=_ms(_now))
+        _timer = threading.Timer(max(duration / float(self.timeScale), 0.01), self._finishRun, [device_id, 'ZONE_COMPLETED', _schedule])
+        _timer.daemon = True
+        _timer.start()
+
+    def _finishRun(self, device_id, subType, run=None):
+        with self.account.lock:
+            _schedule = self.account.currentSchedules.get(device_id)
+            if not _schedule or (run is not None and _schedule is not run):
+                return
+            self.account.currentSchedules[device_id] = {}
+            if 'zoneId' in _schedule:
+                self.sendEvent(device_id, 'ZONE_STATUS', subType, zoneId=_schedule['zoneId'], zoneNumber=_schedule['zoneNumber'], endTime=_ms(time.time()))
+            if 'scheduleRuleId' in _schedule:
+                self.sendEvent(device_id, 'SCHEDULE_STATUS', 'SCHEDULE_COMPLETED' if subType == 'ZONE_COMPLETED' else 'SCHEDULE_STOPPED', scheduleId=_schedule['scheduleRuleId'])
+
+    # Webhook delivery
+
+    def eventPayload(self, device_id, eventType, subType, **fields):
+        _payload = {'externalId': 'polyglot', 'eventId': str(uuid.uuid4()), 'type': eventType, 'subType': subType, 'deviceId': device_id,
+                    'category': 'DEVICE', 'timestamp': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ'), 'eventDate': _ms(time.time())}
+        _payload.update(fields)
+        return _payload
+
+    def sendEvent(self, device_id, eventType, subType, **fields):
+        #Delivers an event to every URL registered for device_id (or to webhookUrl) on a background thread
+        _payload = self.eventPayload(device_id, eventType, subType, **fields)
+        if self.webhookUrl:
+            _urls = [self.webhookUrl]
+        else:
+            with self.account.lock:
+                _urls = [w['url'] for w in self.account.webhooks.values() if w['deviceId'] == device_id and w.get('url')]
+        for _url in _urls:
+            threading.Thread(target=self.post, args=(_url, _payload), daemon=True).start()
+        return _payload
+
+    def post(self, url, payload):
+        _url = urlsplit(url)
+        try:
+            _conn = http.client.HTTPConnection(_url.hostname, _url.port or 80, timeout=10)
+            _conn.request('POST', _url.path or '/', body=json.dumps(payload), headers={'Content-Type': 'application/json'})
+            _status = _conn.getresponse().status
+            _conn.close()
+            with self._lock:
+                self.webhooksSent[payload['type']] += 1
+                if _status != 200:
+                    self.webhookErrors += 1
+            return _status
+        except Exception as ex:
+            LOGGER.debug('Error delivering webhook to %s: %s', url, str(ex))
+            with self._lock:
+                self.webhookErrors += 1
+            return None
+
+    def randomEvent(self):
+        #Generates a plausible event for a random device: zone starts/stops, schedule runs, rain delays, status changes
+        with self.account.lock:
+            _device = self._rng.choice(list(self.account.devices.values()))
+            _roll = self._rng.random()
+            if _roll < 0.6 and _device['zones']:
+                if self.account.currentSchedules[_device['id']]:
+                    self._finishRun(_device['id'], 'ZONE_STOPPED')
+                else:
+                    self.startRun(_device['id'], self._rng.choice(_device['zones']), self._rng.randint(1, 30) * 60, 'MANUAL')
+            elif _roll < 0.8 and _device['scheduleRules']:
+                _rule = self._rng.choice(_device['scheduleRules'])
+                self.startRun(_device['id'], _device['zones'][0] if _device['zones'] else None, _rule['totalDuration'], 'AUTOMATIC', _rule)
+            elif _roll < 0.9:
+                _duration = self._rng.choice([0, 86400])
+                _device['rainDelayExpirationDate'] = _ms(time.time() + _duration)
+                self.sendEvent(_device['id'], 'RAIN_DELAY', 'RAIN_DELAY_ON' if _duration else 'RAIN_DELAY_OFF', endTime=_device['rainDelayExpirationDate'])
+            else:
+                _device['status'] = 'OFFLINE' if _device['status'] == 'ONLINE' else 'ONLINE'
+                self.sendEvent(_device['id'], 'DEVICE_STATUS', _device['status'])
+
+    def generateEvents(self, rate, stop):
+        #Emits "rate" random events per second until the "stop" event is set
+        _interval = 1. / rate
+        _next = time.time()
+        while not stop.is_set():
+            self.randomEvent()
+            _next += _interval
+            stop.wait(max(_next - time.time(), 0))
+
+
+EVENT_TYPE_NAMES = {'5': 'DEVICE_STATUS_EVENT', '6': 'RAIN_DELAY_EVENT', '7': 'WEATHER_INTELLIGENCE_EVENT', '8': 'WATER_BUDGET',
+                    '9': 'SCHEDULE_STATUS_EVENT', '10': 'ZONE_STATUS_EVENT', '11': 'RAIN_SENSOR_DETECTION_EVENT', '12': 'ZONE_DELTA', '14': 'DELTA'}
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' #keep-alive, like the real API
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        LOGGER.debug(format, *args)
+
+    def _respond(self, status, headers, payload):
+        _body = b'' if payload is None else json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if payload is not None:
+            self.send_header('Content-Type', 'application/json;charset=UTF-8')
+        self.send_header('Content-Length', str(len(_body)))
+        self.end_headers()
+        self.wfile.write(_body)
+
+    def _handle(self, method):
+        _length = int(self.headers.get('Content-Length') or 0)
+        _body = self.rfile.read(_length) if _length else b''
+        if self.path.startswith('/_sim/stats'):
+            return self._respond(200, {}, self.server.simulator.stats())
+        try:
+            _json = json.loads(_body.decode('utf-8')) if _body else {}
+        except ValueError:
+            return self._respond(400, {}, {'error': 'Invalid JSON'})
+        _status, _headers, _payload = self.server.simulator.handle(method, self.path, self.headers.get('Authorization', ''), _json)
+        self._respond(_status, _headers, _payload)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+class SimulatorServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, simulator):
+        HTTPServer.__init__(self, address, SimulatorHandler)
+        self.simulator = simulator
+
+    @property
+    def url(self):
+        return 'http://%s:%i/1/public' % (self.server_address[0], self.server_address[1])
+
+
+def startSimulator(simulator, host='127.0.0.1', port=0):
+    #Serves "simulator" on a background thread and returns the server (server.url is the API base URL)
+    _server = SimulatorServer((host, port), simulator)
+    threading.Thread(target=_server.serve_forever, name='rachio-simulator', daemon=True).start()
+    return _server
+
+
+def main():
+    _parser = argparse.ArgumentParser(description='Local Rachio cloud API simulator for offline load testing of the Rachio NodeServer')
+    _parser.add_argument('--host', default='0.0.0.0')
+    _parser.add_argument('--port', type=int, default=8080)
+    _parser.add_argument('--controllers', type=int, default=1, help='number of controllers in the synthetic account')
+    _parser.add_argument('--zones', type=int, default=8, help='zones per controller')
+    _parser.add_argument('--schedules', type=int, default=2, help='schedule rules per controller')
+    _parser.add_argument('--flex-schedules', type=int, default=1, help='flex schedule rules per controller')
+    _parser.add_argument('--limit', type=int, default=1700, help='daily API request budget per API key')
+    _parser.add_argument('--latency', type=float, default=0.1, help='seconds added to every response')
+    _parser.add_argument('--jitter', type=float, default=0.05, help='random extra latency, up to this many seconds')
+    _parser.add_argument('--throttle-rate', type=float, default=0., help='fraction of requests answered with HTTP 429')
+    _parser.add_argument('--time-scale', type=float, default=60., help='zone runs finish duration/TIME_SCALE seconds after starting')
+    _parser.add_argument('--webhook-rate', type=float, default=0., help='synthetic webhook events per second')
+    _parser.add_argument('--webhook-url', default=None, help='push webhooks here instead of to the URLs registered through the API')
+    _parser.add_argument('--seed', type=int, default=1)
+    _parser.add_argument('--debug', action='store_true')
+    _args = _parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if _args.debug else logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    _account = SimulatedAccount(_args.controllers, _args.zones, _args.schedules, _args.flex_schedules, _args.seed)
+    _simulator = RachioSimulator(_account, _args.limit, _args.latency, _args.jitter, _args.throttle_rate, _args.time_scale, _args.webhook_url, _args.seed)
+    _server = startSimulator(_simulator, _args.host, _args.port)
+    LOGGER.info('Simulating %i controller(s) with %i zone(s) each at %s', _args.controllers, _args.zones, _server.url)
+    _stop = threading.Event()
+    if _args.webhook_rate > 0:
+        threading.Thread(target=_simulator.generateEvents, args=(_args.webhook_rate, _stop), daemon=True).start()
+    try:
+        while True:
+            time.sleep(60)
+            LOGGER.info('Simulator stats: %s', json.dumps(_simulator.stats()))
+    except KeyboardInterrupt:
+        _stop.set()
+        _server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,24 @@
+"""
+Loads rachio-poly.py for the unit tests the same way benchmark.py does, with polyinterface replaced by the
+benchmark's Polyglot stub.  Run the tests from the repository root with
+    python3 -m pytest tests
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import benchmark
+
+rachio = benchmark.loadNodeServer()
+
+
+def waitUntil(predicate, timeout=5.):
+    #Polls predicate() until it returns True or timeout seconds pass, returns its last result
+    _deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > _deadline:
+            return False
+        time.sleep(0.005)
+    return True
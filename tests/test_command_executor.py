@@ -0,0 +1,100 @@
+import threading
+import time
+import unittest
+
+from support import rachio, waitUntil
+
+
+class Command(object):
+    #Callable standing in for a Rachio API command, failing the first "failures" calls with "error"
+    def __init__(self, failures=0, error=IOError):
+        self.failures = failures
+        self.error = error
+        self.calls = []
+
+    def __call__(self):
+        self.calls.append(time.time())
+        if len(self.calls) <= self.failures:
+            raise self.error('simulated failure %i' % len(self.calls))
+
+
+class CommandExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.statuses = []
+        self.done = threading.Event()
+
+    def onStatus(self, device_id, status):
+        self.statuses.append((device_id, status))
+        if status != rachio.CommandExecutor.PENDING:
+            self.done.set()
+
+    def executor(self, **kwargs):
+        kwargs.setdefault('onStatus', self.onStatus)
+        return rachio.CommandExecutor(**kwargs)
+
+    def test_duplicate_within_window_is_dropped(self):
+        _executor = self.executor(dedupeWindow=60.)
+        _command = Command()
+        self.assertTrue(_executor.submit('d1', ('z1', 'START', 5), 'Start zone 1', _command))
+        self.assertFalse(_executor.submit('d1', ('z1', 'START', 5), 'Start zone 1', _command))
+        self.assertTrue(_executor.submit('d1', ('z1', 'START', 10), 'Start zone 1 for 10 minutes', _command))
+        self.assertTrue(waitUntil(lambda: _executor.stats()['succeeded'] == 2))
+        self.assertEqual(len(_command.calls), 2)
+        _stats = _executor.stats()
+        self.assertEqual((_stats['submitted'], _stats['collapsed']), (2, 1))
+
+    def test_duplicate_after_window_runs_again(self):
+        _executor = self.executor(dedupeWindow=0.05)
+        _command = Command()
+        self.assertTrue(_executor.submit('d1', 'key', 'Command', _command))
+        time.sleep(0.1)
+        self.assertTrue(_executor.submit('d1', 'key', 'Command', _command))
+        self.assertTrue(waitUntil(lambda: len(_command.calls) == 2))
+        self.assertEqual(_executor.stats()['collapsed'], 0)
+
+    def test_failure_is_retried_with_backoff(self):
+        _executor = self.executor(retries=3, backoff=0.02)
+        _command = Command(failures=2)
+        _executor.submit('d1', 'key', 'Command', _command)
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(self.statuses, [('d1', rachio.CommandExecutor.PENDING), ('d1', rachio.CommandExecutor.SUCCEEDED)])
+        self.assertEqual(len(_command.calls), 3)
+        #Delays are backoff * 2^attempt, jittered by 0.5-1.5x
+        _delays = [b - a for a, b in zip(_command.calls, _command.calls[1:])]
+        self.assertGreaterEqual(_delays[0], 0.02 * 0.5)
+        self.assertGreaterEqual(_delays[1], 0.04 * 0.5)
+        _stats = _executor.stats()
+        self.assertEqual((_stats['retried'], _stats['succeeded'], _stats['failed']), (2, 1, 0))
+
+    def test_failure_after_last_retry(self):
+        _executor = self.executor(retries=2, backoff=0.001)
+        _command = Command(failures=10)
+        _executor.submit('d1', 'key', 'Command', _command)
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(self.statuses[-1], ('d1', rachio.CommandExecutor.FAILED))
+        self.assertEqual(len(_command.calls), 3)
+        self.assertEqual(_executor.stats()['failed'], 1)
+
+    def test_rejected_command_is_not_retried(self):
+        _executor = self.executor(retries=3, backoff=0.001)
+        _command = Command(failures=1, error=rachio.CommandRejected)
+        _executor.submit('d1', 'key', 'Command', _command)
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(self.statuses[-1], ('d1', rachio.CommandExecutor.FAILED))
+        self.assertEqual(len(_command.calls), 1)
+        self.assertEqual(_executor.stats()['retried'], 0)
+
+    def test_commands_for_one_device_run_in_order(self):
+        _executor = self.executor(workers=4)
+        _order = []
+        _release = threading.Event()
+        _executor.submit('d1', 1, 'First', lambda: (_release.wait(5), _order.append(1)))
+        _executor.submit('d1', 2, 'Second', lambda: _order.append(2))
+        _executor.submit('d2', 3, 'Other device', lambda: _order.append(3))
+        self.assertTrue(waitUntil(lambda: _order == [3])) #d2 isn't held up by d1's first command
+        _release.set()
+        self.assertTrue(waitUntil(lambda: _order == [3, 1, 2]))
+
+
+if __name__ == '__main__':
+    unittest.main()
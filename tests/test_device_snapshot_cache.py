@@ -0,0 +1,97 @@
+import threading
+import time
+import unittest
+
+from support import rachio, waitUntil
+
+
+class Fetch(object):
+    #Stands in for the device.get/getCurrentSchedule pair, blocking until released so callers pile up behind it
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+            _call = self.calls
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return {'id': 'd1', 'name': 'Fetch %i' % _call, 'zones': [{'id': 'z1', 'zoneNumber': 1}]}, {'status': 'IDLE'}
+
+
+class DeviceSnapshotCacheTest(unittest.TestCase):
+    def getConcurrently(self, cache, callers, **kwargs):
+        _results = [None] * callers
+        def _get(i):
+            _results[i] = cache.get(**kwargs)
+        _threads = [threading.Thread(target=_get, args=(i,)) for i in range(callers)]
+        for _thread in _threads:
+            _thread.start()
+        return _threads, _results
+
+    def test_concurrent_callers_share_one_fetch(self):
+        _fetch = Fetch()
+        _cache = rachio.DeviceSnapshotCache('d1', _fetch, refreshInterval=0)
+        _threads, _results = self.getConcurrently(_cache, 8, force=True)
+        self.assertTrue(waitUntil(lambda: _cache.waits == 7)) #one leader fetching, seven callers waiting on it
+        self.assertEqual(_fetch.calls, 1)
+        _fetch.release.set()
+        for _thread in _threads:
+            _thread.join(5)
+        self.assertEqual(_fetch.calls, 1)
+        self.assertEqual(_cache.stats()['misses'], 1)
+        for _device, _schedule in _results:
+            self.assertEqual(_device['name'], 'Fetch 1')
+            self.assertEqual(_schedule, {'status': 'IDLE'})
+        self.assertIn('z1', _cache.zones)
+
+    def test_fresh_snapshot_is_served_from_cache(self):
+        _fetch = Fetch()
+        _fetch.release.set()
+        _cache = rachio.DeviceSnapshotCache('d1', _fetch, refreshInterval=60)
+        _cache.get(force=True)
+        _device, _schedule = _cache.get(force=True) #within refreshInterval of the last fetch
+        self.assertEqual((_fetch.calls, _cache.hits), (1, 1))
+        self.assertEqual(_device['name'], 'Fetch 1')
+
+    def test_change_after_fetch_started_fetches_again(self):
+        _fetch = Fetch()
+        _cache = rachio.DeviceSnapshotCache('d1', _fetch, refreshInterval=60)
+        _threads, _results = self.getConcurrently(_cache, 1, force=True)
+        self.assertTrue(waitUntil(lambda: _fetch.calls == 1))
+        #A webhook arriving after the in-flight fetch started needs a snapshot fetched after it
+        time.sleep(0.01)
+        _since = time.time()
+        _later, _laterResults = self.getConcurrently(_cache, 3, since=_since)
+        self.assertTrue(waitUntil(lambda: _cache.waits == 3))
+        _fetch.release.set()
+        for _thread in _threads + _later:
+            _thread.join(5)
+        self.assertEqual(_fetch.calls, 2) #the three late callers share the second fetch
+        self.assertEqual(_results[0][0]['name'], 'Fetch 1')
+        for _device, _schedule in _laterResults:
+            self.assertEqual(_device['name'], 'Fetch 2')
+
+    def test_failed_fetch_releases_waiters(self):
+        _fetch = Fetch(error=IOError('simulated failure'))
+        _cache = rachio.DeviceSnapshotCache('d1', _fetch, device={'id': 'd1', 'name': 'Saved'}, refreshInterval=0)
+        _threads, _results = self.getConcurrently(_cache, 4, force=True)
+        self.assertTrue(waitUntil(lambda: _cache.waits == 3))
+        _fetch.release.set()
+        for _thread in _threads:
+            _thread.join(5)
+            self.assertFalse(_thread.is_alive())
+        self.assertEqual(_fetch.calls, 1)
+        for _device, _schedule in _results:
+            self.assertEqual(_device['name'], 'Saved') #the previous snapshot is kept
+        #The next request tries again
+        _fetch.error = None
+        self.assertEqual(_cache.get(force=True)[0]['name'], 'Fetch 2')
+
+
+if __name__ == '__main__':
+    unittest.main()
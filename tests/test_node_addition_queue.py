@@ -0,0 +1,90 @@
+import threading
+import unittest
+
+from support import rachio, waitUntil
+
+
+class Node(object):
+    def __init__(self, address, primary=None):
+        self.address = address
+        self.primary = primary if primary is not None else address
+        self.name = address
+
+
+class Polyglot(object):
+    #Records added nodes and acknowledges them straight away unless "ack" is False or the address is in "ignore"
+    def __init__(self, ack=True, ignore=()):
+        self.ack = ack
+        self.ignore = set(ignore)
+        self.added = []
+        self.queue = None
+        self._lock = threading.Lock()
+
+    def addNode(self, node):
+        with self._lock:
+            self.added.append(node.address)
+        if self.ack and node.address not in self.ignore:
+            self.queue.acknowledged(node.address)
+
+
+class NodeAdditionQueueTest(unittest.TestCase):
+    def additionQueue(self, polyglot, **kwargs):
+        kwargs.setdefault('interval', 0)
+        polyglot.queue = rachio.NodeAdditionQueue(polyglot.addNode, **kwargs)
+        return polyglot.queue
+
+    def test_acknowledged_batches_grow(self):
+        _polyglot = Polyglot()
+        _queue = self.additionQueue(_polyglot, maxBatch=4)
+        for i in range(10):
+            _queue.put(Node('n%i' % i))
+        self.assertTrue(waitUntil(lambda: _queue.stats()['batches'] == 4)) #batches of 1, 2, 4 and 3
+        self.assertEqual(_polyglot.added, ['n%i' % i for i in range(10)])
+        _stats = _queue.stats()
+        self.assertEqual((_stats['added'], _stats['queued'], _stats['failed'], _stats['batchSize']), (10, 0, 0, 4))
+
+    def test_unacknowledged_batch_times_out(self):
+        _polyglot = Polyglot(ignore=['n1'])
+        _queue = self.additionQueue(_polyglot, maxBatch=4, ackTimeout=0.2)
+        _queue.put(Node('n0'))
+        self.assertTrue(waitUntil(lambda: _queue.stats()['batchSize'] == 2)) #n0 acknowledged, batch size doubled
+        _queue.put(Node('n1'))
+        self.assertTrue(_queue.contains('n1'))
+        self.assertTrue(waitUntil(lambda: _queue.stats()['failed'] == 1))
+        _stats = _queue.stats()
+        self.assertEqual((_stats['added'], _stats['queued'], _stats['batchSize']), (1, 0, 1)) #batch size halved
+        self.assertFalse(_queue.contains('n1'))
+        #The worker moves on to the next batch
+        _queue.put(Node('n2'))
+        self.assertTrue(waitUntil(lambda: _queue.stats()['added'] == 2))
+        #A late acknowledgement still counts the node as added
+        self.assertTrue(_queue.acknowledged('n1'))
+        _stats = _queue.stats()
+        self.assertEqual((_stats['added'], _stats['failed']), (3, 0))
+        self.assertFalse(_queue.acknowledged('n1'))
+
+    def test_child_waits_for_its_primary(self):
+        _polyglot = Polyglot(ack=False)
+        _queue = self.additionQueue(_polyglot, maxBatch=8)
+        _queue.put(Node('c1', 'p1'))
+        _queue.put(Node('p1'))
+        self.assertTrue(waitUntil(lambda: _polyglot.added == ['p1']))
+        self.assertFalse(waitUntil(lambda: len(_polyglot.added) > 1, 0.2)) #held back until p1 is acknowledged
+        _queue.acknowledged('p1')
+        self.assertTrue(waitUntil(lambda: _polyglot.added == ['p1', 'c1']))
+        _queue.acknowledged('c1')
+        self.assertTrue(waitUntil(lambda: _queue.stats()['added'] == 2))
+
+    def test_node_in_flight_is_not_queued_again(self):
+        _polyglot = Polyglot(ack=False)
+        _queue = self.additionQueue(_polyglot)
+        self.assertTrue(_queue.put(Node('n0')))
+        self.assertTrue(waitUntil(lambda: _polyglot.added == ['n0']))
+        self.assertFalse(_queue.put(Node('n0')))
+        _queue.acknowledged('n0')
+        self.assertTrue(waitUntil(lambda: _queue.stats()['added'] == 1))
+        self.assertEqual(_polyglot.added, ['n0'])
+
+
+if __name__ == '__main__':
+    unittest.main()